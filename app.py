@@ -1,43 +1,336 @@
+import asyncio
+import os
 
-# Usage
+import gradio as gr
+
+from conversation_context import ConversationContext
 from fantasy_game_master import FantasyGameMaster
 from fantasy_world_generator import FantasyWorldGenerator
-from helper import get_game_state, get_together_api_key, is_safe, run_action, start_game
-
-world_json_path = './GeneratedWorld.json'
-
-def main_loop(message, history):
-    # Retrieve the game state with predefined inventory
-    game_state = get_game_state(
-        inventory={
-            "cloth pants": 1,
-            "cloth shirt": 1,
-            "goggles": 1,
-            "leather bound journal": 1,
-            "gold": 5,
-        }
-    )
-
-    output = run_action(message, history, game_state)
-    
-    # Check if the output is safe
-    if not is_safe(output):
-        return "Invalid Output"
+from helper import (
+    complete_sentences_end, get_game_state, run_action, run_action_async,
+    sentences_to_check, start_game, stream_action, stream_action_async
+)
+from config import get_setting, get_together_api_key
+from instrumentation import traced
+from lore_index import LoreIndex
+from opening_scenes import OpeningScenePool
+from session_store import SessionStore
+from speculation import SessionSpeculation, Speculator
+from structured_turn import NarrationReader
+from transcripts import TranscriptRecorder, TurnRecording
+from turn_pipeline import INVALID_OUTPUT, TurnPipeline, read_structured_turn
+from world_store import migrate_json, open_world_store
+
+legacy_world_path = './GeneratedWorld.json'
+world_path = './GeneratedWorld.db'
+world_stores = {}
+
+def get_world_store():
+    # One store shared by every session; nodes are read from it on demand.
+    if world_path not in world_stores:
+        if not os.path.exists(world_path) and os.path.exists(legacy_world_path):
+            migrate_json(legacy_world_path, world_path)
+        world_stores[world_path] = open_world_store(world_path)
+    return world_stores[world_path]
+
+# Opening scenes kept per character. With OPENING_SCENE_REFRESH=1 each scene
+# a session starts with is replaced by a new one in the background.
+scenes_per_character = int(get_setting("OPENING_SCENES_PER_CHARACTER", "1"))
+refresh_opening_scenes = get_setting("OPENING_SCENE_REFRESH", "0").lower() in ("1", "true", "yes")
+scene_pools = {}
+
+def get_scene_pool():
+    if world_path not in scene_pools:
+        game_master = FantasyGameMaster(api_key=get_together_api_key(), world_path=world_path, output_path=world_path, store=get_world_store())
+        scene_pools[world_path] = OpeningScenePool(game_master, per_character=scenes_per_character, refresh=refresh_opening_scenes)
+    return scene_pools[world_path]
+
+# World lore relevant to each turn is added to the prompt, up to this many tokens.
+lore_token_budget = int(get_setting("LORE_TOKEN_BUDGET", "256"))
+lore_indexes = {}
+
+def get_lore_index():
+    # Built once per world and kept up to date as the store changes.
+    if world_path not in lore_indexes:
+        lore_indexes[world_path] = LoreIndex.from_store(get_world_store())
+    return lore_indexes[world_path]
+
+# With SPECULATIVE_ACTIONS=1 the likely next actions are generated while the
+# player reads, up to SPECULATION_TOKEN_BUDGET tokens per session.
+speculator = None
+if get_setting("SPECULATIVE_ACTIONS", "0").lower() in ("1", "true", "yes"):
+    speculator = Speculator(token_budget=int(get_setting("SPECULATION_TOKEN_BUDGET", "20000")))
+
+# With STRUCTURED_TURNS=1 the narration and the inventory changes come from
+# one model call (see structured_turn) instead of two.
+structured_turns = get_setting("STRUCTURED_TURNS", "0").lower() in ("1", "true", "yes")
 
-    # Detect and update inventory
-    game_master = FantasyGameMaster(api_key=get_together_api_key(), world_path=world_json_path, output_path=world_json_path)
-    update_msg = game_master.process_inventory_updates(game_state, output)
-    output += update_msg
+# With INVENTORY_PREFILTER=1, narrations that can't plausibly change the
+# inventory skip the detection call (see inventory_filter).
+inventory_prefilter = get_setting("INVENTORY_PREFILTER", "0").lower() in ("1", "true", "yes")
 
+# With TRANSCRIPT_PATH set, every turn is appended to an anonymized
+# transcript there, which benchmarks/replay_transcripts can play back.
+transcript_path = get_setting("TRANSCRIPT_PATH")
+transcripts = TranscriptRecorder(transcript_path) if transcript_path else None
+
+def record_turn(session_id, message, history, game_state):
+    return TurnRecording(transcripts, session_id, message, history, game_state)
+
+def take_speculation(session, message, history):
+    """The speculation on this turn's message, or None."""
+    if speculator is None or message == 'start game':
+        return None
+    return speculator.take(session["speculation"], message, history, session["game_state"])
+
+def adopt_speculation(session, result):
+    output, context = result
+    # The speculative turn continued from the session's context.
+    session["context"] = context
     return output
 
+async def speculated_output_async(session, message, history):
+    """The speculated response to this turn's message, or None."""
+    speculation = take_speculation(session, message, history)
+    if speculation is None:
+        return None
+    try:
+        result = await asyncio.wrap_future(speculation.future)
+    except Exception:
+        return None
+    return adopt_speculation(session, result)
+
+def prefetch_next(session, message, history, output):
+    if speculator is not None:
+        speculator.prefetch(session["speculation"], [*history, [message, output]], session["game_state"], session["context"])
+
+def default_inventory():
+    return {
+        "cloth pants": 1,
+        "cloth shirt": 1,
+        "goggles": 1,
+        "leather bound journal": 1,
+        "gold": 5,
+    }
+
+@traced("new_session")
+def new_session():
+    # Built once per player: the character stays the same between turns
+    store = get_world_store()
+    game_master = FantasyGameMaster(api_key=get_together_api_key(), world_path=world_path, output_path=world_path,
+                                    prefilter=inventory_prefilter, store=store)
+    # The opening scene comes precomputed from the store; no model call here.
+    game_state = get_game_state(inventory=default_inventory(), world=store)
+    get_scene_pool().used(start=game_state["start"], **game_state["location"])
+    context = ConversationContext(lore=get_lore_index(), lore_budget=lore_token_budget)
+    return {"game_state": game_state, "game_master": game_master, "context": context, "speculation": SessionSpeculation()}
+
+sessions = SessionStore(new_session, sizeof=lambda session: len(str(session["game_state"])))
+# Each turn served at once (CONCURRENCY_LIMIT, see helper.start_game) may
+# have an inventory detection and a streamed safety check on the pipeline's
+# workers; threads are only started as they are needed.
+pipeline = TurnPipeline(max_workers=2 * int(get_setting("CONCURRENCY_LIMIT", "64")))
+
+@traced("turn")
+def main_loop(message, history, request: gr.Request = None):
+    session_id = request.session_hash if request is not None else None
+    session = sessions.get(session_id)
+    game_state = session["game_state"]
+    turn = record_turn(session_id, message, history, game_state)
+
+    speculation = take_speculation(session, message, history)
+    if speculation is not None and speculation.succeeded():
+        output = adopt_speculation(session, speculation.result())
+        result = pipeline.post_process(game_state, session["game_master"], output)
+    elif structured_turns:
+        result = pipeline.run_structured(message, history, game_state, session["game_master"], session["context"])
+    else:
+        # Generate, then check safety and detect inventory changes concurrently
+        result = pipeline.run(message, history, game_state, session["game_master"], session["context"])
+    sessions.refresh_size(session_id)
+    prefetch_next(session, message, history, result["output"])
+    turn.finish(result)
+
+    return result["output"]
+
+@traced("turn")
+def main_loop_stream(message, history, request: gr.Request = None):
+    """
+    Streaming version of main_loop. The response is shown as it is
+    generated, while newly completed sentences are safety checked in the
+    background, with a little of the text before them. If a check fails
+    the response is replaced with "Invalid Output". Once the response is
+    complete it is checked as a whole, and inventory updates are appended
+    when it is safe; that check and inventory detection run concurrently.
+    """
+    session_id = request.session_hash if request is not None else None
+    session = sessions.get(session_id)
+    game_state = session["game_state"]
+    turn = record_turn(session_id, message, history, game_state)
+
+    speculation = take_speculation(session, message, history)
+    if speculation is not None and speculation.succeeded():
+        output = adopt_speculation(session, speculation.result())
+        result = pipeline.post_process(game_state, session["game_master"], output)
+        sessions.refresh_size(session_id)
+        prefetch_next(session, message, history, result["output"])
+        turn.finish(result)
+        yield result["output"]
+        return
+
+    output = checked = ""
+    checked_end = 0
+    checks = []
+    # A structured turn streams JSON; only its narration is shown.
+    reader = NarrationReader() if structured_turns else None
+
+    def unsafe():
+        return any(check.done() and not check.result() for check in checks)
+
+    for token in stream_action(message, history, game_state, session["context"], structured=structured_turns):
+        if reader is not None:
+            narration = reader.feed(token)
+            if narration == output:
+                continue
+            output = narration
+        else:
+            output += token
+        sentences_end = complete_sentences_end(output)
+        if sentences_end > checked_end:
+            checked = sentences_to_check(output, checked_end, sentences_end)
+            checks.append(pipeline.submit_safety_check(checked))
+            checked_end = sentences_end
+        if unsafe():
+            turn.finish({"output": INVALID_OUTPUT, "safe": False})
+            yield INVALID_OUTPUT
+            return
+        yield output
+
+    streamed = output
+    item_updates = None
+    if reader is not None:
+        narration, item_updates = read_structured_turn(reader.text)
+        if narration is None or narration != output.strip():
+            # What was shown isn't the final narration; check all of it.
+            output = narration or run_action(message, history, game_state, session["context"])
+            checked = ""
+
+    if checked.rstrip() != output.rstrip():
+        checks.append(pipeline.submit_safety_check(output))
+    result = pipeline.post_process(game_state, session["game_master"], output, safety_checks=checks,
+                                   item_updates=item_updates)
+    sessions.refresh_size(session_id)
+    prefetch_next(session, message, history, result["output"])
+    turn.finish(result)
+    if result["output"] != streamed:
+        yield result["output"]
+
+@traced("turn")
+async def main_loop_async(message, history, request: gr.Request = None):
+    """
+    main_loop on the async client. A turn waiting on the model holds no
+    thread, so one process can serve many more players at once.
+    """
+    session_id = request.session_hash if request is not None else None
+    session = sessions.get(session_id)
+    turn = record_turn(session_id, message, history, session["game_state"])
+
+    output = await speculated_output_async(session, message, history)
+    if output is not None:
+        result = await pipeline.post_process_async(session["game_state"], session["game_master"], output)
+    elif structured_turns:
+        result = await pipeline.run_structured_async(
+            message, history, session["game_state"], session["game_master"], session["context"]
+        )
+    else:
+        result = await pipeline.run_async(message, history, session["game_state"], session["game_master"], session["context"])
+    sessions.refresh_size(session_id)
+    prefetch_next(session, message, history, result["output"])
+    turn.finish(result)
+
+    return result["output"]
+
+@traced("turn")
+async def main_loop_stream_async(message, history, request: gr.Request = None):
+    """main_loop_stream on the async client."""
+    session_id = request.session_hash if request is not None else None
+    session = sessions.get(session_id)
+    game_state = session["game_state"]
+    turn = record_turn(session_id, message, history, game_state)
+
+    output = await speculated_output_async(session, message, history)
+    if output is not None:
+        result = await pipeline.post_process_async(game_state, session["game_master"], output)
+        sessions.refresh_size(session_id)
+        prefetch_next(session, message, history, result["output"])
+        turn.finish(result)
+        yield result["output"]
+        return
+
+    output = checked = ""
+    checked_end = 0
+    checks = []
+    reader = NarrationReader() if structured_turns else None
+
+    def unsafe():
+        return any(check.done() and not check.result() for check in checks)
+
+    async for token in stream_action_async(message, history, game_state, session["context"], structured=structured_turns):
+        if reader is not None:
+            narration = reader.feed(token)
+            if narration == output:
+                continue
+            output = narration
+        else:
+            output += token
+        sentences_end = complete_sentences_end(output)
+        if sentences_end > checked_end:
+            checked = sentences_to_check(output, checked_end, sentences_end)
+            checks.append(pipeline.submit_safety_check_async(checked))
+            checked_end = sentences_end
+        if unsafe():
+            for check in checks:
+                check.cancel()
+            turn.finish({"output": INVALID_OUTPUT, "safe": False})
+            yield INVALID_OUTPUT
+            return
+        yield output
+
+    streamed = output
+    item_updates = None
+    if reader is not None:
+        narration, item_updates = read_structured_turn(reader.text)
+        if narration is None or narration != output.strip():
+            output = narration or await run_action_async(message, history, game_state, session["context"])
+            checked = ""
+
+    if checked.rstrip() != output.rstrip():
+        checks.append(pipeline.submit_safety_check_async(output))
+    result = await pipeline.post_process_async(game_state, session["game_master"], output, safety_checks=checks,
+                                               item_updates=item_updates)
+    sessions.refresh_size(session_id)
+    prefetch_next(session, message, history, result["output"])
+    turn.finish(result)
+    if result["output"] != streamed:
+        yield result["output"]
+
+stream_responses = True
+async_handlers = True
+
+def select_main_loop():
+    if async_handlers:
+        return main_loop_stream_async if stream_responses else main_loop_async
+    return main_loop_stream if stream_responses else main_loop
+
 if __name__ == "__main__":
     api_key = get_together_api_key()
     
     generator = FantasyWorldGenerator(api_key=api_key)
-    generator.generate(world_json_path)
+    generator.generate(world_path)
 
-    game_master = FantasyGameMaster(api_key, world_json_path, world_json_path)
+    game_master = FantasyGameMaster(api_key, world_path, world_path, store=get_world_store())
     game_master.initialize_game()
+    # An opening scene for every character, so sessions start instantly.
+    get_scene_pool().fill()
 
-    start_game(main_loop, True)
\ No newline at end of file
+    start_game(select_main_loop(), True)
@@ -0,0 +1,108 @@
+"""
+Concurrent players one process can serve with the synchronous main_loop
+versus main_loop_async, against the local mock Together server.
+
+Gradio runs a synchronous handler on one of its worker threads (40 by
+default) for the whole turn, while async handlers share the event loop.
+Both are driven here the way Gradio drives them. For each number of
+players, every player plays a few turns back to back; capacity is the
+largest number of players whose p95 turn latency stays within --slo times
+the single-player p95.
+
+Usage: python -m benchmarks.bench_async_capacity [--players 1,16,64,128,256] [--latency 0.3]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from benchmarks.mock_together_server import LatencyModel, MockTogetherServer
+from benchmarks.run_benchmarks import ACTIONS, configure_client, summarize
+from benchmarks.stub_world import make_world
+from llm_client import close_async_sessions
+
+# Gradio's default number of worker threads for synchronous handlers.
+GRADIO_THREADS = 40
+
+
+async def play(handler, player, turns, run):
+    request = SimpleNamespace(session_hash=f"capacity-{player}-{time.monotonic_ns()}")
+    history, latencies = [], []
+    for turn in range(turns):
+        # Skip "start game", which doesn't call the model.
+        message = ACTIONS[1 + turn % (len(ACTIONS) - 1)]
+        start = time.perf_counter()
+        output = await run(handler, message, history, request)
+        latencies.append(time.perf_counter() - start)
+        history.append([message, output])
+    return latencies
+
+
+async def load(handler, players, turns):
+    if asyncio.iscoroutinefunction(handler):
+        async def run(handler, *args):
+            return await handler(*args)
+        executor = None
+    else:
+        executor = ThreadPoolExecutor(max_workers=GRADIO_THREADS)
+        loop = asyncio.get_running_loop()
+
+        async def run(handler, *args):
+            return await loop.run_in_executor(executor, handler, *args)
+
+    start = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(play(handler, player, turns, run) for player in range(players)))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        await close_async_sessions()
+    elapsed = time.perf_counter() - start
+    latencies = [latency for result in results for latency in result]
+    return {"turns_per_second": len(latencies) / elapsed, "latency": summarize(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--players", default="1,16,64,128,256")
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.3, help="time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--slo", type=float, default=1.5,
+                        help="allowed p95 latency as a multiple of the single-player p95")
+    args = parser.parse_args()
+    counts = [int(count) for count in args.players.split(",")]
+
+    # Measure the handlers, not the admission limits.
+    os.environ["LLM_MAX_CONCURRENCY"] = str(4 * max(counts))
+    server = MockTogetherServer(latency=LatencyModel(args.latency), tokens_per_second=args.tokens_per_second)
+    with server, tempfile.TemporaryDirectory() as tmp:
+        configure_client(server)
+        from world_store import save_world
+
+        world_path = os.path.join(tmp, "world.db")
+        save_world(make_world(), world_path)
+
+        import app
+
+        app.world_path = world_path
+        print(f"{'handler':>8} {'players':>7} {'turns/s':>8} {'p50 ms':>7} {'p95 ms':>7}")
+        for name, handler in (("sync", app.main_loop), ("async", app.main_loop_async)):
+            baseline = None
+            capacity = 0
+            for players in counts:
+                result = asyncio.run(load(handler, players, args.turns))
+                latency = result["latency"]
+                baseline = baseline or latency["p95"]
+                if latency["p95"] <= args.slo * baseline:
+                    capacity = players
+                print(f"{name:>8} {players:7} {result['turns_per_second']:8.1f} "
+                      f"{latency['p50'] * 1000:7.0f} {latency['p95'] * 1000:7.0f}")
+            print(f"{name:>8} capacity: {capacity} players within {args.slo}x single-player p95")
+
+
+if __name__ == "__main__":
+    main()
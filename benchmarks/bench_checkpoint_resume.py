@@ -0,0 +1,77 @@
+"""
+Checkpointed world generation and scheduler retries, against the stub client.
+
+First a generation is cut off by an outage partway through and then
+resumed from its checkpoint, counting the calls the resume saves over
+starting again. Then a world is generated while a share of calls fail with
+rate-limit errors, which the request scheduler retries.
+
+Usage: python -m benchmarks.bench_checkpoint_resume [fail_after_calls]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_world_sizes import count_entities
+from benchmarks.stub_client import StubTogether
+from fantasy_world_generator import FantasyWorldGenerator
+from request_scheduler import RequestScheduler, ScheduledClient
+
+SIZE = dict(kingdoms=5, towns=5, npcs=5)
+
+
+def make_generator(client):
+    generator = FantasyWorldGenerator(api_key="stub", **SIZE)
+    generator.client = client
+    return generator
+
+
+def fresh(output_path):
+    generator = make_generator(StubTogether(latency=0.02, token_delay=0))
+    world = generator.generate(output_path)
+    return generator.client.calls, world
+
+
+def interrupted_then_resumed(output_path, fail_after):
+    generator = make_generator(StubTogether(latency=0.02, token_delay=0, fail_after=fail_after))
+    try:
+        generator.generate(output_path)
+    except Exception as exc:
+        print(f"interrupted: {type(exc).__name__} after {generator.client.calls} calls")
+    else:
+        raise AssertionError("generation was expected to fail")
+    assert os.path.exists(output_path + ".checkpoint.db")
+    generator = make_generator(StubTogether(latency=0.02, token_delay=0))
+    world = generator.generate(output_path)
+    assert not os.path.exists(output_path + ".checkpoint.db")
+    return generator.client.calls, world
+
+
+def with_rate_limits(output_path, error_rate):
+    stub = StubTogether(latency=0.02, token_delay=0, error_rate=error_rate)
+    scheduler = RequestScheduler(max_concurrent=4, max_retries=8, base_delay=0.01, max_delay=0.2)
+    generator = make_generator(ScheduledClient(stub, scheduler))
+    start = time.perf_counter()
+    world = generator.generate(output_path)
+    return stub, scheduler, world, time.perf_counter() - start
+
+
+def main(fail_after=20):
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = os.path.join(tmp, "world.json")
+        full_calls, world = fresh(output_path)
+        entities = count_entities(world)
+        resume_calls, resumed = interrupted_then_resumed(output_path, fail_after)
+        assert count_entities(resumed) == entities
+        print(f"fresh:   {full_calls} calls for {entities} entities")
+        print(f"resume:  {resume_calls} calls ({full_calls - resume_calls} saved by the checkpoint)")
+
+        stub, scheduler, world, elapsed = with_rate_limits(output_path, error_rate=0.3)
+        assert count_entities(world) == entities
+        print(f"retries: {stub.errors} rate-limit errors, {scheduler.retries} retries, "
+              f"{stub.calls} successful calls in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,52 @@
+"""
+Per-turn client setup cost: building a fresh Together client (and reloading
+.env) for every call versus reusing the shared client from llm_client.
+
+A turn used to construct three clients: one each in run_action and
+is_safe, and one in a new FantasyGameMaster.
+
+Usage: python -m benchmarks.bench_client_overhead [turns]
+"""
+import os
+import sys
+import time
+
+from together import Together
+
+from config import get_together_api_key, load_env
+from llm_client import get_client
+
+CLIENTS_PER_TURN = 3
+
+
+def per_turn_rebuild():
+    for _ in range(CLIENTS_PER_TURN):
+        load_env()
+        Together(api_key=os.getenv("TOGETHER_AI_API_KEY"))
+
+
+def shared_provider():
+    for _ in range(CLIENTS_PER_TURN):
+        get_client()
+
+
+def measure(fn, turns):
+    start = time.perf_counter()
+    for _ in range(turns):
+        fn()
+    return (time.perf_counter() - start) / turns
+
+
+def main(turns=200):
+    os.environ.setdefault("TOGETHER_AI_API_KEY", "benchmark")
+    get_together_api_key()
+
+    rebuild = measure(per_turn_rebuild, turns)
+    shared = measure(shared_provider, turns)
+    print(f"rebuild per turn: {rebuild * 1e6:9.1f} us")
+    print(f"shared provider:  {shared * 1e6:9.1f} us")
+    print(f"removed per turn: {(rebuild - shared) * 1e6:9.1f} us")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
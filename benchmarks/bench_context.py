@@ -0,0 +1,47 @@
+"""
+Prompt tokens per turn with the full history resent every turn versus a
+bounded ConversationContext, over a long simulated session. Summaries come
+from a local stand-in, so no API calls are made.
+
+Usage: python -m benchmarks.bench_context [turns]
+"""
+import sys
+
+from benchmarks.stub_client import NARRATION
+from benchmarks.stub_world import make_world
+from conversation_context import ConversationContext, messages_tokens
+from helper import build_messages, get_game_state
+
+SUMMARY = "You arrived in the market, met a merchant and bought a rusty key. " * 4
+
+
+def main(turns=60):
+    game_state = get_game_state(world=make_world())
+    summaries = []
+
+    def summarize(summary, folded):
+        summaries.append(len(folded))
+        return SUMMARY
+
+    context = ConversationContext(summarize=summarize)
+    history = []
+    full_total = bounded_total = 0
+    print(" turn   full  bounded")
+    for turn in range(1, turns + 1):
+        message = f"I walk to the stall number {turn} and look at the wares."
+        full = messages_tokens(build_messages(message, history, game_state))
+        context.build_messages(message, history, game_state)
+        context.record_usage(None)
+        bounded = context.prompt_tokens[-1]
+        full_total += full
+        bounded_total += bounded
+        if turn % 10 == 0:
+            print(f"{turn:5} {full:6} {bounded:8}")
+        history.append([message, NARRATION])
+
+    print(f"total prompt tokens: full {full_total}, bounded {bounded_total} "
+          f"({full_total / bounded_total:.1f}x fewer), {len(summaries)} summary calls")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 60)
@@ -0,0 +1,79 @@
+"""
+Cold import time of each entry point, measured with `python -X importtime`
+in a fresh interpreter, and which heavy dependencies each one loads.
+
+Results can be written as JSON and compared with an earlier run, as for
+run_benchmarks.
+
+Usage: python -m benchmarks.bench_import_time [--runs 5] [--output F] [--compare F]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.run_benchmarks import compare
+
+ENTRY_POINTS = [
+    "world_store",
+    "fantasy_world_generator",
+    "fantasy_game_master",
+    "helper",
+    "lore_index",
+    "app",
+]
+HEAVY = ["gradio", "together", "requests", "aiohttp", "pydantic"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time(module):
+    """Cumulative import time of module in microseconds, and the heavy modules it loaded."""
+    code = f"import sys, json, {module}; print(json.dumps([name for name in {HEAVY!r} if name in sys.modules]))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    cumulative = None
+    for line in result.stderr.splitlines():
+        parts = line.removeprefix("import time:").split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            cumulative = int(parts[1])
+    return cumulative, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run(runs):
+    metrics = {}
+    for module in ENTRY_POINTS:
+        samples = []
+        for _ in range(runs):
+            cumulative, loaded = import_time(module)
+            samples.append(cumulative)
+        metrics[module] = {"import_ms": min(samples) / 1000, "heavy_modules": loaded}
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0], "metrics": metrics}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5, help="imports per entry point; the fastest is kept")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    print(f"{'entry point':26} {'import':>10}  heavy modules loaded")
+    for module, result in results["metrics"].items():
+        print(f"{module:26} {result['import_ms']:8.1f}ms  {', '.join(result['heavy_modules']) or '-'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+How often the inventory pre-filter lets a turn skip the model call, and how
+well its "call needed" decision matches the item updates the model returns
+for a labeled corpus of narrations. Labels come from the inventory model
+(see label_inventory_narrations); cases still labeled by hand are counted
+separately. The pre-filter stays off by default until it misses none.
+
+Usage: python -m benchmarks.bench_inventory_filter
+"""
+import json
+import os
+import time
+
+from inventory_filter import inventory_change_signals
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "inventory_narrations.json")
+
+
+def main():
+    with open(FIXTURE) as f:
+        cases = json.load(f)
+
+    true_pos = false_pos = false_neg = skipped = 0
+    by_model = sum(case.get("labeled_by", "hand") != "hand" for case in cases)
+    start = time.perf_counter()
+    for case in cases:
+        predicted = bool(inventory_change_signals(case["inventory"], case["story"]))
+        changed = bool(case["item_updates"])
+        skipped += not predicted
+        true_pos += predicted and changed
+        false_pos += predicted and not changed
+        if changed and not predicted:
+            false_neg += 1
+            print(f"missed: {case['story']}")
+    per_case = (time.perf_counter() - start) / len(cases)
+
+    precision = true_pos / (true_pos + false_pos) if true_pos + false_pos else 1.0
+    recall = true_pos / (true_pos + false_neg) if true_pos + false_neg else 1.0
+    print(f"cases:        {len(cases)} ({by_model} labeled by the model, {len(cases) - by_model} by hand)")
+    print(f"skipped calls {skipped / len(cases):6.1%}")
+    print(f"precision     {precision:6.1%}")
+    print(f"recall        {recall:6.1%}  ({false_neg} missed)")
+    print(f"filter time   {per_case * 1e6:6.1f} us per narration")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Lore index build, query and update time as the world grows, how often a
+named NPC is retrieved, and the prompt size with lore selected per turn.
+
+Usage: python -m benchmarks.bench_lore_index
+"""
+import os
+import random
+import tempfile
+import time
+
+from conversation_context import ConversationContext, estimate_tokens, messages_tokens
+from helper import get_game_state
+from lore_index import LoreIndex
+from world_store import open_world_store, save_world
+
+SIZES = [(3, 3, 3), (10, 30, 5), (20, 100, 5)]
+QUERIES = 200
+
+SYLLABLES = ["al", "bar", "cor", "dun", "el", "fen", "gar", "hal", "ith", "jor", "kel", "lor",
+             "mir", "nor", "or", "pel", "quin", "ros", "sol", "tor", "ul", "var", "wen", "yr", "zan"]
+WORDS = ["river", "forge", "temple", "market", "harbor", "forest", "mine", "tower", "guild",
+         "dragon", "wolf", "merchant", "smith", "healer", "thief", "knight", "scholar", "bard",
+         "silver", "iron", "salt", "amber", "wine", "wool", "spice", "grain", "stone", "glass",
+         "ancient", "haunted", "busy", "quiet", "walled", "ruined", "northern", "misty", "golden"]
+
+
+def make_name(rng, used):
+    while True:
+        name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+        if name not in used:
+            used.add(name)
+            return name
+
+
+def describe(rng, kind, name):
+    words = " ".join(rng.choice(WORDS) for _ in range(12))
+    return f"{name} is a {kind} known for {words}."
+
+
+def lore_world(kingdoms, towns, npcs, seed=0):
+    rng = random.Random(seed)
+    used = set()
+    world = {"name": "Lore", "description": "A world for benchmarks.", "start": "You wake up.", "kingdoms": {}}
+    for _ in range(kingdoms):
+        name = make_name(rng, used)
+        kingdom = {"name": name, "description": describe(rng, "kingdom", name), "towns": {}}
+        for _ in range(towns):
+            name = make_name(rng, used)
+            town = {"name": name, "description": describe(rng, "town", name), "npcs": {}}
+            for _ in range(npcs):
+                name = make_name(rng, used)
+                town["npcs"][name] = {"name": name, "description": describe(rng, "character", name)}
+            kingdom["towns"][town["name"]] = town
+        world["kingdoms"][kingdom["name"]] = kingdom
+    return world
+
+
+def npc_keys(world):
+    return [
+        (kingdom["name"], town["name"], npc)
+        for kingdom in world["kingdoms"].values()
+        for town in kingdom["towns"].values()
+        for npc in town["npcs"]
+    ]
+
+
+def main():
+    rng = random.Random(1)
+    print(f"{'entries':>7} {'build':>9} {'query p50':>10} {'query p95':>10} {'update':>8} "
+          f"{'recall@5':>8} {'prompt':>7} {'world':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for kingdoms, towns, npcs in SIZES:
+            world = lore_world(kingdoms, towns, npcs)
+            path = os.path.join(tmp, f"lore-{kingdoms}-{towns}.db")
+            save_world(world, path)
+            store = open_world_store(path)
+
+            start = time.perf_counter()
+            index = LoreIndex.from_store(store)
+            build = time.perf_counter() - start
+
+            keys = npc_keys(world)
+            timings, found = [], 0
+            for _ in range(QUERIES):
+                key = rng.choice(keys)
+                query = f"I ask around for {key[2]} near the {rng.choice(WORDS)}"
+                start = time.perf_counter()
+                results = index.search(query, k=5)
+                timings.append(time.perf_counter() - start)
+                found += any(result_key == key for _, result_key, _ in results)
+            timings.sort()
+
+            kingdom, town, npc = keys[0]
+            start = time.perf_counter()
+            store.put_npc(kingdom, town, {"name": npc, "description": f"{npc} now guards the harbor."})
+            update = time.perf_counter() - start
+
+            # Prompt for a turn mentioning another character, with lore.
+            game_state = get_game_state(world=store)
+            context = ConversationContext(lore=index)
+            messages = context.build_messages(f"I go looking for {rng.choice(keys)[2]}", [], game_state)
+            world_tokens = estimate_tokens(str(world))
+
+            print(f"{len(index):7} {build * 1000:7.1f}ms {timings[len(timings) // 2] * 1000:8.2f}ms "
+                  f"{timings[int(len(timings) * 0.95)] * 1000:8.2f}ms {update * 1000:6.2f}ms "
+                  f"{found / QUERIES:8.0%} {messages_tokens(messages):7} {world_tokens:7}")
+            index.close()
+            store.close()
+
+    print(f"(prompt and world in estimated tokens; recall over {QUERIES} queries naming an NPC)")
+
+
+if __name__ == "__main__":
+    main()
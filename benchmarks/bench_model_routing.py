@@ -0,0 +1,201 @@
+"""
+Turn latency while the narration model slows down and recovers, with every
+task fixed to its model versus routed with a latency budget, a timeout and
+a fallback to the 8B model, against the stub client, for whole turns and
+for streamed narration. Reports the fallbacks by reason and the latency per
+task and model. Also checks that calls waiting for a scheduler slot don't
+time out or count the wait as latency, and that streamed calls that time
+out give their scheduler slot back.
+
+Usage: python -m benchmarks.bench_model_routing
+"""
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import llm_client
+from benchmarks.stub_client import StubTogether
+from benchmarks.stub_world import write_world
+from config import get_together_api_key
+from fantasy_game_master import FantasyGameMaster
+from helper import get_game_state, safety_cache, stream_action
+from model_registry import DEFAULT_ROUTES, LLAMA_3_8B, LLAMA_3_70B, ModelRegistry, Route, set_model_registry
+from request_scheduler import AsyncScheduledClient, RequestScheduler, ScheduledClient
+from turn_pipeline import TurnPipeline
+
+# (phase, turns, 70B latency in seconds)
+PHASES = [("normal", 8, 0.3), ("slow", 12, 1.2), ("recovered", 8, 0.3)]
+BUDGET = 0.6
+TIMEOUT = 1.0
+
+
+def routed(cooldown=2.0):
+    routes = dict(DEFAULT_ROUTES)
+    routes["narration"] = Route(LLAMA_3_70B, LLAMA_3_8B, budget=BUDGET, timeout=TIMEOUT)
+    return ModelRegistry(routes, window=4, min_samples=2, cooldown=cooldown)
+
+
+def fixed():
+    return ModelRegistry({task: Route(route.model) for task, route in DEFAULT_ROUTES.items()})
+
+
+def play(client, turn):
+    results = []
+    for phase, turns, latency in PHASES:
+        client.model_latencies[LLAMA_3_70B] = latency
+        latencies = []
+        for _ in range(turns):
+            safety_cache.clear()
+            start = time.perf_counter()
+            turn()
+            latencies.append(time.perf_counter() - start)
+        results.append((phase, latencies))
+    return results
+
+
+class AsyncStub:
+    """The stub's chat completions as an async client."""
+
+    def __init__(self, client):
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = self
+        self.completions = self
+        self._client = client
+
+    async def create(self, **kwargs):
+        chunks = await asyncio.to_thread(self._client.chat.completions.create, **kwargs)
+
+        async def stream():
+            # The stub sleeps between chunks, so they are read off the event loop.
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+
+        return stream()
+
+
+def wait_for_slots(scheduler, seconds):
+    deadline = time.monotonic() + seconds
+    while scheduler.active and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return scheduler.active
+
+
+def queued_calls(client):
+    """
+    More concurrent narration calls than the scheduler has slots, each
+    finishing within the timeout once admitted: none may time out, and the
+    latency recorded is the model's, not the wait for a slot.
+    """
+    client.model_latencies[LLAMA_3_70B] = TIMEOUT * 0.8
+    messages = [{"role": "user", "content": "Look around"}]
+    calls = 6
+    for label in ("sync", "async"):
+        registry = ModelRegistry({"narration": Route(LLAMA_3_70B, LLAMA_3_8B, timeout=TIMEOUT)})
+        scheduler = RequestScheduler(max_concurrent=2)
+        before = client.calls
+        if label == "sync":
+            scheduled = ScheduledClient(client, scheduler)
+            with ThreadPoolExecutor(calls) as executor:
+                list(executor.map(
+                    lambda _: registry.create("narration", scheduled.chat.completions.create, messages=messages),
+                    range(calls),
+                ))
+        else:
+            async def play_async():
+                scheduled = AsyncScheduledClient(AsyncStub(client), scheduler)
+                await asyncio.gather(*(
+                    registry.create_async("narration", scheduled.chat.completions.create, messages=messages)
+                    for _ in range(calls)
+                ))
+
+            asyncio.run(play_async())
+        latency = registry.stats()["latency"][("narration", LLAMA_3_70B)]
+        print(f"{label:5} queued calls: {calls} turns, {client.calls - before} model calls, "
+              f"{sum(registry.fallbacks.values())} fallbacks, p50 {latency['p50'] * 1000:.0f}ms")
+        assert client.calls - before == calls and not registry.fallbacks
+        assert latency["p50"] < TIMEOUT
+        registry.shutdown()
+
+
+def abandoned_streams(client):
+    """
+    Streamed narration calls that all time out, more of them than the
+    scheduler has slots: a slot kept by an abandoned stream would block the
+    rest.
+    """
+    client.model_latencies[LLAMA_3_70B] = TIMEOUT * 1.5
+    messages = [{"role": "user", "content": "Look around"}]
+    # No cooldown, so every call tries the 70B model and times out.
+    registry = routed(cooldown=0)
+    scheduler = RequestScheduler(max_concurrent=2, base_delay=0.01)
+    scheduled = ScheduledClient(client, scheduler)
+    for _ in range(scheduler.max_concurrent + 1):
+        chunks = registry.create("narration", scheduled.chat.completions.create, messages=messages, stream=True)
+        assert "".join(chunk.choices[0].delta.content for chunk in chunks)
+    active = wait_for_slots(scheduler, TIMEOUT)
+    print(f"sync  streams timed out: {registry.fallbacks[('narration', 'timeout')]}, slots held after: {active}")
+    assert active == 0
+
+    async def play_async():
+        scheduled = AsyncScheduledClient(AsyncStub(client), scheduler)
+        for _ in range(scheduler.max_concurrent + 1):
+            chunks = await registry.create_async(
+                "narration", scheduled.chat.completions.create, messages=messages, stream=True
+            )
+            assert "".join([chunk.choices[0].delta.content async for chunk in chunks])
+
+    registry.fallbacks.clear()
+    asyncio.run(play_async())
+    active = wait_for_slots(scheduler, TIMEOUT)
+    print(f"async streams timed out: {registry.fallbacks[('narration', 'timeout')]}, slots held after: {active}")
+    assert active == 0
+    registry.shutdown()
+
+
+def main():
+    os.environ.setdefault("TOGETHER_AI_API_KEY", "benchmark")
+    client = StubTogether(latency=0.3, token_delay=0.002, latencies={"safety": 0.1},
+                          model_latencies={LLAMA_3_8B: 0.1})
+    llm_client.set_client(client)
+    pipeline = TurnPipeline()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        world_path = write_world(os.path.join(tmp, "world.json"))
+        game_master = FantasyGameMaster(get_together_api_key(), world_path, world_path)
+
+        def turn():
+            pipeline.run("Look around", [], get_game_state(world=game_master.store), game_master)
+
+        def streamed():
+            "".join(stream_action("Look around", [], get_game_state(world=game_master.store)))
+
+        for mode, run in (("turn", turn), ("streamed", streamed)):
+            for label, registry in (("fixed", fixed()), ("routed", routed())):
+                set_model_registry(registry)
+                for phase, latencies in play(client, run):
+                    latencies.sort()
+                    print(f"{label:6} {phase:9}: {mode:8} mean {statistics.fmean(latencies) * 1000:5.0f}ms  "
+                          f"max {latencies[-1] * 1000:5.0f}ms")
+                stats = registry.stats()
+                fallbacks = ", ".join(f"{task} {reason}: {count}"
+                                      for (task, reason), count in stats["fallbacks"].items())
+                print(f"  fallbacks: {fallbacks or 'none'}")
+                for (task, model), latency in sorted(stats["latency"].items()):
+                    print(f"  {task:10} {model:32} {latency['calls']:3} calls  p50 {latency['p50'] * 1000:5.0f}ms")
+                registry.shutdown()
+            print()
+
+    queued_calls(client)
+    abandoned_streams(client)
+    set_model_registry(None)
+    pipeline.shutdown()
+
+
+if __name__ == "__main__":
+    main()
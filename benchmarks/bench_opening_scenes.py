@@ -0,0 +1,68 @@
+"""
+Precomputing an opening scene for every character, against the stub client:
+time to fill the pool one scene at a time and concurrently, then the cost
+and model calls of starting sessions from the pool, and background refresh.
+
+Usage: python -m benchmarks.bench_opening_scenes [latency_seconds]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.stub_client import StubTogether
+from benchmarks.stub_world import make_world
+from fantasy_game_master import FantasyGameMaster
+from helper import get_game_state
+from opening_scenes import OpeningScenePool, characters
+from world_store import open_world_store, save_world
+
+SIZE = dict(kingdoms=4, towns=4, npcs=4)
+SESSIONS = 200
+
+
+def make_pool(path, latency, max_workers, refresh=False):
+    store = open_world_store(path)
+    game_master = FantasyGameMaster(api_key="stub", world_path=path, output_path=path, store=store)
+    game_master.client = StubTogether(latency=latency, token_delay=0)
+    return OpeningScenePool(game_master, max_workers=max_workers, refresh=refresh)
+
+
+def fill(path, latency, max_workers):
+    save_world(make_world(**SIZE), path)
+    pool = make_pool(path, latency, max_workers)
+    start = time.perf_counter()
+    generated = pool.fill()
+    return generated, time.perf_counter() - start, pool.game_master.client.calls
+
+
+def main(latency=0.1):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "world.db")
+        for max_workers in (1, 8):
+            generated, elapsed, calls = fill(path, latency, max_workers)
+            print(f"fill, {max_workers} worker(s): {generated} scenes, {calls} calls in {elapsed:.2f}s")
+
+        pool = make_pool(path, latency, max_workers=8, refresh=True)
+        store = pool.store
+        shared_start = store.get_meta("start")
+        assert all(store.npc(*names).get("starts") for names in characters(store))
+
+        start = time.perf_counter()
+        states = [get_game_state(world=store) for _ in range(SESSIONS)]
+        elapsed = time.perf_counter() - start
+        matched = sum(state["start"] != shared_start for state in states)
+        print(f"session start: {elapsed / SESSIONS * 1000:.2f}ms each, 0 model calls, "
+              f"{matched}/{SESSIONS} with the character's own scene")
+
+        futures = [pool.used(start=state["start"], **state["location"]) for state in states[:20]]
+        start = time.perf_counter()
+        for future in futures:
+            future.result()
+        print(f"refresh: {pool.generated} scenes replaced in the background in "
+              f"{time.perf_counter() - start:.2f}s ({pool.game_master.client.calls} calls)")
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.1)
@@ -0,0 +1,74 @@
+"""
+Post-generation latency of a turn: safety check and inventory detection run
+one after the other versus concurrently in TurnPipeline, with injected
+delays on a stub client. Also checks that an unsafe turn never commits its
+inventory change.
+
+Usage: python -m benchmarks.bench_post_processing
+"""
+import os
+import tempfile
+import time
+
+import llm_client
+from benchmarks.stub_client import StubTogether
+from benchmarks.stub_world import write_world
+from config import get_together_api_key
+from fantasy_game_master import FantasyGameMaster
+from helper import get_game_state, is_safe, safety_cache
+from turn_pipeline import INVALID_OUTPUT, TurnPipeline
+
+SAFETY_DELAY = 0.15
+INVENTORY_DELAY = 0.25
+NARRATION = "You pick up a rusty key from the floor."
+GAIN_KEY = '{"itemUpdates": [{"name": "rusty key", "change_amount": 1}]}'
+
+
+def sequential(game_state, game_master, output):
+    safety_cache.clear()
+    start = time.perf_counter()
+    if is_safe(output):
+        game_master.process_inventory_updates(game_state, output)
+    return time.perf_counter() - start
+
+
+def main():
+    os.environ.setdefault("TOGETHER_AI_API_KEY", "benchmark")
+    client = StubTogether(
+        latencies={"safety": SAFETY_DELAY, "inventory": INVENTORY_DELAY},
+        inventory_response=GAIN_KEY,
+    )
+    llm_client.set_client(client)
+    pipeline = TurnPipeline()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        world_path = write_world(os.path.join(tmp, "world.json"))
+        game_master = FantasyGameMaster(get_together_api_key(), world_path, world_path)
+
+        game_state = get_game_state(world=game_master.store)
+        sequential_time = sequential(game_state, game_master, NARRATION)
+
+        game_state = get_game_state(world=game_master.store)
+        safety_cache.clear()
+        result = pipeline.post_process(game_state, game_master, NARRATION)
+        timings = result["timings"]
+
+        print(f"sequential post-processing: {sequential_time * 1000:6.1f} ms")
+        for stage in ("safety", "inventory", "post_process"):
+            print(f"pipeline {stage:18} {timings[stage] * 1000:6.1f} ms")
+        assert game_state["inventory"] == {"rusty key": 1}
+        assert timings["post_process"] < SAFETY_DELAY + INVENTORY_DELAY - 0.05, "stages did not overlap"
+
+        client.safety_verdict = "unsafe\nO1"
+        safety_cache.clear()
+        game_state = get_game_state(world=game_master.store)
+        result = pipeline.post_process(game_state, game_master, NARRATION)
+        assert result["output"] == INVALID_OUTPUT
+        assert game_state["inventory"] == {}, "unsafe turn changed the inventory"
+        print("unsafe turn: inventory unchanged")
+
+    pipeline.shutdown()
+
+
+if __name__ == "__main__":
+    main()
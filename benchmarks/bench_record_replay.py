@@ -0,0 +1,73 @@
+"""
+Record a world generation and a few game turns against the stub client,
+then replay them from the SQLite cache with no client behind it. The replay
+must produce the same world and narration without making any calls.
+
+Usage: python -m benchmarks.bench_record_replay
+"""
+import os
+import random
+import tempfile
+import time
+
+import llm_client
+from benchmarks.stub_client import StubTogether
+from config import get_together_api_key
+from fantasy_game_master import FantasyGameMaster
+from fantasy_world_generator import FantasyWorldGenerator
+from helper import get_game_state, run_action
+from llm_cache import CachingClient, CompletionCache
+
+ACTIONS = ["Look around", "I pick up the lantern", "Continue the story"]
+
+
+class OfflineClient:
+    """Fails any call that reaches it: replay must be served from the cache."""
+
+    def __init__(self):
+        def fail(**kwargs):
+            raise AssertionError("replay made an API call")
+
+        self.chat = type("Chat", (), {"completions": type("C", (), {"create": staticmethod(fail)})})()
+        self.completions = type("C", (), {"create": staticmethod(fail)})()
+
+
+def session(client, world_path):
+    llm_client.set_client(client)
+    start = time.perf_counter()
+    generator = FantasyWorldGenerator(api_key=get_together_api_key(), max_workers=1)
+    world = generator.generate(world_path)
+    world["start"] = "You stand at the gates."
+    game_master = FantasyGameMaster(get_together_api_key(), world_path, world_path)
+    # Same character both times, so the prompts match the recording.
+    random.seed(0)
+    game_state = get_game_state(world=world)
+    history, outputs = [], []
+    for action in ACTIONS:
+        output = run_action(action, history, game_state)
+        output += game_master.process_inventory_updates(game_state, output)
+        history.append([action, output])
+        outputs.append(output)
+    return world, outputs, time.perf_counter() - start
+
+
+def main():
+    os.environ.setdefault("TOGETHER_AI_API_KEY", "benchmark")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = os.path.join(tmp, "responses.sqlite")
+        world_path = os.path.join(tmp, "world.json")
+
+        record_cache = CompletionCache(mode="record", path=cache_path)
+        stub = StubTogether(latency=0.05, token_delay=0)
+        recorded = session(CachingClient(stub, record_cache), world_path)
+
+        replay_cache = CompletionCache(mode="replay", path=cache_path)
+        replayed = session(CachingClient(OfflineClient(), replay_cache), world_path)
+
+    assert recorded[:2] == replayed[:2], "replay differs from the recording"
+    print(f"record: {stub.calls} calls in {recorded[2]:.3f}s")
+    print(f"replay: 0 calls in {replayed[2]:.3f}s ({replay_cache.stats()['hits']} cache hits)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Turn latency with and without speculative prefetch of the likely next
+actions, against the stub client. Simulated players read each response
+for a while, then send one of the UI's example actions most of the time
+and something else otherwise. Reports hit rate, extra model calls and
+tokens wasted on speculation that wasn't used.
+
+Usage: python -m benchmarks.bench_speculation [likely_share]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import llm_client
+from benchmarks.stub_client import StubTogether
+from benchmarks.stub_world import make_world
+from request_scheduler import ScheduledClient
+from speculation import DEFAULT_ACTIONS, Speculator
+from world_store import save_world
+
+PLAYERS = 4
+TURNS = 8
+READ_SECONDS = 0.8
+OTHER_ACTIONS = ["I walk to the market", "I ask the merchant about the beast", "I open the door"]
+
+
+def play(app, player, likely_share):
+    rng = random.Random(player)
+    request = SimpleNamespace(session_hash=f"speculation-{player}-{time.monotonic_ns()}")
+    history = [["start game", app.main_loop("start game", [], request)]]
+    latencies = []
+    for _ in range(TURNS):
+        time.sleep(READ_SECONDS)
+        if rng.random() < likely_share:
+            message = rng.choice(DEFAULT_ACTIONS)
+        else:
+            message = rng.choice(OTHER_ACTIONS)
+        start = time.perf_counter()
+        output = app.main_loop(message, history, request)
+        latencies.append(time.perf_counter() - start)
+        history.append([message, output])
+    return latencies
+
+
+def run(app, client, speculator, likely_share):
+    app.speculator = speculator
+    app.sessions = app.SessionStore(app.new_session)
+    calls = client.calls
+    with ThreadPoolExecutor(max_workers=PLAYERS) as executor:
+        results = list(executor.map(lambda player: play(app, player, likely_share), range(PLAYERS)))
+    latencies = [latency for result in results for latency in result]
+    return latencies, client.calls - calls
+
+
+def main(likely_share=0.6):
+    os.environ.setdefault("TOGETHER_AI_API_KEY", "benchmark")
+    client = StubTogether(latency=0.3, token_delay=0.005, latencies={"safety": 0.1})
+    # Through the scheduler, as in the game: speculations are only used once
+    # it has admitted their model call.
+    llm_client.set_client(ScheduledClient(client, llm_client.get_scheduler()))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        import app
+
+        app.world_path = os.path.join(tmp, "world.db")
+        save_world(make_world(), app.world_path)
+
+        for label, speculator in (("off", None), ("on", Speculator())):
+            latencies, calls = run(app, client, speculator, likely_share)
+            print(f"speculation {label:3}: turn mean {statistics.fmean(latencies) * 1000:6.0f}ms  "
+                  f"p50 {statistics.median(latencies) * 1000:6.0f}ms  {calls} model calls")
+            if speculator is not None:
+                speculator.shutdown()
+                stats = speculator.stats()
+                print(f"  hit rate {stats['hit_rate']:.0%} ({stats['hits']}/{stats['hits'] + stats['misses']}), "
+                      f"{stats['speculated']} speculated, {stats['cancelled']} cancelled before starting, "
+                      f"{stats['tokens_wasted']} of {stats['tokens_spent']} tokens wasted")
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.6)
@@ -0,0 +1,56 @@
+"""
+Time to first visible text for the blocking main_loop versus the streaming
+main_loop_stream, against a stub client.
+
+Usage: python -m benchmarks.bench_streaming [latency_seconds] [token_delay]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import app
+import llm_client
+from benchmarks.stub_client import StubTogether
+from benchmarks.stub_world import write_world
+
+TURNS = 5
+
+
+def time_blocking(message):
+    start = time.perf_counter()
+    app.main_loop(message, [])
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed
+
+
+def time_streaming(message):
+    start = time.perf_counter()
+    first = None
+    for _ in app.main_loop_stream(message, []):
+        if first is None:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def report(name, samples):
+    first = statistics.median(sample[0] for sample in samples)
+    total = statistics.median(sample[1] for sample in samples)
+    print(f"{name:10} first text {first * 1000:7.1f} ms   complete {total * 1000:7.1f} ms")
+    return first
+
+
+def main(latency=0.2, token_delay=0.02):
+    os.environ.setdefault("TOGETHER_AI_API_KEY", "benchmark")
+    llm_client.set_client(StubTogether(latency=latency, token_delay=token_delay))
+    with tempfile.TemporaryDirectory() as tmp:
+        app.world_path = write_world(os.path.join(tmp, "world.json"))
+        blocking = report("blocking", [time_blocking("Look around") for _ in range(TURNS)])
+        streaming = report("streaming", [time_streaming("Look around") for _ in range(TURNS)])
+    print(f"time to first text: {blocking / streaming:.1f}x lower")
+
+
+if __name__ == "__main__":
+    args = [float(arg) for arg in sys.argv[1:3]]
+    main(*args)
@@ -0,0 +1,109 @@
+"""
+Model calls and latency of a turn that changes the inventory, with the
+narration and inventory detection as two calls versus one structured
+call, against the stub client. Also checks how the structured turn reader
+copes with the kinds of malformed output models produce, and that a turn
+still completes when it can't read the response.
+
+Usage: python -m benchmarks.bench_structured_turns
+"""
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import llm_client
+from benchmarks.stub_client import StubTogether
+from benchmarks.stub_world import write_world
+from config import get_together_api_key
+from fantasy_game_master import FantasyGameMaster
+from helper import get_game_state, safety_cache
+from structured_turn import parse_turn
+from turn_pipeline import TurnPipeline
+
+TURNS = 10
+MESSAGE = "I pick up the lantern"
+GAIN_LANTERN = '{"itemUpdates": [{"name": "lantern", "change_amount": 1}]}'
+
+TAKE = "You take the lantern."
+LANTERN = [{"name": "lantern", "change_amount": 1}]
+
+# Model output and what parse_turn should make of it: (narration, item
+# updates), with None for updates that must be detected separately, or
+# None if the turn has to be generated again.
+OUTPUTS = {
+    "clean": ('{"narration": "You take the lantern.", "itemUpdates": [{"name": "lantern", "change_amount": 1}]}',
+              (TAKE, LANTERN)),
+    "code fence": ('```json\n{"narration": "You take the lantern.", "itemUpdates": []}\n```', (TAKE, [])),
+    "prose around": ('Here is the turn: {"narration": "You take the lantern.", "itemUpdates": []} Enjoy!',
+                     (TAKE, [])),
+    "trailing comma": ('{"narration": "You take the lantern.", "itemUpdates": [{"name": "lantern", "change_amount": 1},],}',
+                       (TAKE, LANTERN)),
+    "bad item": ('{"narration": "You take the lantern.", "itemUpdates": [{"name": "lantern", "change_amount": "one"}]}',
+                 (TAKE, [])),
+    "no itemUpdates": ('{"narration": "You take the lantern."}', (TAKE, [])),
+    "null itemUpdates": ('{"narration": "You take the lantern.", "itemUpdates": null}', (TAKE, [])),
+    "object itemUpdates": ('{"narration": "You take the lantern.", "itemUpdates": {}}', (TAKE, None)),
+    "plain text": ("You take the lantern.", (TAKE, None)),
+    "braces in prose": ("A sign on the door reads {closed}.", ("A sign on the door reads {closed}.", None)),
+    "truncated": ('{"narration": "You take the lan', None),
+}
+
+
+def play(pipeline, run, game_master, world):
+    latencies = []
+    for _ in range(TURNS):
+        safety_cache.clear()
+        game_state = get_game_state(world=world)
+        start = time.perf_counter()
+        run(MESSAGE, [], game_state, game_master)
+        latencies.append(time.perf_counter() - start)
+    return latencies, game_state["inventory"]
+
+
+def main():
+    # The malformed outputs below are logged as warnings on purpose.
+    logging.disable(logging.WARNING)
+    os.environ.setdefault("TOGETHER_AI_API_KEY", "benchmark")
+    client = StubTogether(latency=0.3, token_delay=0.005, latencies={"safety": 0.1},
+                          inventory_response=GAIN_LANTERN)
+    llm_client.set_client(client)
+    pipeline = TurnPipeline()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        world_path = write_world(os.path.join(tmp, "world.json"))
+        game_master = FantasyGameMaster(get_together_api_key(), world_path, world_path)
+
+        for label, run in (("two calls", pipeline.run), ("structured", pipeline.run_structured)):
+            calls = client.calls
+            latencies, inventory = play(pipeline, run, game_master, game_master.store)
+            print(f"{label:10}: turn mean {statistics.fmean(latencies) * 1000:5.0f}ms  "
+                  f"{(client.calls - calls) / TURNS:.1f} model calls per turn  inventory {inventory}")
+            assert inventory == {"lantern": 1}
+
+        print()
+        for label, (text, expected) in OUTPUTS.items():
+            try:
+                parsed = parse_turn(text)
+            except ValueError:
+                parsed = None
+            if parsed is None:
+                print(f"{label:18} unreadable, generated again the usual way")
+            else:
+                updates = "detected separately" if parsed[1] is None else parsed[1]
+                print(f"{label:18} {parsed[0]!r}  item updates: {updates}")
+            assert parsed == expected, f"{label}: expected {expected}, got {parsed}"
+
+        # A turn whose structured response can't be read still completes.
+        client.turn_response = OUTPUTS["truncated"][0]
+        calls = client.calls
+        _, inventory = play(pipeline, pipeline.run_structured, game_master, game_master.store)
+        print(f"\nunreadable: {(client.calls - calls) / TURNS:.1f} model calls per turn  inventory {inventory}")
+        assert inventory == {"lantern": 1}
+
+    pipeline.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Compare sequential and concurrent world generation against a stub client.
+
+Usage: python -m benchmarks.bench_world_generation [latency_seconds]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.stub_client import StubTogether
+from fantasy_world_generator import FantasyWorldGenerator
+
+
+def shape(world):
+    return [
+        (kingdom_name, [
+            (town_name, list(town["npcs"].keys()))
+            for town_name, town in kingdom["towns"].items()
+        ])
+        for kingdom_name, kingdom in world["kingdoms"].items()
+    ]
+
+
+def run(max_workers, latency, output_path):
+    generator = FantasyWorldGenerator(api_key="stub", max_workers=max_workers)
+    generator.client = StubTogether(latency=latency, token_delay=0)
+    start = time.perf_counter()
+    world = generator.generate(output_path)
+    return world, time.perf_counter() - start, generator.client.calls
+
+
+def main(latency=0.05):
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = os.path.join(tmp, "world.json")
+        seq_world, seq_time, seq_calls = run(1, latency, output_path)
+        con_world, con_time, con_calls = run(4, latency, output_path)
+
+    print(f"sequential: {seq_calls} calls in {seq_time:.3f}s")
+    print(f"concurrent: {con_calls} calls in {con_time:.3f}s")
+    print(f"speedup:    {seq_time / con_time:.2f}x")
+
+    assert shape(seq_world) == shape(con_world), "world structure differs"
+    # 14 calls one after another versus four dependency stages.
+    assert seq_time / con_time > 2.0, "concurrent generation is not faster"
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.05)
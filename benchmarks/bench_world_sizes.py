@@ -0,0 +1,95 @@
+"""
+Calls and seconds per generated entity at different world sizes, with one
+request per parent versus batched requests, against the stub client. Also
+checks that the parser reads the formats models drift into.
+
+Usage: python -m benchmarks.bench_world_sizes [batch_size]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.stub_client import StubTogether
+from fantasy_world_generator import FantasyWorldGenerator
+from world_parser import parse_entities
+
+SIZES = [(3, 3, 3), (5, 5, 5), (8, 8, 4)]
+
+# Kingdom responses in the formats models produce instead of the one asked for.
+FORMATS = {
+    "labeled": "Kingdom 1 Name: Emberhold\nKingdom 1 Description: Fire priests rule.\n\n"
+               "Kingdom 2 Name: Frostmere\nKingdom 2 Description: A frozen realm.",
+    "bare first name": "Emberhold\nKingdom 1 Description: Fire priests rule.\n\n"
+                       "Kingdom 2 Name: Frostmere\nKingdom 2 Description: A frozen realm.",
+    "markdown labels": "1. **Name:** Emberhold\n   **Description:** Fire priests rule.\n"
+                       "2. **Name:** Frostmere\n   **Description:** A frozen realm.",
+    "bold numbered header": "**Kingdom 1: Emberhold**\nFire priests rule.\n\n"
+                            "**Kingdom 2: Frostmere**\nA frozen realm.",
+    "numbered header": "### Kingdom 1: Emberhold\nFire priests rule.\n### Kingdom 2: Frostmere\nA frozen realm.",
+    "bold header": "**Emberhold**\nFire priests rule.\n\n**Frostmere**\nA frozen realm.",
+    "listed": "1. Emberhold: Fire priests rule.\n2. Frostmere: A frozen realm.",
+    "echoed world": "World Name: Aldoria\nKingdom 1 Name: Emberhold\nKingdom 1 Description: Fire priests rule.\n"
+                    "World Description: A torn land.\n\nKingdom 2 Name: Frostmere\n"
+                    "Kingdom 2 Description: A frozen realm.",
+}
+
+# The batch NPC prompt echoes each place back; those lines are not NPC description.
+ECHOED_NPCS = ("Kingdom Name: Emberhold\nTown Name: Ashford\nTown Description: A mining town.\n"
+               "Character 1 Name: Brann\nCharacter 1 Description: A smith.\n"
+               "Kingdom Name: Emberhold\nTown: Cinderfall\n"
+               "Character 1 Name: Ilsa\nCharacter 1 Description: A baker.")
+
+
+def count_entities(world):
+    towns = [town for kingdom in world["kingdoms"].values() for town in kingdom["towns"].values()]
+    npcs = sum(len(town["npcs"]) for town in towns)
+    return len(world["kingdoms"]) + len(towns) + npcs
+
+
+def run(size, batch_size, output_path):
+    kingdoms, towns, npcs = size
+    generator = FantasyWorldGenerator(
+        api_key="stub", kingdoms=kingdoms, towns=towns, npcs=npcs, batch_size=batch_size,
+    )
+    generator.client = StubTogether(latency=0.05, token_delay=0.0005)
+    start = time.perf_counter()
+    world = generator.generate(output_path)
+    elapsed = time.perf_counter() - start
+    entities = count_entities(world)
+    expected = kingdoms + kingdoms * towns + kingdoms * towns * npcs
+    assert entities == expected, f"expected {expected} entities, got {entities}"
+    return generator.client.calls, elapsed, entities
+
+
+def check_formats():
+    for label, text in FORMATS.items():
+        entities = [entity for _, entity in parse_entities("Kingdom", text)]
+        names = [entity["name"] for entity in entities]
+        print(f"{label:22} {names}")
+        assert names == ["Emberhold", "Frostmere"], f"{label}: parsed {names}"
+        descriptions = [entity["description"] for entity in entities]
+        assert descriptions == ["Fire priests rule.", "A frozen realm."], f"{label}: parsed {descriptions}"
+    npcs = [(town, entity["name"], entity["description"])
+            for town, entity in parse_entities("Character", ECHOED_NPCS, parent_kind="Town")]
+    print(f"{'echoed npcs':22} {npcs}")
+    assert npcs == [("Ashford", "Brann", "A smith."), ("Cinderfall", "Ilsa", "A baker.")], f"echoed npcs: parsed {npcs}"
+
+
+def main(batch_size=4):
+    check_formats()
+    print()
+    print(f"{'size':>8} {'batch':>5} {'entities':>8} {'calls':>5} {'seconds':>8} "
+          f"{'calls/entity':>12} {'ms/entity':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = os.path.join(tmp, "world.json")
+        for size in SIZES:
+            for batch in (1, batch_size):
+                calls, elapsed, entities = run(size, batch, output_path)
+                label = "x".join(map(str, size))
+                print(f"{label:>8} {batch:5} {entities:8} {calls:5} {elapsed:8.2f} "
+                      f"{calls / entities:12.3f} {elapsed / entities * 1000:9.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
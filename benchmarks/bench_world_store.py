@@ -0,0 +1,48 @@
+"""
+Session start cost for the JSON and SQLite world stores as the world grows:
+open the world, pick a kingdom/town/character, and set the start scene.
+
+Usage: python -m benchmarks.bench_world_store
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.stub_world import make_world
+from helper import get_game_state
+from world_store import open_world_store, save_world
+
+SIZES = [(3, 3, 3), (10, 30, 5), (20, 100, 5)]
+
+
+def measure(path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    store = open_world_store(path)
+    get_game_state(world=store)
+    opened = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    store.set_meta("start", "You wake up somewhere new.")
+    update = time.perf_counter() - start
+    return opened, update, peak
+
+
+def main():
+    print(f"{'towns':>6} {'backend':8} {'open+select':>12} {'set start':>10} {'peak memory':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for kingdoms, towns, npcs in SIZES:
+            world = make_world(kingdoms, towns, npcs)
+            for backend, name in (("json", "world.json"), ("sqlite", f"world-{kingdoms}-{towns}.db")):
+                path = os.path.join(tmp, name)
+                save_world(world, path)
+                opened, update, peak = measure(path)
+                print(f"{kingdoms * towns:6} {backend:8} {opened * 1000:10.2f}ms {update * 1000:8.2f}ms "
+                      f"{peak / 1024:10.0f}KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Labels the inventory filter's fixture with the item updates the inventory
+model returns for each narration, so bench_inventory_filter measures the
+filter against what the model actually does. Calls the real API (needs
+TOGETHER_AI_API_KEY) with the pre-filter off; each labeled case records
+the model in "labeled_by".
+
+Usage: python -m benchmarks.label_inventory_narrations [--model MODEL] [--only-hand]
+"""
+import argparse
+import json
+import os
+import tempfile
+
+from benchmarks.bench_inventory_filter import FIXTURE
+from benchmarks.stub_world import write_world
+from config import get_together_api_key
+from fantasy_game_master import FantasyGameMaster
+from model_registry import DEFAULT_ROUTES, ModelRegistry, Route, set_model_registry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model", default=DEFAULT_ROUTES["inventory"].model,
+                        help="inventory model to label with (no fallback)")
+    parser.add_argument("--only-hand", action="store_true", help="only label cases not labeled by a model yet")
+    args = parser.parse_args()
+
+    with open(FIXTURE) as f:
+        cases = json.load(f)
+
+    set_model_registry(ModelRegistry({"inventory": Route(args.model)}))
+    with tempfile.TemporaryDirectory() as tmp:
+        world_path = write_world(os.path.join(tmp, "world.json"))
+        game_master = FantasyGameMaster(get_together_api_key(), world_path, world_path, prefilter=False)
+        changed = 0
+        for case in cases:
+            if args.only_hand and case.get("labeled_by", "hand") != "hand":
+                continue
+            item_updates = game_master.detect_inventory_changes(case["inventory"], case["story"])
+            if item_updates != case["item_updates"]:
+                changed += 1
+                print(f"{case['story']}\n  {case['item_updates']} -> {item_updates}")
+            case["item_updates"] = item_updates
+            case["labeled_by"] = args.model
+    set_model_registry(None)
+
+    with open(FIXTURE, "w") as f:
+        json.dump(cases, f, indent=2)
+        f.write("\n")
+    print(f"{changed} of {len(cases)} labels changed")
+
+
+if __name__ == "__main__":
+    main()
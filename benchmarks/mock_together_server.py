@@ -0,0 +1,227 @@
+"""
+Local stand-in for the Together chat and text completion endpoints.
+
+Point the app at it with TOGETHER_BASE_URL=http://127.0.0.1:<port>/v1. Each
+request waits for a sampled time to first token, then generates tokens at
+a fixed rate. A configurable share of requests fails with an HTTP error.
+Responses follow the formats the game's prompts ask for (see stub_client).
+
+Usage: python -m benchmarks.mock_together_server [--port 8089] [--latency 0.3]
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.stub_client import canned_response, request_kind, split_tokens
+
+
+class LatencyModel:
+    """
+    Time to first token in seconds. distribution is "fixed" (always mean),
+    "uniform" (mean ± spread) or "lognormal" (median mean, sigma spread).
+    """
+
+    def __init__(self, mean=0.2, distribution="fixed", spread=0.0, seed=None):
+        self.mean = mean
+        self.distribution = distribution
+        self.spread = spread
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            if self.distribution == "uniform":
+                return max(0.0, self.random.uniform(self.mean - self.spread, self.mean + self.spread))
+            if self.distribution == "lognormal":
+                return self.mean * self.random.lognormvariate(0.0, self.spread)
+            return self.mean
+
+
+class MockTogetherServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=None, tokens_per_second=200.0,
+                 failure_rate=0.0, failure_status=503, seed=None,
+                 safety_verdict="safe", inventory_response='{"itemUpdates": []}', turn_response=None):
+        self.latency = latency or LatencyModel(seed=seed)
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.safety_verdict = safety_verdict
+        self.inventory_response = inventory_response
+        self.turn_response = turn_response
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+        self.calls_by_kind = {}
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def respond(self, endpoint, body):
+        """Returns (status, content, kind) for one request."""
+        if endpoint == "completions":
+            kind = "safety"
+        else:
+            kind = request_kind(body["messages"])
+        with self._lock:
+            self.requests += 1
+            self.calls_by_kind[kind] = self.calls_by_kind.get(kind, 0) + 1
+            fail = self.random.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        if fail:
+            return self.failure_status, None, kind
+
+        if kind == "safety":
+            content = self.safety_verdict
+        else:
+            content = canned_response(kind, self, body.get("messages"))
+            # Every narration is different, as it would be from the model.
+            if kind == "narration":
+                content += f" A bell rings {next(self._counter)} times."
+            elif kind == "turn" and self.turn_response is None:
+                turn = json.loads(content)
+                turn["narration"] += f" A bell rings {next(self._counter)} times."
+                content = json.dumps(turn)
+        return 200, content, kind
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.endswith("/chat/completions"):
+                    endpoint = "chat"
+                elif self.path.endswith("/completions"):
+                    endpoint = "completions"
+                else:
+                    return self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+                status, content, kind = server.respond(endpoint, body)
+                latency = server.latency.sample()
+                if status != 200:
+                    time.sleep(latency)
+                    return self._send_json(status, {"error": {"message": "Injected failure", "type": "mock"}})
+
+                tokens = split_tokens(content)
+                prompt = json.dumps(body.get("messages") or body.get("prompt"))
+                usage = {
+                    "prompt_tokens": max(1, len(prompt) // 4),
+                    "completion_tokens": len(tokens),
+                    "total_tokens": max(1, len(prompt) // 4) + len(tokens),
+                }
+                if body.get("stream"):
+                    return self._stream(endpoint, body["model"], tokens, usage, latency)
+
+                time.sleep(latency + len(tokens) / server.tokens_per_second)
+                if endpoint == "chat":
+                    choice = {"index": 0, "finish_reason": "eos",
+                              "message": {"role": "assistant", "content": content}}
+                    obj = "chat.completion"
+                else:
+                    choice = {"index": 0, "finish_reason": "eos", "text": content}
+                    obj = "text.completion"
+                self._send_json(200, {
+                    "id": uuid.uuid4().hex, "object": obj, "created": int(time.time()),
+                    "model": body["model"], "choices": [choice], "usage": usage,
+                })
+
+            def _stream(self, endpoint, model, tokens, usage, latency):
+                # Headers go out right away, as from the real API; the
+                # latency is spent waiting for the first token.
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                self.wfile.flush()
+                time.sleep(latency)
+                request_id = uuid.uuid4().hex
+                for i, token in enumerate(tokens):
+                    if i:
+                        time.sleep(1 / server.tokens_per_second)
+                    last = i == len(tokens) - 1
+                    chunk = {
+                        "id": request_id,
+                        "object": "chat.completion.chunk" if endpoint == "chat" else "completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": token},
+                                     "finish_reason": "eos" if last else None}],
+                        "usage": usage if last else None,
+                    }
+                    self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+
+            def _write_chunk(self, data):
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.2, help="mean time to first token (s)")
+    parser.add_argument("--distribution", default="fixed", choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--spread", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--failure-status", type=int, default=503)
+    args = parser.parse_args()
+
+    latency = LatencyModel(args.latency, args.distribution, args.spread)
+    server = MockTogetherServer(args.host, args.port, latency, args.tokens_per_second,
+                                args.failure_rate, args.failure_status)
+    print(f"Mock Together API listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
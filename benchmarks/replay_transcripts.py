@@ -0,0 +1,179 @@
+"""
+Replays recorded player sessions through main_loop against the local mock Together server.
+
+Transcripts are recorded by running the game with TRANSCRIPT_PATH set (see
+transcripts). Each session's turns start at their recorded times divided
+by --speedup (0 replays them back to back), but never before the session's
+previous turn has finished; at most --concurrency sessions are replayed at
+once. Reports per-turn latency next to the recorded latency, throughput,
+and how far turns started behind the recorded schedule ("lag"). Results
+are written as JSON and can be compared with an earlier run, as for
+run_benchmarks.
+
+With --record-sample, synthetic sessions are played through the mock and
+recorded to that file instead, for trying the replay without a recording.
+
+Usage: python -m benchmarks.replay_transcripts TRANSCRIPT [--speedup 1] [--concurrency 32]
+       python -m benchmarks.replay_transcripts --record-sample FILE [--sessions 8] [--turns 12]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from benchmarks.mock_together_server import LatencyModel, MockTogetherServer
+from benchmarks.run_benchmarks import ACTIONS, compare, configure_client, summarize
+from benchmarks.stub_world import make_world
+from transcripts import TranscriptRecorder, load_sessions
+from world_store import save_world
+
+
+def replay_session(main_loop, key, turns, start, speedup):
+    """(latencies, lags, errors) of one session's turns."""
+    request = SimpleNamespace(session_hash=f"replay-{key}-{time.monotonic_ns()}")
+    history, latencies, lags, errors = [], [], [], 0
+    for turn in turns:
+        if speedup:
+            due = start + turn["at"] / speedup
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            lags.append(max(0.0, -wait))
+        began = time.perf_counter()
+        try:
+            output = main_loop(turn["message"], history, request)
+        except Exception:
+            errors += 1
+            output = ""
+        latencies.append(time.perf_counter() - began)
+        history.append([turn["message"], output])
+    return latencies, lags, errors
+
+
+def replay(app, sessions, speedup, concurrency):
+    # The first recorded turn is replayed right away.
+    first = min(turns[0]["at"] for turns in sessions.values())
+    start = time.monotonic() - first / speedup if speedup else time.monotonic()
+    ordered = sorted(sessions.items(), key=lambda item: item[1][0]["at"])
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda item: replay_session(app.main_loop, item[0], item[1], start, speedup), ordered
+        ))
+    elapsed = time.perf_counter() - began
+    latencies = [latency for result in results for latency in result[0]]
+    lags = [lag for result in results for lag in result[1]]
+    recorded = [turn["seconds"] for turns in sessions.values() for turn in turns]
+    metrics = {
+        "sessions": len(sessions),
+        "turns": len(latencies),
+        "errors": sum(result[2] for result in results),
+        "seconds": elapsed,
+        "turns_per_second": len(latencies) / elapsed,
+        "latency": summarize(latencies),
+        "recorded_latency": summarize(recorded),
+    }
+    if lags:
+        metrics["lag"] = summarize(lags)
+    return metrics
+
+
+def record_sample(app, path, sessions, turns, seed):
+    """Record synthetic sessions: staggered starts and a few seconds' reading between turns."""
+    app.transcripts = TranscriptRecorder(path)
+    rng = random.Random(seed)
+    plans = [
+        (rng.uniform(0, 2), [rng.uniform(0.5, 3.0) for _ in range(turns)])
+        for _ in range(sessions)
+    ]
+
+    def play(player):
+        delay, reading = plans[player]
+        time.sleep(delay)
+        request = SimpleNamespace(session_hash=f"sample-{player}")
+        history = []
+        for turn in range(turns):
+            message = ACTIONS[turn % len(ACTIONS)]
+            history.append([message, app.main_loop(message, history, request)])
+            time.sleep(reading[turn])
+
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        list(executor.map(play, range(sessions)))
+    app.transcripts.close()
+    app.transcripts = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("transcript", nargs="?", help="transcript file recorded with TRANSCRIPT_PATH")
+    parser.add_argument("--speedup", type=float, default=1.0, help="replay this many times faster; 0 for no waits")
+    parser.add_argument("--concurrency", type=int, default=32, help="sessions replayed at once")
+    parser.add_argument("--latency", type=float, default=0.2, help="mean time to first token (s)")
+    parser.add_argument("--distribution", default="lognormal", choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--spread", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--record-sample", metavar="FILE", help="record synthetic sessions to FILE instead")
+    parser.add_argument("--sessions", type=int, default=8, help="sessions to record with --record-sample")
+    parser.add_argument("--turns", type=int, default=12, help="turns per session with --record-sample")
+    parser.add_argument("--output", default="replay_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+    if not args.transcript and not args.record_sample:
+        parser.error("give a transcript to replay or --record-sample FILE")
+
+    latency = LatencyModel(args.latency, args.distribution, args.spread, seed=args.seed)
+    server = MockTogetherServer(
+        latency=latency, tokens_per_second=args.tokens_per_second,
+        failure_rate=args.failure_rate, seed=args.seed,
+    )
+    with server, tempfile.TemporaryDirectory() as tmp:
+        configure_client(server)
+        import app
+
+        app.world_path = os.path.join(tmp, "world.db")
+        save_world(make_world(), app.world_path)
+
+        if args.record_sample:
+            record_sample(app, args.record_sample, args.sessions, args.turns, args.seed)
+            print(f"recorded {args.sessions} sessions of {args.turns} turns to {args.record_sample}")
+            return
+
+        requests = server.requests
+        metrics = replay(app, load_sessions(args.transcript), args.speedup, args.concurrency)
+        metrics["model_calls_per_turn"] = (server.requests - requests) / metrics["turns"]
+        metrics["mock_failures"] = server.failures
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": vars(args).copy(),
+        "metrics": metrics,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    replayed, recorded = metrics["latency"], metrics["recorded_latency"]
+    print(f"{metrics['sessions']} sessions, {metrics['turns']} turns in {metrics['seconds']:.1f}s: "
+          f"{metrics['turns_per_second']:.1f} turns/s, {metrics['errors']} errors")
+    print(f"turn latency  replayed p50 {replayed['p50'] * 1000:6.0f}ms  p95 {replayed['p95'] * 1000:6.0f}ms  "
+          f"p99 {replayed['p99'] * 1000:6.0f}ms")
+    print(f"              recorded p50 {recorded['p50'] * 1000:6.0f}ms  p95 {recorded['p95'] * 1000:6.0f}ms  "
+          f"p99 {recorded['p99'] * 1000:6.0f}ms")
+    if "lag" in metrics:
+        print(f"behind schedule: p95 {metrics['lag']['p95'] * 1000:.0f}ms  max {metrics['lag']['max'] * 1000:.0f}ms")
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+End-to-end benchmark suite against the local mock Together server.
+
+Measures FantasyWorldGenerator.generate wall time, per-turn main_loop
+latency percentiles for a single player and throughput with N concurrent
+players. Results are written as JSON; pass --compare with an earlier
+results file to print the change of every metric. With --structured-turns
+the turns get the narration and inventory changes from one model call.
+
+Usage: python -m benchmarks.run_benchmarks [--players 8] [--structured-turns] [--output bench_results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from benchmarks.mock_together_server import LatencyModel, MockTogetherServer
+
+ACTIONS = [
+    "start game",
+    "Look around",
+    "I walk to the market",
+    "I pick up the lantern",
+    "Continue the story",
+    "I ask the merchant about the beast",
+]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+
+    def percentile(p):
+        index = min(len(samples) - 1, max(0, round(p / 100 * len(samples)) - 1))
+        return samples[index]
+
+    return {
+        "count": len(samples),
+        "mean": statistics.fmean(samples),
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": samples[-1],
+    }
+
+
+def configure_client(server):
+    """Point the shared client at the mock server, with no response cache."""
+    import llm_client
+    from llm_cache import CompletionCache
+
+    os.environ["TOGETHER_BASE_URL"] = server.base_url
+    os.environ["TOGETHER_AI_API_KEY"] = "mock"
+    llm_client.reset_clients()
+    llm_client.set_completion_cache(CompletionCache(mode="off"))
+
+
+def bench_world_generation(world_path, max_workers):
+    from fantasy_world_generator import FantasyWorldGenerator
+
+    generator = FantasyWorldGenerator(api_key="mock", max_workers=max_workers)
+    start = time.perf_counter()
+    world = generator.generate(world_path)
+    return world, time.perf_counter() - start
+
+
+def play(main_loop, player, turns):
+    request = SimpleNamespace(session_hash=f"bench-{player}-{time.monotonic_ns()}")
+    history, latencies = [], []
+    for turn in range(turns):
+        message = ACTIONS[turn % len(ACTIONS)]
+        start = time.perf_counter()
+        output = main_loop(message, history, request)
+        latencies.append(time.perf_counter() - start)
+        history.append([message, output])
+    return latencies
+
+
+def bench_players(main_loop, players, turns):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=players) as executor:
+        results = list(executor.map(lambda player: play(main_loop, player, turns), range(players)))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for result in results for latency in result]
+    return {
+        "players": players,
+        "turns": len(latencies),
+        "seconds": elapsed,
+        "turns_per_second": len(latencies) / elapsed,
+        "latency": summarize(latencies),
+    }
+
+
+def run(args):
+    latency = LatencyModel(args.latency, args.distribution, args.spread, seed=args.seed)
+    server = MockTogetherServer(
+        latency=latency, tokens_per_second=args.tokens_per_second,
+        failure_rate=args.failure_rate, seed=args.seed,
+    )
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": vars(args).copy(),
+        "metrics": {},
+    }
+    metrics = results["metrics"]
+
+    with server, tempfile.TemporaryDirectory() as tmp:
+        configure_client(server)
+        from world_store import save_world
+
+        world_path = os.path.join(tmp, "world.db")
+
+        _, metrics["world_generation_sequential_s"] = bench_world_generation(world_path, 1)
+        world, metrics["world_generation_concurrent_s"] = bench_world_generation(world_path, 4)
+        world["start"] = "You stand at the gates of the city."
+        save_world(world, world_path)
+
+        import app
+
+        app.world_path = world_path
+        app.structured_turns = args.structured_turns
+        requests, calls_by_kind = server.requests, dict(server.calls_by_kind)
+        single = bench_players(app.main_loop, 1, args.turns)
+        metrics["turn_latency_s"] = single["latency"]
+        concurrent = bench_players(app.main_loop, args.players, args.turns)
+        metrics["concurrent_players"] = concurrent
+        turns = single["turns"] + concurrent["turns"]
+        turn_calls = {kind: count - calls_by_kind.get(kind, 0) for kind, count in server.calls_by_kind.items()}
+        metrics["model_calls_per_turn"] = (server.requests - requests) / turns
+        metrics["generation_calls_per_turn"] = sum(
+            turn_calls.get(kind, 0) for kind in ("narration", "turn", "inventory")
+        ) / turns
+        metrics["mock_requests"] = server.requests
+        metrics["mock_failures"] = server.failures
+
+    if args.instrument:
+        import instrumentation
+
+        results["instrumentation"] = instrumentation.registry.snapshot()
+
+    return results
+
+
+def flatten(metrics, prefix=""):
+    flat = {}
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{name}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{name}"] = value
+    return flat
+
+
+def compare(previous, current):
+    before, after = flatten(previous["metrics"]), flatten(current["metrics"])
+    print(f"\n{'metric':48} {'before':>10} {'after':>10} {'change':>8}")
+    for name, value in after.items():
+        if name not in before:
+            continue
+        change = (value - before[name]) / before[name] if before[name] else 0.0
+        print(f"{name:48} {before[name]:10.4f} {value:10.4f} {change:+8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency", type=float, default=0.1, help="mean time to first token (s)")
+    parser.add_argument("--distribution", default="lognormal", choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--spread", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--players", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--structured-turns", action="store_true",
+                        help="one model call per turn for the narration and inventory changes")
+    parser.add_argument("--instrument", action="store_true",
+                        help="enable per-stage instrumentation and include it in the results")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    if args.instrument:
+        import instrumentation
+
+        instrumentation.enable()
+    results = run(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    metrics = results["metrics"]
+    print(f"world generation: sequential {metrics['world_generation_sequential_s']:.2f}s, "
+          f"concurrent {metrics['world_generation_concurrent_s']:.2f}s")
+    turn = metrics["turn_latency_s"]
+    print(f"turn latency: p50 {turn['p50'] * 1000:.0f}ms  p95 {turn['p95'] * 1000:.0f}ms  "
+          f"p99 {turn['p99'] * 1000:.0f}ms")
+    players = metrics["concurrent_players"]
+    print(f"{players['players']} players: {players['turns_per_second']:.1f} turns/s, "
+          f"p95 {players['latency']['p95'] * 1000:.0f}ms")
+    print(f"model calls per turn: {metrics['model_calls_per_turn']:.2f} "
+          f"({metrics['generation_calls_per_turn']:.2f} generation)")
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Offline stand-in for the Together client used by the benchmarks.
+
+Responses are canned but follow the output formats the game's prompts ask
+for, and every call sleeps for a configurable latency so wall-clock effects
+of concurrency can be measured without touching the real API. Streaming
+responses are returned right away, as the real client returns once the
+response headers arrive, then wait `latency` before the first token and
+`token_delay` between tokens; blocking responses wait for the equivalent
+total time.
+"""
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from together import error
+
+
+def _entities(kind, count=3, prefix=""):
+    blocks = []
+    for i in range(1, count + 1):
+        blocks.append(
+            f"{kind} {i} Name: Stub {kind} {prefix}{i}\n"
+            f"{kind} {i} Description: A quiet {kind.lower()} used for benchmarks."
+        )
+    return "\n\n".join(blocks)
+
+
+def _batched_entities(kind, prompt, parent_kind):
+    """
+    Entities for every parent listed in a batched prompt, in sections
+    headed by the parent's name.
+    """
+    count = int(re.search(r"Create (\d+) different", prompt).group(1))
+    parents = re.findall(rf"^\s*{parent_kind} Name: (.+)$", prompt, re.MULTILINE)
+    if "for each of the" not in prompt:
+        prefix = f"{parents[-1]} " if parents else ""
+        return _entities(kind, count, prefix)
+    sections = [
+        f"{parent_kind}: {parent}\n" + _entities(kind, count, f"{parent} ")
+        for parent in parents
+    ]
+    return "\n\n".join(sections)
+
+
+NARRATION = (
+    "You look around and see a busy market square. "
+    "Merchants call out their prices over the noise of the crowd. "
+    "A cart rolls past, heading for the city gates."
+)
+# For actions that pick something up, so inventory detection has work to do.
+PICKUP_NARRATION = (
+    "You pick up the lantern from the stall and hang it from your belt. "
+    "Its light shows a narrow path behind the market."
+)
+pickup_action = re.compile(r"\b(?:pick up|take|grab)\b", re.IGNORECASE)
+
+
+def narration_for(messages):
+    if messages and pickup_action.search(messages[-1]["content"]):
+        return PICKUP_NARRATION
+    return NARRATION
+
+
+def request_kind(messages):
+    prompt = messages[-1]["content"]
+    if re.search(r"Create \d+ different kingdoms", prompt):
+        return "kingdoms"
+    if re.search(r"Create \d+ different towns", prompt):
+        return "towns"
+    if re.search(r"Create \d+ different characters", prompt):
+        return "npcs"
+    if "fantasy world" in prompt:
+        return "world"
+    if prompt == "Inventory Updates":
+        return "inventory"
+    if '"narration"' in messages[0]["content"]:
+        return "turn"
+    return "narration"
+
+
+def canned_response(kind, client, messages=None):
+    prompt = messages[-1]["content"] if messages else ""
+    if kind == "kingdoms":
+        count = int(re.search(r"Create (\d+) different", prompt).group(1)) if prompt else 3
+        return _entities("Kingdom", count)
+    if kind == "towns":
+        return _batched_entities("Town", prompt, "Kingdom")
+    if kind == "npcs":
+        return _batched_entities("Character", prompt, "Town")
+    if kind == "world":
+        return "World Name: Stubworld\nWorld Description: A world for benchmarks."
+    if kind == "inventory":
+        return client.inventory_response
+    narration = narration_for(messages)
+    if kind == "turn":
+        if client.turn_response is not None:
+            return client.turn_response
+        # The same item updates inventory detection would find.
+        item_updates = json.loads(client.inventory_response)["itemUpdates"] if narration == PICKUP_NARRATION else []
+        return json.dumps({"narration": narration, "itemUpdates": item_updates})
+    return narration
+
+
+def split_tokens(text):
+    words = text.split(" ")
+    return [word + " " for word in words[:-1]] + words[-1:]
+
+
+class _ChatCompletions:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model, messages, stream=False, **kwargs):
+        kind = request_kind(messages)
+        self._client.record_call(kind)
+        latency = self._client.latency_for(kind, model)
+        content = canned_response(kind, self._client, messages)
+        if stream:
+            return self._stream(content, latency)
+        # A blocking call returns once the whole response has been generated.
+        time.sleep(latency + self._client.token_delay * (len(split_tokens(content)) - 1))
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))]
+        )
+
+    def _stream(self, content, latency):
+        time.sleep(latency)
+        for i, token in enumerate(split_tokens(content)):
+            if i:
+                time.sleep(self._client.token_delay)
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=token))]
+            )
+
+
+class _Completions:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model, prompt, **kwargs):
+        self._client.record_call("safety")
+        time.sleep(self._client.latency_for("safety", model))
+        return SimpleNamespace(choices=[SimpleNamespace(text=self._client.safety_verdict)])
+
+
+class StubTogether:
+    """
+    latencies overrides the latency per request kind: "world", "kingdoms",
+    "towns", "npcs", "narration", "turn", "inventory" or "safety", and
+    model_latencies the latency per model, over both.
+
+    turn_response replaces the canned response to structured turns.
+
+    fail_after makes every call after that many fail with an outage error;
+    error_rate makes that fraction of calls fail with a rate-limit error.
+    """
+
+    def __init__(self, latency=0.05, token_delay=0.01, latencies=None, model_latencies=None,
+                 safety_verdict="safe", inventory_response='{"itemUpdates": []}', turn_response=None,
+                 fail_after=None, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.latencies = latencies or {}
+        self.model_latencies = model_latencies or {}
+        self.safety_verdict = safety_verdict
+        self.inventory_response = inventory_response
+        self.turn_response = turn_response
+        self.fail_after = fail_after
+        self.error_rate = error_rate
+        self.errors = 0
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.calls_by_kind = {}
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_ChatCompletions(self))
+        self.completions = _Completions(self)
+
+    def latency_for(self, kind, model=None):
+        if model in self.model_latencies:
+            return self.model_latencies[model]
+        return self.latencies.get(kind, self.latency)
+
+    def record_call(self, kind):
+        with self._lock:
+            if self.fail_after is not None and self.calls >= self.fail_after:
+                self.errors += 1
+                raise error.ServiceUnavailableError("stub outage")
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                raise error.RateLimitError("stub rate limit")
+            self.calls += 1
+            self.calls_by_kind[kind] = self.calls_by_kind.get(kind, 0) + 1
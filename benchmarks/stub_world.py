@@ -0,0 +1,27 @@
+"""Small generated world for benchmarks that need a GeneratedWorld.json."""
+import json
+
+
+def make_world(kingdoms=3, towns=3, npcs=3):
+    world = {
+        "name": "Stubworld",
+        "description": "A world for benchmarks.",
+        "start": "You wake up in the market square of Stub Town 1.",
+        "kingdoms": {},
+    }
+    for k in range(1, kingdoms + 1):
+        kingdom = {"name": f"Kingdom {k}", "description": f"Kingdom {k} description.", "towns": {}}
+        for t in range(1, towns + 1):
+            town = {"name": f"Town {k}.{t}", "description": f"Town {k}.{t} description.", "npcs": {}}
+            for n in range(1, npcs + 1):
+                name = f"Character {k}.{t}.{n}"
+                town["npcs"][name] = {"name": name, "description": f"{name} description."}
+            kingdom["towns"][town["name"]] = town
+        world["kingdoms"][kingdom["name"]] = kingdom
+    return world
+
+
+def write_world(path, **sizes):
+    with open(path, "w") as f:
+        json.dump(make_world(**sizes), f)
+    return path
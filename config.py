@@ -0,0 +1,35 @@
+import os
+import threading
+from dotenv import load_dotenv, find_dotenv
+
+
+# these expect to find a .env file at the directory above the lesson.                                                         
+# the format for that file is (without the comment)                                                                           
+# API_KEYNAME=AStringThatIsTheLongAPIKeyFromSomeService                                                                                                                                     
+def load_env():
+    _ = load_dotenv(find_dotenv())
+
+_env_loaded = False
+_env_lock = threading.Lock()
+
+def load_env_once():
+    """
+    Load the .env file the first time configuration is needed.
+    find_dotenv walks the filesystem, so it shouldn't run on every call.
+    """
+    global _env_loaded
+    if _env_loaded:
+        return
+    with _env_lock:
+        if not _env_loaded:
+            load_env()
+            _env_loaded = True
+
+def get_together_api_key():
+     load_env_once()
+     together_api_key = os.getenv("TOGETHER_AI_API_KEY")
+     return together_api_key
+
+def get_setting(name, default=None):
+    load_env_once()
+    return os.getenv(name, default)
@@ -0,0 +1,117 @@
+import copy
+import logging
+
+from helper import build_messages, summarize_history
+
+logger = logging.getLogger(__name__)
+
+# Room left for the summary when deciding how much to fold: summarize_history
+# asks for 2-5 sentences.
+SUMMARY_TOKENS = 160
+
+
+def estimate_tokens(text):
+    # Llama 3 averages roughly four characters per token for English prose.
+    return max(1, len(text) // 4)
+
+
+def messages_tokens(messages):
+    # A few tokens of framing per message on top of the content.
+    return sum(estimate_tokens(message["content"]) + 4 for message in messages)
+
+
+class ConversationContext:
+    """
+    Keeps a session's prompt to a bounded size.
+
+    The last keep_last exchanges are sent verbatim; anything older is folded
+    into a running summary. Folding happens in batches of fold_batch
+    exchanges, or sooner when the prompt would exceed token_budget, so the
+    summary is only updated every few turns. One instance is kept per
+    session so the summary isn't recomputed every turn.
+
+    With a lore index (see lore_index), the entries most relevant to the
+    player's message and the last exchange are added, up to lore_budget
+    tokens. The player's own kingdom, town and character are already in
+    the prompt and are not repeated.
+    """
+
+    def __init__(self, token_budget=2048, keep_last=6, fold_batch=4, summarize=summarize_history,
+                 lore=None, lore_budget=256, lore_k=5):
+        self.token_budget = token_budget
+        self.keep_last = keep_last
+        self.fold_batch = fold_batch
+        self.summarize = summarize
+        self.lore = lore
+        self.lore_budget = lore_budget
+        self.lore_k = lore_k
+        self.summary = None
+        self.folded_turns = 0
+        self.prompt_tokens = []
+        self._estimated_tokens = 0
+
+    def build_messages(self, message, history, game_state):
+        if len(history) < self.folded_turns:
+            # The chat was cleared or rewound; start the summary over.
+            self.summary = None
+            self.folded_turns = 0
+
+        unfolded = len(history) - self.folded_turns
+        if unfolded - self.keep_last >= self.fold_batch:
+            self._fold(history, len(history) - self.keep_last)
+
+        lore = self.relevant_lore(message, history, game_state)
+        messages = build_messages(message, history[self.folded_turns:], game_state, self.summary, lore)
+        # Still over budget (long messages): fold as many recent turns as it
+        # takes, with one summary call.
+        if messages_tokens(messages) > self.token_budget and self.folded_turns < len(history):
+            self._fold(history, self._fold_end(message, history, game_state, lore))
+            messages = build_messages(message, history[self.folded_turns:], game_state, self.summary, lore)
+
+        self._estimated_tokens = messages_tokens(messages)
+        return messages
+
+    def relevant_lore(self, message, history, game_state):
+        if self.lore is None:
+            return None
+        query = " ".join([message, *(part for part in (history[-1] if history else []) if part)])
+        location = game_state.get("location")
+        exclude = []
+        if location:
+            kingdom, town, character = location["kingdom"], location["town"], location["character"]
+            exclude = [(kingdom,), (kingdom, town), (kingdom, town, character)]
+        return self.lore.select(query, self.lore_budget, self.lore_k, exclude)
+
+    def copy(self):
+        """An independent copy, e.g. to build a turn that may be thrown away."""
+        context = copy.copy(self)
+        context.prompt_tokens = list(self.prompt_tokens)
+        return context
+
+    def record_usage(self, usage):
+        """
+        Record the prompt size of the turn just sent, preferring the token
+        count reported by the API over the local estimate.
+        """
+        tokens = getattr(usage, "prompt_tokens", None) or self._estimated_tokens
+        self.prompt_tokens.append(tokens)
+        logger.debug("prompt tokens: %d (summary covers %d turns)", tokens, self.folded_turns)
+
+    def _fold_end(self, message, history, game_state, lore):
+        """
+        The first turn to keep verbatim so that the prompt, with the summary
+        in place of the turns before it, fits token_budget.
+        """
+        summary_tokens = max(SUMMARY_TOKENS, estimate_tokens(self.summary or "") + 8)
+        tokens = messages_tokens(build_messages(message, history[self.folded_turns:], game_state, None, lore))
+        tokens += summary_tokens
+        end = self.folded_turns
+        while tokens > self.token_budget and end < len(history):
+            player, response = history[end]
+            tokens -= estimate_tokens(player) + estimate_tokens(response) + 8
+            end += 1
+        return max(end, self.folded_turns + 1)
+
+    def _fold(self, history, end):
+        self.summary = self.summarize(self.summary, history[self.folded_turns:end])
+        self.folded_turns = end
@@ -1,16 +1,25 @@
-import json
+import logging
 import random
-from helper import (
-    load_world, save_world
-)
-from together import Together
+from instrumentation import traced
+from inventory_filter import may_change_inventory
+from llm_client import get_async_client, get_client
+from model_registry import call_model, call_model_async
+from world_store import open_world_store, save_world
+
+logger = logging.getLogger(__name__)
 
 class FantasyGameMaster:
-    def __init__(self, api_key, world_path, output_path):
-        self.client = Together(api_key=api_key)
+    def __init__(self, api_key, world_path, output_path, prefilter=False, store=None):
+        self.api_key = api_key
+        self.client = get_client(api_key)
+        # With prefilter, skip the model call for narrations that can't
+        # plausibly change the inventory (see inventory_filter).
+        self.prefilter = prefilter
         self.world_path = world_path
         self.output_path = output_path
-        self.world = load_world(world_path)
+        # Nodes are read from the store as they are needed; pass store to
+        # share one already open store between game masters.
+        self.store = store if store is not None else open_world_store(world_path)
         self.system_prompt = """You are an AI Game master. Your job is to create a 
         start to an adventure based on the world, kingdom, town, and character 
         a player is playing as. 
@@ -47,20 +56,53 @@ class FantasyGameMaster:
         }
         """
 
-    def detect_inventory_changes(self, inventory, output):
-        messages = [
+    def inventory_messages(self, inventory, output):
+        return [
             {"role": "system", "content": self.inventory_prompt},
             {"role": "user", "content": f"Current Inventory: {str(inventory)}"},
             {"role": "user", "content": f"Recent Story: {output}"},
             {"role": "user", "content": "Inventory Updates"},
         ]
-        chat_completion = self.client.chat.completions.create(
-            model="meta-llama/Llama-3-70b-chat-hf",
+
+    @traced("detect_inventory_changes")
+    def detect_inventory_changes(self, inventory, output):
+        if self.prefilter and not may_change_inventory(inventory, output):
+            return []
+
+        chat_completion = call_model(
+            "inventory", self.client.chat.completions.create,
             temperature=0.0,
-            messages=messages,
+            messages=self.inventory_messages(inventory, output),
         )
-        response = chat_completion.choices[0].message.content
-        return json.loads(response).get("itemUpdates", [])
+        return self.read_item_updates(chat_completion.choices[0].message.content)
+
+    @traced("detect_inventory_changes")
+    async def detect_inventory_changes_async(self, inventory, output):
+        if self.prefilter and not may_change_inventory(inventory, output):
+            return []
+
+        # The async client is looked up per call: it is bound to the
+        # running event loop's connection pool.
+        chat_completion = await call_model_async(
+            "inventory", get_async_client(self.api_key).chat.completions.create,
+            temperature=0.0,
+            messages=self.inventory_messages(inventory, output),
+        )
+        return self.read_item_updates(chat_completion.choices[0].message.content)
+
+    def read_item_updates(self, response):
+        """
+        Valid item updates in a detection response. A response that can't
+        be read changes nothing instead of failing the turn.
+        """
+        # pydantic is slow to import, so it is loaded with the first turn.
+        from structured_turn import parse_item_updates
+
+        try:
+            return parse_item_updates(response)
+        except ValueError as e:
+            logger.warning("Ignoring unreadable inventory updates (%s): %r", e, response[:200])
+            return []
 
     def update_inventory(self, inventory, item_updates):
         update_msg = ""
@@ -85,58 +127,64 @@ class FantasyGameMaster:
         item_updates = self.detect_inventory_changes(game_state["inventory"], output)
         return self.update_inventory(game_state["inventory"], item_updates)
 
+    @property
+    def world(self):
+        """The whole world as a nested dict. Reads every node of the store."""
+        return self.store.to_dict()
+
     def select_kingdom_town_character(self):
         """
         Dynamically select a kingdom, town, and character from the world.
         """
-        kingdoms = self.world.get('kingdoms', {})
+        kingdoms = self.store.kingdom_names()
         if not kingdoms:
             raise ValueError("No kingdoms found in the world.")
 
         # Select a kingdom
-        kingdom_name = input(f"Available Kingdoms: {list(kingdoms.keys())}\nSelect a kingdom: ") or random.choice(list(kingdoms.keys()))
-        kingdom = kingdoms.get(kingdom_name)
-        if not kingdom:
+        kingdom_name = input(f"Available Kingdoms: {kingdoms}\nSelect a kingdom: ") or random.choice(kingdoms)
+        if kingdom_name not in kingdoms:
             raise ValueError(f"Kingdom '{kingdom_name}' not found in the world.")
+        kingdom = self.store.kingdom(kingdom_name)
 
         # Select a town
-        towns = kingdom.get('towns', {})
+        towns = self.store.town_names(kingdom_name)
         if not towns:
             raise ValueError(f"No towns found in the kingdom '{kingdom_name}'.")
         
-        town_name = input(f"Available Towns in {kingdom_name}: {list(towns.keys())}\nSelect a town: ") or random.choice(list(towns.keys()))
-        town = towns.get(town_name)
-        if not town:
+        town_name = input(f"Available Towns in {kingdom_name}: {towns}\nSelect a town: ") or random.choice(towns)
+        if town_name not in towns:
             raise ValueError(f"Town '{town_name}' not found in the kingdom '{kingdom_name}'.")
+        town = self.store.town(kingdom_name, town_name)
 
         # Select a character
-        npcs = town.get('npcs', {})
+        npcs = self.store.npc_names(kingdom_name, town_name)
         if not npcs:
             raise ValueError(f"No NPCs found in the town '{town_name}'.")
         
-        character_name = input(f"Available Characters in {town_name}: {list(npcs.keys())}\nSelect a character: ") or random.choice(list(npcs.keys()))
-        character = npcs.get(character_name)
-        if not character:
+        character_name = input(f"Available Characters in {town_name}: {npcs}\nSelect a character: ") or random.choice(npcs)
+        if character_name not in npcs:
             raise ValueError(f"Character '{character_name}' not found in the town '{town_name}'.")
+        character = self.store.npc(kingdom_name, town_name, character_name)
 
         return kingdom, town, character
 
-    def initialize_game(self):
-        """
-        Initialize the game setup with dynamic selection.
-        """
-        kingdom, town, character = self.select_kingdom_town_character()
+    @traced("generate_start")
+    def generate_start(self, kingdom, town, character):
+        """Generate an opening scene for playing character in town."""
+        # Only the node's own fields; children and stored scenes are left out.
+        def fields(node):
+            return {key: value for key, value in node.items() if key not in ("towns", "npcs", "starts")}
 
-        # Generate the starting adventure
         world_info = f"""
-        World: {self.world['description']}
-        Kingdom: {kingdom}
-        Town: {town}
-        Your Character: {character}
+        World: {self.store.get_meta('description')}
+        Kingdom: {fields(kingdom)}
+        Town: {fields(town)}
+        Your Character: {fields(character)}
         """
 
-        model_output = self.client.chat.completions.create(
-            model="meta-llama/Llama-3-70b-chat-hf",
+        # Opening scenes are made with the world, ahead of any player.
+        model_output = call_model(
+            "world_generation", self.client.chat.completions.create,
             temperature=1.0,
             messages=[
                 {"role": "system", "content": self.system_prompt},
@@ -144,14 +192,26 @@ class FantasyGameMaster:
             ],
         )
 
-        start = model_output.choices[0].message.content
+        return model_output.choices[0].message.content
+
+    @traced("initialize_game")
+    def initialize_game(self):
+        """
+        Initialize the game setup with dynamic selection.
+        """
+        kingdom, town, character = self.select_kingdom_town_character()
+        start = self.generate_start(kingdom, town, character)
 
-        # Update world with the starting point and save it
-        self.world['start'] = start
-        save_world(self.world, self.output_path)
+        # Update only the starting point, not the whole world
+        if self.output_path == self.world_path:
+            self.store.set_meta('start', start)
+        else:
+            world = self.store.to_dict()
+            world['start'] = start
+            save_world(world, self.output_path)
 
         return {
-            "world": self.world['description'],
+            "world": self.store.get_meta('description'),
             "kingdom": kingdom['description'],
             "town": town['description'],
             "character": character['description'],
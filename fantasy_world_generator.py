@@ -1,9 +1,75 @@
-from together import Together
-from helper import get_together_api_key, save_world
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from config import get_together_api_key
+from instrumentation import traced
+from llm_client import get_client
+from model_registry import call_model
+from request_scheduler import BACKGROUND, priority
+from world_parser import normalize_name, parse_entities
+from world_store import SqliteWorldStore, save_world
+
+class GenerationCheckpoint:
+    """
+    Completed nodes of a world being generated, written to an SQLite world
+    store as soon as each one finishes, so an interrupted generation can
+    resume where it stopped. A node's children are only marked done once
+    all of them have been stored.
+    """
+
+    MARKER = "checkpoint:"
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.store = SqliteWorldStore(path)
+
+    def world(self):
+        world = self.store.to_dict()
+        return {key: value for key, value in world.items() if not key.startswith(self.MARKER)}
+
+    def is_done(self, *node):
+        return bool(self.store.get_meta(self.MARKER + "/".join(node)))
+
+    def save_world_info(self, world):
+        for key, value in world.items():
+            if key != "kingdoms":
+                self.store.set_meta(key, value)
+        self.store.set_meta(self.MARKER + "world", True)
+
+    def save_kingdoms(self, kingdoms):
+        for kingdom in kingdoms.values():
+            self.store.put_kingdom(kingdom)
+        self.store.set_meta(self.MARKER + "kingdoms", True)
+
+    def save_towns(self, kingdom, towns):
+        for town in towns.values():
+            self.store.put_town(kingdom["name"], town)
+        self.store.set_meta(self.MARKER + "towns/" + kingdom["name"], True)
+
+    def save_npcs(self, kingdom, town, npcs):
+        for npc in npcs.values():
+            self.store.put_npc(kingdom["name"], town["name"], npc)
+        self.store.set_meta(self.MARKER + "npcs/" + kingdom["name"] + "/" + town["name"], True)
+
+    def remove(self):
+        self.store.close()
+        if self.path != ":memory:":
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
 
 class FantasyWorldGenerator:
-    def __init__(self, api_key):
-        self.client = Together(api_key=api_key)
+    def __init__(self, api_key, max_workers=4, kingdoms=3, towns=3, npcs=3, batch_size=1):
+        self.client = get_client(api_key)
+        # Upper bound on in-flight completion calls when generating concurrently.
+        # Set to 1 to generate the world one call at a time.
+        self.max_workers = max_workers
+        # World size: kingdoms in the world, towns per kingdom, NPCs per town.
+        self.kingdom_count = kingdoms
+        self.town_count = towns
+        self.npc_count = npcs
+        # How many parents' children to ask for in a single request.
+        self.batch_size = max(1, batch_size)
         self.system_prompt = """
         Your job is to help create interesting fantasy worlds that players would love to play in.
         Instructions:
@@ -15,6 +81,24 @@ class FantasyWorldGenerator:
     def create_prompt(self, template, **kwargs):
         return template.format(**kwargs)
 
+    def output_form(self, kind, count, indent):
+        lines = []
+        for i in range(1, count + 1):
+            lines.append(f"{kind} {i} Name: <{kind.upper()} NAME>")
+            lines.append(f"{kind} {i} Description: <{kind.upper()} DESCRIPTION>")
+        return f"\n{indent}".join(lines)
+
+    def complete(self, prompt):
+        response = call_model(
+            "world_generation", self.client.chat.completions.create,
+            messages=[
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+        )
+        return response.choices[0].message.content.strip()
+
+    @traced("generate_world")
     def generate_world(self):
         world_prompt = """
         Generate a creative description for a unique fantasy world with an
@@ -26,72 +110,48 @@ class FantasyWorldGenerator:
 
         World Name:
         """
-        response = self.client.chat.completions.create(
-            model="meta-llama/Llama-3-70b-chat-hf",
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": world_prompt}
-            ],
-        )
-        world_output = response.choices[0].message.content.strip()
-        return {
-            "name": world_output.split('\n')[0].replace('World Name: ', '').strip(),
-            "description": '\n'.join(world_output.split('\n')[1:]).replace('World Description:', '').strip()
-        }
+        world_output = self.complete(world_prompt)
+        worlds = parse_entities("World", world_output)
+        if not worlds:
+            raise ValueError(f"Could not parse a world from: {world_output!r}")
+        return dict(worlds[0][1])
 
+    @traced("generate_kingdoms")
     def generate_kingdoms(self, world):
         kingdom_prompt = self.create_prompt(
             """
-            Create 3 different kingdoms for a fantasy world.
+            Create {count} different kingdoms for a fantasy world.
             For each kingdom generate a description based on the world it's in. 
             Describe important leaders, cultures, history of the kingdom.
 
             Output content in the form:
-            Kingdom 1 Name: <KINGDOM NAME>
-            Kingdom 1 Description: <KINGDOM DESCRIPTION>
-            Kingdom 2 Name: <KINGDOM NAME>
-            Kingdom 2 Description: <KINGDOM DESCRIPTION>
-            Kingdom 3 Name: <KINGDOM NAME>
-            Kingdom 3 Description: <KINGDOM DESCRIPTION>
+            {output_form}
 
             World Name: {name}
             World Description: {description}
 
             Kingdom 1
             """,
+            count=self.kingdom_count,
+            output_form=self.output_form("Kingdom", self.kingdom_count, " " * 12),
             name=world["name"],
             description=world["description"],
         )
-        response = self.client.chat.completions.create(
-            model="meta-llama/Llama-3-70b-chat-hf",
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": kingdom_prompt}
-            ],
-        )
-        kingdoms_output = response.choices[0].message.content.strip()
         kingdoms = {}
-        for block in kingdoms_output.split('\n\n'):
-            lines = block.strip().split('\n')
-            name = lines[0].replace('Name: ', '').strip()
-            description = lines[1].replace('Description: ', '').strip()
-            kingdoms[name] = {"name": name, "description": description, "towns": {}}
+        for _, kingdom in parse_entities("Kingdom", self.complete(kingdom_prompt))[:self.kingdom_count]:
+            kingdoms[kingdom["name"]] = {**kingdom, "towns": {}}
         return kingdoms
 
+    @traced("generate_towns")
     def generate_towns(self, world, kingdom):
         town_prompt = self.create_prompt(
             """
-            Create 3 different towns for a fantasy kingdom and world.
+            Create {count} different towns for a fantasy kingdom and world.
             Describe the region it's in, important places of the town, 
             and interesting history about it.
 
             Output content in the form:
-            Town 1 Name: <TOWN NAME>
-            Town 1 Description: <TOWN DESCRIPTION>
-            Town 2 Name: <TOWN NAME>
-            Town 2 Description: <TOWN DESCRIPTION>
-            Town 3 Name: <TOWN NAME>
-            Town 3 Description: <TOWN DESCRIPTION>
+            {output_form}
 
             World Name: {world_name}
             World Description: {world_description}
@@ -100,41 +160,28 @@ class FantasyWorldGenerator:
 
             Town 1 Name:
             """,
+            count=self.town_count,
+            output_form=self.output_form("Town", self.town_count, " " * 12),
             world_name=world["name"],
             world_description=world["description"],
             kingdom_name=kingdom["name"],
             kingdom_description=kingdom["description"],
         )
-        response = self.client.chat.completions.create(
-            model="meta-llama/Llama-3-70b-chat-hf",
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": town_prompt}
-            ],
-        )
-        towns_output = response.choices[0].message.content.strip()
         towns = {}
-        for block in towns_output.split('\n\n'):
-            lines = block.strip().split('\n')
-            name = lines[0].replace('Name: ', '').strip()
-            description = lines[1].replace('Description: ', '').strip()
-            towns[name] = {"name": name, "description": description}
+        for _, town in parse_entities("Town", self.complete(town_prompt))[:self.town_count]:
+            towns[town["name"]] = town
         return towns
 
+    @traced("generate_npcs")
     def generate_npcs(self, world, kingdom, town):
         npc_prompt = self.create_prompt(
             """
-            Create 3 different characters based on the world, kingdom 
+            Create {count} different characters based on the world, kingdom 
             and town they're in. Describe the character's appearance and 
             profession, as well as their deeper pains and desires.
 
             Output content in the form:
-            Character 1 Name: <CHARACTER NAME>
-            Character 1 Description: <CHARACTER DESCRIPTION>
-            Character 2 Name: <CHARACTER NAME>
-            Character 2 Description: <CHARACTER DESCRIPTION>
-            Character 3 Name: <CHARACTER NAME>
-            Character 3 Description: <CHARACTER DESCRIPTION>
+            {output_form}
 
             World Name: {world_name}
             World Description: {world_description}
@@ -145,6 +192,8 @@ class FantasyWorldGenerator:
 
             Character 1 Name:
             """,
+            count=self.npc_count,
+            output_form=self.output_form("Character", self.npc_count, " " * 12),
             world_name=world["name"],
             world_description=world["description"],
             kingdom_name=kingdom["name"],
@@ -152,32 +201,195 @@ class FantasyWorldGenerator:
             town_name=town["name"],
             town_description=town["description"],
         )
-        response = self.client.chat.completions.create(
-            model="meta-llama/Llama-3-70b-chat-hf",
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": npc_prompt}
-            ],
-        )
-        npcs_output = response.choices[0].message.content.strip()
         npcs = {}
-        for block in npcs_output.split('\n\n'):
-            lines = block.strip().split('\n')
-            name = lines[0].replace('Name: ', '').strip()
-            description = lines[1].replace('Description: ', '').strip()
-            npcs[name] = {"name": name, "description": description}
+        for _, npc in parse_entities("Character", self.complete(npc_prompt))[:self.npc_count]:
+            npcs[npc["name"]] = npc
         return npcs
 
-    def generate(self, output_path):
-        world = self.generate_world()
-        world["kingdoms"] = self.generate_kingdoms(world)
+    @traced("generate_towns_batch")
+    def generate_towns_batch(self, world, kingdoms):
+        """
+        Towns for several kingdoms in one request. Returns one towns dict
+        per kingdom, in order.
+        """
+        if len(kingdoms) == 1:
+            return [self.generate_towns(world, kingdoms[0])]
+
+        parents = "\n".join(
+            f"Kingdom Name: {kingdom['name']}\nKingdom Description: {kingdom['description']}\n"
+            for kingdom in kingdoms
+        )
+        town_prompt = self.create_prompt(
+            """
+            Create {count} different towns for each of the kingdoms below, in a fantasy world.
+            Describe the region it's in, important places of the town, 
+            and interesting history about it.
 
-        for kingdom in world["kingdoms"].values():
-            kingdom["towns"] = self.generate_towns(world, kingdom)
-            for town in kingdom["towns"].values():
-                town["npcs"] = self.generate_npcs(world, kingdom, town)
+            Output content in the form, repeated for every kingdom:
+            Kingdom: <KINGDOM NAME>
+            {output_form}
 
+            World Name: {world_name}
+            World Description: {world_description}
+
+            {parents}
+            """,
+            count=self.town_count,
+            output_form=self.output_form("Town", self.town_count, " " * 12),
+            world_name=world["name"],
+            world_description=world["description"],
+            parents=parents,
+        )
+        entities = parse_entities("Town", self.complete(town_prompt), parent_kind="Kingdom")
+        towns = self.assign_to_parents([kingdom["name"] for kingdom in kingdoms], entities, self.town_count)
+        # Ask again, one kingdom at a time, for any the model skipped.
+        return [
+            found or self.generate_towns(world, kingdom)
+            for kingdom, found in zip(kingdoms, towns)
+        ]
+
+    @traced("generate_npcs_batch")
+    def generate_npcs_batch(self, world, places):
+        """
+        NPCs for several (kingdom, town) pairs in one request. Returns one
+        NPCs dict per pair, in order.
+        """
+        if len(places) == 1:
+            return [self.generate_npcs(world, *places[0])]
+
+        parents = "\n".join(
+            f"Kingdom Name: {kingdom['name']}\nTown Name: {town['name']}\n"
+            f"Town Description: {town['description']}\n"
+            for kingdom, town in places
+        )
+        npc_prompt = self.create_prompt(
+            """
+            Create {count} different characters for each of the towns below, based on
+            the world, kingdom and town they're in. Describe the character's appearance and 
+            profession, as well as their deeper pains and desires.
+
+            Output content in the form, repeated for every town:
+            Town: <TOWN NAME>
+            {output_form}
+
+            World Name: {world_name}
+            World Description: {world_description}
+
+            {parents}
+            """,
+            count=self.npc_count,
+            output_form=self.output_form("Character", self.npc_count, " " * 12),
+            world_name=world["name"],
+            world_description=world["description"],
+            parents=parents,
+        )
+        entities = parse_entities("Character", self.complete(npc_prompt), parent_kind="Town")
+        npcs = self.assign_to_parents([town["name"] for _, town in places], entities, self.npc_count)
+        return [
+            found or self.generate_npcs(world, kingdom, town)
+            for (kingdom, town), found in zip(places, npcs)
+        ]
+
+    def assign_to_parents(self, parent_names, entities, count):
+        """
+        Group parsed (section, entity) pairs by parent. Sections are matched
+        to parents by name, and otherwise taken to follow the requested order.
+        """
+        indexes = {normalize_name(name): i for i, name in enumerate(parent_names)}
+        sections = {}
+        children = [{} for _ in parent_names]
+        for section, entity in entities:
+            key = normalize_name(section)
+            if key not in sections:
+                if key in indexes:
+                    sections[key] = indexes[key]
+                else:
+                    unused = [i for i in range(len(parent_names)) if i not in sections.values()]
+                    sections[key] = unused[0] if unused else None
+            index = sections[key]
+            if index is not None and len(children[index]) < count:
+                children[index][entity["name"]] = entity
+        return children
+
+    def map_batches(self, generate_batch, items):
+        """
+        Split items into batches of batch_size, run generate_batch on each,
+        concurrently when max_workers allows, and flatten the results back
+        into one result per item.
+        """
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        if self.max_workers and self.max_workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # Run each batch in a copy of this context so the request
+                # priority carries over to the worker threads.
+                futures = [
+                    executor.submit(contextvars.copy_context().run, generate_batch, batch)
+                    for batch in batches
+                ]
+                results = [future.result() for future in futures]
+        else:
+            results = [generate_batch(batch) for batch in batches]
+        return [result for batch_results in results for result in batch_results]
+
+    @traced("generate")
+    def generate(self, output_path, checkpoint=True):
+        """
+        Generate a world and save it to output_path. Progress is checkpointed
+        to <output_path>.checkpoint.db and a later call resumes from it; the
+        checkpoint is removed once the world is saved.
+        """
+        checkpoint = GenerationCheckpoint(output_path + ".checkpoint.db" if checkpoint else ":memory:")
+        # World generation yields to players' turns when requests queue up.
+        with priority(BACKGROUND):
+            world = self.build_world(checkpoint)
         save_world(world, output_path)
+        checkpoint.remove()
+        return world
+
+    def build_world(self, checkpoint=None):
+        """
+        Build the world in dependency stages: world, kingdoms, then all towns
+        and finally all NPCs. Siblings within a stage only depend on their
+        parent, so they are requested in batches that run in parallel.
+        Results are assigned in submission order, so the tree has the same
+        shape and key order however it was generated. Nodes already in
+        checkpoint are not generated again.
+        """
+        checkpoint = checkpoint or GenerationCheckpoint()
+        if not checkpoint.is_done("world"):
+            checkpoint.save_world_info(self.generate_world())
+        world = checkpoint.world()
+        if not checkpoint.is_done("kingdoms"):
+            checkpoint.save_kingdoms(self.generate_kingdoms(world))
+            world = checkpoint.world()
+        kingdoms = list(world["kingdoms"].values())
+
+        def towns_batch(batch):
+            results = self.generate_towns_batch(world, batch)
+            for kingdom, towns in zip(batch, results):
+                checkpoint.save_towns(kingdom, towns)
+            return results
+
+        pending = [kingdom for kingdom in kingdoms if not checkpoint.is_done("towns", kingdom["name"])]
+        for kingdom, kingdom_towns in zip(pending, self.map_batches(towns_batch, pending)):
+            kingdom["towns"] = kingdom_towns
+
+        def npcs_batch(batch):
+            results = self.generate_npcs_batch(world, batch)
+            for (kingdom, town), npcs in zip(batch, results):
+                checkpoint.save_npcs(kingdom, town, npcs)
+            return results
+
+        places = [
+            (kingdom, town)
+            for kingdom in kingdoms
+            for town in kingdom["towns"].values()
+            if not checkpoint.is_done("npcs", kingdom["name"], town["name"])
+        ]
+        for (kingdom, town), town_npcs in zip(places, self.map_batches(npcs_batch, places)):
+            town["npcs"] = town_npcs
+
+        return world
 
 # Usage
 if __name__ == "__main__":
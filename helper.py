@@ -1,72 +1,67 @@
 # Add your utilities or helper functions to this file.
 
-import os
+# Gradio and the Together SDK are slow to import, so they are only loaded
+# when the UI starts or the first model call is made.
+
+import asyncio
 import random
-from dotenv import load_dotenv, find_dotenv
+import re
 import json
-import gradio as gr
-from together import Together
-
-
-# these expect to find a .env file at the directory above the lesson.                                                         
-# the format for that file is (without the comment)                                                                           
-# API_KEYNAME=AStringThatIsTheLongAPIKeyFromSomeService                                                                                                                                     
-def load_env():
-    _ = load_dotenv(find_dotenv())
 
-def save_world(world, filename):
-    with open(filename, 'w+') as f:
-        json.dump(world, f)
+from config import get_setting
+from instrumentation import start_metrics_server, traced
+from llm_client import get_async_client, get_client
+from model_registry import LLAMA_3_70B, call_model, call_model_async
+from safety_cache import SafetyCache
+from world_store import as_world_store, open_world_store
 
-def load_world(filename):
-    with open(filename, 'r') as f:
-        return json.load(f)
+def get_game_state(inventory=None, world=None):
+    """
+    world can be a world dict or a world store; only the selected kingdom,
+    town and character are read from a store. The opening scene is one of
+    those precomputed for the character (see opening_scenes), or else the
+    world's shared start.
+    """
+    if world is None:
+        world = open_world_store('./GeneratedWorld.json')
+    store = as_world_store(world)
 
-def get_together_api_key():
-     load_env()
-     together_api_key = os.getenv("TOGETHER_AI_API_KEY")
-     return together_api_key
-
-def get_game_state(inventory={}):
-    world = load_world('./GeneratedWorld.json')
     # Select a kingdom
-    kingdoms = world.get('kingdoms', {})
+    kingdoms = store.kingdom_names()
     if not kingdoms:
         raise ValueError("No kingdoms found in the world.")
-    kingdom_name = random.choice(list(kingdoms.keys()))
-    kingdom = kingdoms[kingdom_name]
+    kingdom_name = random.choice(kingdoms)
+    kingdom = store.kingdom(kingdom_name)
 
     # Select a town
-    towns = kingdom.get('towns', {})
+    towns = store.town_names(kingdom_name)
     if not towns:
         raise ValueError(f"No towns found in the kingdom '{kingdom_name}'.")
-    town_name = random.choice(list(towns.keys()))
-    town = towns[town_name]
+    town_name = random.choice(towns)
+    town = store.town(kingdom_name, town_name)
 
     # Select a character
-    npcs = town.get('npcs', {})
+    npcs = store.npc_names(kingdom_name, town_name)
     if not npcs:
         raise ValueError(f"No NPCs found in the town '{town_name}'.")
-    character_name = random.choice(list(npcs.keys()))
-    character = npcs[character_name]
+    character_name = random.choice(npcs)
+    character = store.npc(kingdom_name, town_name, character_name)
 
-    start = world['start']
+    starts = character.get('starts')
+    start = random.choice(starts) if starts else store.get_meta('start')
 
     game_state = {
-        "world": world['description'],
+        "world": store.get_meta('description'),
         "kingdom": kingdom['description'],
         "town": town['description'],
         "character": character['description'],
         "start": start,
-        "inventory": inventory
+        "inventory": dict(inventory or {}),
+        "location": {"kingdom": kingdom_name, "town": town_name, "character": character_name},
     }
     return game_state
 
-def run_action(message, history, game_state):
-    
-    if(message == 'start game'):
-        return game_state['start']
-        
+def build_messages(message, history, game_state, summary=None, lore=None):
     system_prompt = """You are an AI Game master. Your job is to write what \
 happens next in a player's adventure game.\
 Instructions: \
@@ -89,21 +84,204 @@ Inventory: {json.dumps(game_state['inventory'])}"""
         {"role": "user", "content": world_info}
     ]
 
+    if lore:
+        messages.append({"role": "user", "content": "Relevant lore:\n" + "\n".join(lore)})
+
+    if summary:
+        messages.append({"role": "user", "content": f"Story so far: {summary}"})
+
     for action in history:
         messages.append({"role": "assistant", "content": action[0]})
         messages.append({"role": "user", "content": action[1]})
            
     messages.append({"role": "user", "content": message})
-    client = Together(api_key=get_together_api_key())
-    model_output = client.chat.completions.create(
-        model="meta-llama/Llama-3-70b-chat-hf",
-        messages=messages
-    )
+    return messages
+
+# Appended to the system prompt for a structured turn, where the model
+# reports the inventory changes along with the narration (see structured_turn).
+structured_turn_format = """
+Respond with one JSON object and nothing else, with the narration first:
+{"narration": <WHAT HAPPENS NEXT>, "itemUpdates": [{"name": <ITEM NAME>, "change_amount": <CHANGE AMOUNT>}...]}
+In itemUpdates, add items the player clearly gained with a positive change_amount \
+and items the player clearly lost with a negative change_amount. \
+Don't add items that are already in the inventory. \
+If no items were changed use "itemUpdates": [].
+"""
+
+def structured_messages(messages):
+    return [{**messages[0], "content": messages[0]["content"] + structured_turn_format}, *messages[1:]]
+
+@traced("run_action")
+def run_action(message, history, game_state, context=None, structured=False):
+    """
+    With structured, the response is a structured turn (JSON with the
+    narration and the item updates) to be read with
+    structured_turn.parse_turn.
+    """
+    if(message == 'start game'):
+        return game_state['start']
+
+    if context is not None:
+        # Bounded prompt: recent turns verbatim, older ones summarized
+        messages = context.build_messages(message, history, game_state)
+    else:
+        messages = build_messages(message, history, game_state)
+    if structured:
+        messages = structured_messages(messages)
+    client = get_client()
+    model_output = call_model("narration", client.chat.completions.create, messages=messages)
+    if context is not None:
+        context.record_usage(getattr(model_output, 'usage', None))
     
     result = model_output.choices[0].message.content
     return result
 
-def start_game(main_loop, share=False):
+async def build_turn_messages_async(message, history, game_state, context=None):
+    if context is not None:
+        # Folding old turns into the summary may call the model, so the
+        # context is built off the event loop.
+        return await asyncio.to_thread(context.build_messages, message, history, game_state)
+    return build_messages(message, history, game_state)
+
+@traced("run_action")
+async def run_action_async(message, history, game_state, context=None, structured=False):
+    """run_action on the async client, for async request handlers."""
+    if(message == 'start game'):
+        return game_state['start']
+
+    messages = await build_turn_messages_async(message, history, game_state, context)
+    if structured:
+        messages = structured_messages(messages)
+    client = get_async_client()
+    model_output = await call_model_async("narration", client.chat.completions.create, messages=messages)
+    if context is not None:
+        context.record_usage(getattr(model_output, 'usage', None))
+
+    return model_output.choices[0].message.content
+
+@traced("run_action")
+def stream_action(message, history, game_state, context=None, structured=False):
+    """
+    Streaming version of run_action: yields the response a few tokens at a
+    time as the model produces them.
+    """
+    if(message == 'start game'):
+        yield game_state['start']
+        return
+
+    if context is not None:
+        messages = context.build_messages(message, history, game_state)
+    else:
+        messages = build_messages(message, history, game_state)
+    if structured:
+        messages = structured_messages(messages)
+    client = get_client()
+    stream = call_model("narration", client.chat.completions.create, messages=messages, stream=True)
+    usage = None
+    for chunk in stream:
+        # The final chunk carries the token counts for the whole response
+        usage = getattr(chunk, 'usage', None) or usage
+        if not chunk.choices:
+            continue
+        token = chunk.choices[0].delta.content
+        if token:
+            yield token
+    if context is not None:
+        context.record_usage(usage)
+
+@traced("run_action")
+async def stream_action_async(message, history, game_state, context=None, structured=False):
+    """stream_action on the async client."""
+    if(message == 'start game'):
+        yield game_state['start']
+        return
+
+    messages = await build_turn_messages_async(message, history, game_state, context)
+    if structured:
+        messages = structured_messages(messages)
+    client = get_async_client()
+    stream = await call_model_async("narration", client.chat.completions.create, messages=messages, stream=True)
+    usage = None
+    async for chunk in stream:
+        usage = getattr(chunk, 'usage', None) or usage
+        if not chunk.choices:
+            continue
+        token = chunk.choices[0].delta.content
+        if token:
+            yield token
+    if context is not None:
+        context.record_usage(usage)
+
+@traced("summarize_history")
+def summarize_history(summary, turns):
+    """
+    Fold older (player message, response) pairs into the running story
+    summary so they don't have to be resent every turn.
+    """
+    transcript = "\n".join(f"Player: {turn[0]}\nGame master: {turn[1]}" for turn in turns)
+    client = get_client()
+    model_output = call_model(
+        "summary", client.chat.completions.create,
+        temperature=0.0,
+        messages=[
+            {"role": "system", "content": "You summarize a player's adventure so far. "
+                "Write 2-5 plain sentences in second person. Keep the places visited, "
+                "people met, items gained or lost and unfinished goals."},
+            {"role": "user", "content": f"Summary so far: {summary or 'The adventure has just begun.'}"},
+            {"role": "user", "content": f"What happened next:\n{transcript}"},
+            {"role": "user", "content": "Updated summary:"},
+        ],
+    )
+    return model_output.choices[0].message.content.strip()
+
+# End of a sentence: terminal punctuation, optional closing quotes or
+# brackets, then whitespace.
+sentence_end = re.compile(r"""[.!?…]+["')\]]*\s""")
+
+def complete_sentences_end(text):
+    """
+    Index just past the last complete sentence in text, or 0 if there is
+    none yet.
+    """
+    end = 0
+    for match in sentence_end.finditer(text):
+        end = match.end()
+    return end
+
+def sentences_to_check(text, checked_end, end, context=200):
+    """
+    The sentences of text completed between checked_end and end, after the
+    sentences that end in the context characters before checked_end, so a
+    streamed response is checked a few sentences at a time rather than as
+    an ever longer prefix.
+    """
+    floor = checked_end - context
+    if floor <= 0:
+        return text[:end]
+    start = checked_end
+    for match in sentence_end.finditer(text, 0, checked_end):
+        if match.end() >= floor:
+            start = match.end()
+            break
+    return text[start:end]
+
+def start_game(main_loop, share=False, metrics_port=None, concurrency_limit=None, max_queue_size=None):
+    """
+    concurrency_limit is how many turns run at once (CONCURRENCY_LIMIT,
+    default 64) and max_queue_size how many more may wait before new ones
+    are turned away (MAX_QUEUE_SIZE, default 256). Synchronous handlers
+    each hold one of Gradio's worker threads while they run; async ones
+    don't, so use an async main_loop for high limits.
+    """
+    # Prometheus metrics are served on their own port next to the UI.
+    metrics_port = metrics_port or get_setting("METRICS_PORT")
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    concurrency_limit = concurrency_limit or int(get_setting("CONCURRENCY_LIMIT", "64"))
+    max_queue_size = max_queue_size or int(get_setting("MAX_QUEUE_SIZE", "256"))
+
+    import gradio as gr
+
     demo = gr.ChatInterface(
         main_loop,
         chatbot=gr.Chatbot(height=250, placeholder="Type 'start game' to begin"),
@@ -117,6 +295,7 @@ def start_game(main_loop, share=False):
         undo_btn=None,
         clear_btn=None,
                            )
+    demo.queue(default_concurrency_limit=concurrency_limit, max_size=max_queue_size)
     demo.launch(share=share, server_name="0.0.0.0")
 
 
@@ -149,12 +328,16 @@ Should not
 - Write stories that depicts, glorifies or encourages drug use."""
 }
 
-def is_safe(message):
+# Verdicts for identical text (e.g. the canned start scene) are reused.
+# Set SAFETY_CACHE_PATH to also keep them on disk between runs.
+safety_cache = SafetyCache(path=get_setting("SAFETY_CACHE_PATH"))
+
+def safety_prompt(message, policy):
     # Build the prompt with embedded values
-    prompt = f"""[INST] Task: Check if there is unsafe content in 'user' messages in conversations according to our safety policy with the below categories.
+    return f"""[INST] Task: Check if there is unsafe content in 'user' messages in conversations according to our safety policy with the below categories.
     
     <BEGIN UNSAFE CONTENT CATEGORIES>
-    {everyone_content_policy['policy']}
+    {policy}
     <END UNSAFE CONTENT CATEGORIES>
     
     <BEGIN CONVERSATION>
@@ -163,15 +346,34 @@ def is_safe(message):
     Provide your safety assessment for user in the above conversation:
     - First line must read 'safe' or 'unsafe'.
     - If unsafe, a second line must include a comma-separated list of violated categories. [/INST]"""
-    
-    client = Together(api_key=get_together_api_key())
 
-    response = client.completions.create(
-        model="Meta-Llama/LlamaGuard-2-8b",
-        prompt=prompt,
-    )
+@traced("is_safe")
+def is_safe(message):
+    policy = everyone_content_policy['policy']
+    cached = safety_cache.get(message, policy)
+    if cached is not None:
+        return cached
+
+    client = get_client()
+
+    response = call_model("safety", client.completions.create, prompt=safety_prompt(message, policy))
     result = response.choices[0].text
-    return result.strip() == 'safe'
+    safe = result.strip() == 'safe'
+    safety_cache.put(message, policy, safe)
+    return safe
+
+@traced("is_safe")
+async def is_safe_async(message):
+    policy = everyone_content_policy['policy']
+    cached = safety_cache.get(message, policy)
+    if cached is not None:
+        return cached
+
+    client = get_async_client()
+    response = await call_model_async("safety", client.completions.create, prompt=safety_prompt(message, policy))
+    safe = response.choices[0].text.strip() == 'safe'
+    safety_cache.put(message, policy, safe)
+    return safe
 
-def main_loop(message, history, model="meta-llama/Llama-3-70b-chat-hf"):
+def main_loop(message, history, model=LLAMA_3_70B):
     return run_action(message, history, model)
\ No newline at end of file
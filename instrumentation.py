@@ -0,0 +1,378 @@
+"""
+Timing spans and token accounting for game stages and model calls.
+
+Functions decorated with @traced("stage") record how long they take and
+whether they raised. Model calls made through an InstrumentedClient while a
+stage is running are recorded under that stage, with the model name and
+the prompt and completion token counts returned by the API.
+
+Results are aggregated into histograms and counters, exposed in the
+Prometheus text format by start_metrics_server, and written as one JSON
+log line per span to the "instrumentation" logger.
+
+Instrumentation is off unless INSTRUMENTATION=1 is set or enable() is
+called; when off, decorated functions and clients only check a flag.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+
+from config import get_setting
+
+logger = logging.getLogger("instrumentation")
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+enabled = get_setting("INSTRUMENTATION", "0").lower() in ("1", "true", "yes")
+
+_current_stage = contextvars.ContextVar("stage", default="other")
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def current_stage():
+    return _current_stage.get()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Histograms and counters keyed by metric name and label values."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        """Current values as plain data, e.g. for a JSON report."""
+        with self._lock:
+            return {
+                "histograms": [
+                    {"name": name, "labels": dict(labels), "count": h.count, "sum": h.sum,
+                     "buckets": dict(zip([*map(str, BUCKETS), "+Inf"], h.counts))}
+                    for (name, labels), h in self.histograms.items()
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self.counters.items()
+                ],
+            }
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), h in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip([*map(str, BUCKETS), "+Inf"], h.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {h.sum}")
+                    lines.append(f"{name}_count{_labels(labels)} {h.count}")
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (f'{key}="{str(value)}"'.replace("\n", " ") for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+registry = Registry()
+
+
+def record_stage(stage, seconds, error=None):
+    registry.observe("game_stage_seconds", {"stage": stage}, seconds)
+    if error is not None:
+        registry.increment("game_stage_errors_total", {"stage": stage, "error": error})
+    logger.info(json.dumps({"span": stage, "seconds": round(seconds, 6), "error": error}))
+
+
+def record_llm_call(stage, model, seconds, usage=None, error=None):
+    labels = {"stage": stage, "model": model}
+    registry.observe("llm_request_seconds", labels, seconds)
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    if prompt_tokens:
+        registry.increment("llm_prompt_tokens_total", labels, prompt_tokens)
+    if completion_tokens:
+        registry.increment("llm_completion_tokens_total", labels, completion_tokens)
+    if error is not None:
+        registry.increment("llm_errors_total", {**labels, "error": error})
+    logger.info(json.dumps({
+        "span": "llm", "stage": stage, "model": model, "seconds": round(seconds, 6),
+        "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "error": error,
+    }))
+
+
+def traced(stage):
+    """Record the duration and errors of the decorated function as stage."""
+
+    def decorator(fn):
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def async_generator_wrapper(*args, **kwargs):
+                if not enabled:
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                    return
+                start = time.perf_counter()
+                error = None
+                # The generator runs in the consumer's task, so the stage
+                # is set around each step as for plain generators.
+                generator = fn(*args, **kwargs)
+                try:
+                    while True:
+                        token = _current_stage.set(stage)
+                        try:
+                            item = await generator.__anext__()
+                        except StopAsyncIteration:
+                            return
+                        finally:
+                            _current_stage.reset(token)
+                        yield item
+                except Exception as e:
+                    error = type(e).__name__
+                    raise
+                finally:
+                    await generator.aclose()
+                    record_stage(stage, time.perf_counter() - start, error)
+
+            return async_generator_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def coroutine_wrapper(*args, **kwargs):
+                if not enabled:
+                    return await fn(*args, **kwargs)
+                start = time.perf_counter()
+                token = _current_stage.set(stage)
+                error = None
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception as e:
+                    error = type(e).__name__
+                    raise
+                finally:
+                    _current_stage.reset(token)
+                    record_stage(stage, time.perf_counter() - start, error)
+
+            return coroutine_wrapper
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                if not enabled:
+                    yield from fn(*args, **kwargs)
+                    return
+                start = time.perf_counter()
+                error = None
+                generator = fn(*args, **kwargs)
+                try:
+                    while True:
+                        # Consumers may resume the generator from another
+                        # thread, so the stage is set around each step.
+                        token = _current_stage.set(stage)
+                        try:
+                            item = next(generator)
+                        except StopIteration:
+                            return
+                        finally:
+                            _current_stage.reset(token)
+                        yield item
+                except Exception as e:
+                    error = type(e).__name__
+                    raise
+                finally:
+                    record_stage(stage, time.perf_counter() - start, error)
+
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            token = _current_stage.set(stage)
+            error = None
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                _current_stage.reset(token)
+                record_stage(stage, time.perf_counter() - start, error)
+
+        return wrapper
+
+    return decorator
+
+
+class _InstrumentedEndpoint:
+    def __init__(self, create):
+        self._create = create
+
+    def create(self, model, **kwargs):
+        if not enabled:
+            return self._create(model=model, **kwargs)
+        stage = current_stage()
+        start = time.perf_counter()
+        try:
+            response = self._create(model=model, **kwargs)
+        except Exception as e:
+            record_llm_call(stage, model, time.perf_counter() - start, error=type(e).__name__)
+            raise
+        if kwargs.get("stream"):
+            return self._stream(response, stage, model, start)
+        record_llm_call(stage, model, time.perf_counter() - start, getattr(response, "usage", None))
+        return response
+
+    def _stream(self, chunks, stage, model, start):
+        usage = None
+        error = None
+        try:
+            for chunk in chunks:
+                usage = getattr(chunk, "usage", None) or usage
+                yield chunk
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            record_llm_call(stage, model, time.perf_counter() - start, usage, error)
+
+
+class _AsyncInstrumentedEndpoint(_InstrumentedEndpoint):
+    async def create(self, model, **kwargs):
+        if not enabled:
+            return await self._create(model=model, **kwargs)
+        stage = current_stage()
+        start = time.perf_counter()
+        try:
+            response = await self._create(model=model, **kwargs)
+        except Exception as e:
+            record_llm_call(stage, model, time.perf_counter() - start, error=type(e).__name__)
+            raise
+        if kwargs.get("stream"):
+            return self._stream(response, stage, model, start)
+        record_llm_call(stage, model, time.perf_counter() - start, getattr(response, "usage", None))
+        return response
+
+    async def _stream(self, chunks, stage, model, start):
+        usage = None
+        error = None
+        try:
+            async for chunk in chunks:
+                usage = getattr(chunk, "usage", None) or usage
+                yield chunk
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            record_llm_call(stage, model, time.perf_counter() - start, usage, error)
+
+
+class InstrumentedClient:
+    """Wraps a Together client so chat and text completions are recorded."""
+
+    endpoint = _InstrumentedEndpoint
+
+    def __init__(self, client):
+        self.client = client
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = self.endpoint(client.chat.completions.create)
+        self.completions = self.endpoint(client.completions.create)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class AsyncInstrumentedClient(InstrumentedClient):
+    """InstrumentedClient for an AsyncTogether client."""
+
+    endpoint = _AsyncInstrumentedEndpoint
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serve registry.render_prometheus() at /metrics from a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] == "/metrics":
+                body = registry.render_prometheus().encode()
+                content_type = "text/plain; version=0.0.4"
+            elif self.path.split("?")[0] == "/metrics.json":
+                body = json.dumps(registry.snapshot()).encode()
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, int(port)), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,105 @@
+"""
+Cheap local check for whether a turn's narration could have changed the
+player's inventory. Only narrations that pass it are sent to the model for
+inventory detection.
+
+The check is tuned for recall: a false positive costs one model call, a
+false negative loses an inventory change. It is off unless the game master
+is created with prefilter=True (INVENTORY_PREFILTER=1 in the app);
+benchmarks/bench_inventory_filter measures its recall against the item
+updates the model returns.
+"""
+import re
+
+ACQUIRE_WORDS = [
+    "pick", "picks", "picked", "take", "takes", "took", "grab", "grabs",
+    "receive", "receives", "received", "find", "finds", "found", "loot", "loots",
+    "buy", "buys", "bought", "purchase", "purchases", "purchased", "pocket", "pockets",
+    "collect", "collects", "gain", "gains", "gained", "obtain", "obtains", "obtained",
+    "earn", "earns", "earned", "reward", "rewards", "rewarded", "win", "wins", "won",
+    "acquire", "acquires", "acquired", "hands you", "gives you", "tosses you",
+    "offers you", "add", "adds", "added", "stash", "stashes", "retrieve", "retrieves",
+    "put", "puts", "carry", "carries", "carrying", "carried", "equip", "equips", "equipped",
+    "tuck", "tucks", "tucked", "slip", "slips", "slipped", "wear", "wears", "wield", "wields",
+    "fill", "fills", "filled", "pack", "packs", "packed", "hold", "holds", "now have", "now own",
+]
+
+LOSE_WORDS = [
+    "drop", "drops", "dropped", "lose", "loses", "lost", "give", "gave", "hand over",
+    "hand the", "pay", "pays", "paid", "spend", "spends", "spent", "sell", "sells", "sold",
+    "trade", "trades", "traded", "steal", "steals", "stole", "stolen", "snatch", "snatches",
+    "break", "breaks", "broke", "shatter", "shatters", "shattered", "consume", "consumes",
+    "eat", "eats", "ate", "drink", "drinks", "drank", "throw", "throws", "threw",
+    "toss", "tosses", "tossed", "discard", "discards", "use up", "used up", "leave behind",
+    "confiscate", "confiscates", "confiscated", "seize", "seizes", "seized", "taken",
+    "ruin", "ruins", "ruined", "destroy", "destroys", "destroyed", "burn", "burns", "burned",
+    "burnt", "melt", "melts", "melted", "rot", "rots", "rotted", "crumble", "crumbles", "crumbled",
+    "vanish", "vanishes", "vanished", "gone", "missing", "soaked", "torn", "snaps", "snapped",
+]
+
+# Where carried things go: "into your satchel", "from your belt".
+CONTAINER_WORDS = [
+    "bag", "bags", "pack", "backpack", "knapsack", "rucksack", "satchel", "sack", "pouch",
+    "pocket", "pockets", "purse", "belt", "boot", "boots", "sleeve", "cloak", "coat",
+    "quiver", "sheath", "scabbard", "bandolier", "hand", "hands", "arms", "inventory",
+    "belongings", "things", "gear",
+]
+
+CURRENCY_WORDS = [
+    "gold", "silver", "copper", "coin", "coins", "crown", "crowns", "money", "purse",
+    "payment", "price", "gems", "gem",
+]
+
+
+def _word_pattern(words):
+    alternatives = sorted((re.escape(word) for word in words), key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(alternatives) + r")\b")
+
+
+acquire_pattern = _word_pattern(ACQUIRE_WORDS)
+lose_pattern = _word_pattern(LOSE_WORDS)
+currency_pattern = _word_pattern(CURRENCY_WORDS)
+container_pattern = re.compile(
+    r"\b(?:in|into|inside|onto|on|to|from|out of|under) your (?:[\w-]+ )?(?:"
+    + "|".join(re.escape(word) for word in CONTAINER_WORDS) + r")\b"
+)
+
+
+def item_terms(inventory):
+    """
+    Words that refer to an inventory item: its full name and the last word
+    of multi-word names ("journal" for "leather bound journal").
+    """
+    terms = set()
+    for name in inventory:
+        name = str(name).lower().strip()
+        if not name:
+            continue
+        terms.add(name)
+        last_word = name.split()[-1]
+        if len(last_word) > 2:
+            terms.add(last_word)
+            terms.add(last_word.rstrip("s"))
+    return terms
+
+
+def inventory_change_signals(inventory, output):
+    """Names of the rules that matched, empty if none did."""
+    text = output.lower()
+    signals = []
+    if acquire_pattern.search(text):
+        signals.append("acquire")
+    if lose_pattern.search(text):
+        signals.append("lose")
+    if currency_pattern.search(text):
+        signals.append("currency")
+    if container_pattern.search(text):
+        signals.append("container")
+    terms = item_terms(inventory)
+    if terms and _word_pattern(terms).search(text):
+        signals.append("item")
+    return signals
+
+
+def may_change_inventory(inventory, output):
+    return bool(inventory_change_signals(inventory, output))
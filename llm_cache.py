@@ -0,0 +1,253 @@
+"""
+Cache of completion responses, keyed by endpoint, model, request
+parameters and a hash of the messages or prompt.
+
+Modes:
+- "off": every call goes to the API.
+- "deterministic": only calls made at temperature 0 are cached.
+- "record": every call is cached, so a session or world generation can be
+  replayed later.
+- "replay": calls are only answered from the cache; a miss raises
+  CacheMissError instead of calling the API.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+MODES = ("off", "deterministic", "record", "replay")
+
+
+class CacheMissError(LookupError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+def request_key(endpoint, model, payload, params):
+    """
+    payload is the messages list for chat calls or the prompt string for
+    completions. Streaming and non-streaming calls share a key.
+    """
+    params = {name: value for name, value in params.items() if name != "stream"}
+    material = json.dumps(
+        {"endpoint": endpoint, "model": model, "params": params, "payload": payload},
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def response_to_dict(response):
+    """Keep the parts of a response the game reads: choices and usage."""
+    choices = []
+    for choice in response.choices:
+        message = getattr(choice, "message", None)
+        if message is not None:
+            choices.append({"message": {"role": "assistant", "content": message.content}})
+        else:
+            choices.append({"text": choice.text})
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        usage = {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "total_tokens": getattr(usage, "total_tokens", None),
+        }
+    return {"choices": choices, "usage": usage}
+
+
+def dict_to_response(data):
+    def convert(value):
+        if isinstance(value, dict):
+            return SimpleNamespace(**{key: convert(item) for key, item in value.items()})
+        if isinstance(value, list):
+            return [convert(item) for item in value]
+        return value
+
+    return convert(data)
+
+
+def stream_chunks(data):
+    """Replay a cached chat response as a single streamed chunk."""
+    content = data["choices"][0]["message"]["content"]
+    yield SimpleNamespace(
+        choices=[SimpleNamespace(delta=SimpleNamespace(content=content))],
+        usage=dict_to_response(data["usage"]) if data.get("usage") else None,
+    )
+
+
+async def stream_chunks_async(data):
+    for chunk in stream_chunks(data):
+        yield chunk
+
+
+class CompletionCache:
+    """
+    In-memory LRU of recent responses in front of an optional SQLite file.
+    The file is trimmed, least recently used first, when the stored
+    responses exceed max_bytes.
+    """
+
+    def __init__(self, mode="deterministic", path=None, max_entries=1024, max_bytes=256 * 1024 * 1024):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode '{mode}', expected one of {MODES}.")
+        self.mode = mode
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_bytes = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.commit()
+            self._db_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def should_cache(self, params):
+        if self.mode in ("record", "replay"):
+            return True
+        if self.mode == "deterministic":
+            return params.get("temperature") == 0
+        return False
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    data = json.loads(row[0])
+                    self._remember(key, data)
+                    self.hits += 1
+                    return data
+            self.misses += 1
+            return None
+
+    def put(self, key, data):
+        with self._lock:
+            self._remember(key, data)
+            if self._db is None:
+                return
+            value = json.dumps(data)
+            row = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._db_bytes -= row[0]
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+            self._db_bytes += len(value)
+            self._evict()
+            self._db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "disk_bytes": self._db_bytes,
+        }
+
+    def _remember(self, key, data):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        while self._db_bytes > self.max_bytes:
+            row = self._db.execute("SELECT key, size FROM responses ORDER BY last_used LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self._db_bytes -= row[1]
+
+
+class _CachedEndpoint:
+    def __init__(self, cache, endpoint, create, payload_name):
+        self._cache = cache
+        self._endpoint = endpoint
+        self._create = create
+        self._payload_name = payload_name
+
+    def create(self, model, **kwargs):
+        payload = kwargs.pop(self._payload_name)
+        stream = kwargs.get("stream", False)
+        if not self._cache.should_cache(kwargs):
+            return self._create(model=model, **{self._payload_name: payload}, **kwargs)
+
+        key = request_key(self._endpoint, model, payload, kwargs)
+        data = self._cache.get(key)
+        if data is not None:
+            return stream_chunks(data) if stream else dict_to_response(data)
+        if self._cache.mode == "replay":
+            raise CacheMissError(f"No recorded {self._endpoint} response for model {model}.")
+
+        # Always fetch the full response so it can be cached as one entry.
+        kwargs.pop("stream", None)
+        response = self._create(model=model, **{self._payload_name: payload}, **kwargs)
+        data = response_to_dict(response)
+        self._cache.put(key, data)
+        return stream_chunks(data) if stream else response
+
+
+class _AsyncCachedEndpoint(_CachedEndpoint):
+    async def create(self, model, **kwargs):
+        payload = kwargs.pop(self._payload_name)
+        stream = kwargs.get("stream", False)
+        if not self._cache.should_cache(kwargs):
+            return await self._create(model=model, **{self._payload_name: payload}, **kwargs)
+
+        key = request_key(self._endpoint, model, payload, kwargs)
+        data = self._cache.get(key)
+        if data is not None:
+            return stream_chunks_async(data) if stream else dict_to_response(data)
+        if self._cache.mode == "replay":
+            raise CacheMissError(f"No recorded {self._endpoint} response for model {model}.")
+
+        kwargs.pop("stream", None)
+        response = await self._create(model=model, **{self._payload_name: payload}, **kwargs)
+        data = response_to_dict(response)
+        self._cache.put(key, data)
+        return stream_chunks_async(data) if stream else response
+
+
+class CachingClient:
+    """
+    Wraps a Together client so chat and text completions go through cache.
+    Other attributes are passed through to the wrapped client.
+    """
+
+    endpoint = _CachedEndpoint
+
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+        self.chat = SimpleNamespace(
+            completions=self.endpoint(cache, "chat", client.chat.completions.create, "messages")
+        )
+        self.completions = self.endpoint(cache, "completions", client.completions.create, "prompt")
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class AsyncCachingClient(CachingClient):
+    """CachingClient for an AsyncTogether client."""
+
+    endpoint = _AsyncCachedEndpoint
@@ -0,0 +1,193 @@
+"""
+Process-wide Together clients.
+
+Clients are built once per API key and shared by every module, so each
+call reuses the client's configuration and keep-alive HTTP connections
+instead of constructing a new client (and re-reading .env) per request.
+
+The SDK (and requests/aiohttp) are imported when the first client is
+built, so importing this module is cheap.
+"""
+import asyncio
+import threading
+import weakref
+
+from config import get_setting, get_together_api_key
+from instrumentation import AsyncInstrumentedClient, InstrumentedClient
+from llm_cache import AsyncCachingClient, CachingClient, CompletionCache
+from request_scheduler import AsyncScheduledClient, RequestScheduler, ScheduledClient
+
+# Connections kept open per host by each thread's requests session.
+POOL_MAXSIZE = 16
+
+_clients = {}
+_async_clients = {}
+_cache = None
+_scheduler = None
+_aiohttp_sessions = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _make_pooled_session():
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_completion_cache():
+    """
+    The process-wide response cache, configured by LLM_CACHE_MODE (see
+    llm_cache for the modes, default "deterministic") and LLM_CACHE_PATH
+    for the on-disk tier.
+    """
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = CompletionCache(
+                    mode=get_setting("LLM_CACHE_MODE", "deterministic"),
+                    path=get_setting("LLM_CACHE_PATH"),
+                )
+    return _cache
+
+
+def set_completion_cache(cache):
+    """Use cache for clients created from now on, e.g. to record or replay."""
+    global _cache
+    with _lock:
+        _cache = cache
+        _clients.clear()
+        _async_clients.clear()
+
+
+def get_scheduler():
+    """
+    The process-wide request scheduler. LLM_RATE_LIMIT sets requests per
+    second (unlimited by default), LLM_MAX_CONCURRENCY the requests in
+    flight and LLM_MAX_RETRIES the retries of rate-limit and transient
+    errors.
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                rate = get_setting("LLM_RATE_LIMIT")
+                _scheduler = RequestScheduler(
+                    rate=float(rate) if rate else None,
+                    max_concurrent=int(get_setting("LLM_MAX_CONCURRENCY", "16")),
+                    max_retries=int(get_setting("LLM_MAX_RETRIES", "5")),
+                )
+    return _scheduler
+
+
+def get_client(api_key=None):
+    """
+    Return the shared synchronous client for api_key, defaulting to the
+    key from the environment. Calls go through the completion cache unless
+    it is turned off, then the request scheduler.
+    """
+    api_key = api_key or get_together_api_key()
+    client = _clients.get(api_key)
+    if client is not None:
+        return client
+    import together
+
+    cache = get_completion_cache()
+    scheduler = get_scheduler()
+    with _lock:
+        if api_key not in _clients:
+            # The SDK keeps one requests session per thread; give it a
+            # larger connection pool so concurrent calls stay keep-alive.
+            if together.requestssession is None:
+                together.requestssession = _make_pooled_session
+            # Replaying recorded responses doesn't need a real key.
+            # Retries are left to the scheduler, which knows about priorities.
+            client = together.Together(api_key=api_key or ("replay" if cache.mode == "replay" else None), max_retries=0)
+            # Instrumented inside the scheduler and cache, so every real API
+            # attempt is timed but queueing and cache hits are not.
+            client = ScheduledClient(InstrumentedClient(client), scheduler)
+            if cache.mode != "off":
+                client = CachingClient(client, cache)
+            _clients[api_key] = client
+        return _clients[api_key]
+
+
+def get_async_client(api_key=None):
+    """
+    Return the shared asynchronous client for api_key. Calls go through
+    the same completion cache and request scheduler as the synchronous
+    client.
+
+    When called from a running event loop, the SDK is also pointed at one
+    aiohttp session per loop; otherwise it would open and close a new
+    session, and so a new connection, for every request.
+    """
+    import together
+
+    api_key = api_key or get_together_api_key()
+    client = _async_clients.get(api_key)
+    if client is None:
+        cache = get_completion_cache()
+        scheduler = get_scheduler()
+        with _lock:
+            if api_key not in _async_clients:
+                client = together.AsyncTogether(api_key=api_key or ("replay" if cache.mode == "replay" else None), max_retries=0)
+                client = AsyncScheduledClient(AsyncInstrumentedClient(client), scheduler)
+                if cache.mode != "off":
+                    client = AsyncCachingClient(client, cache)
+                _async_clients[api_key] = client
+            client = _async_clients[api_key]
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return client
+    session = _aiohttp_sessions.get(loop)
+    if session is None or session.closed:
+        import aiohttp
+
+        # The scheduler already caps requests in flight; allow as many
+        # connections so none of them queue again in aiohttp.
+        limit = max(POOL_MAXSIZE, get_scheduler().max_concurrent)
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit))
+        _aiohttp_sessions[loop] = session
+    together.aiosession.set(session)
+    return client
+
+
+async def close_async_sessions():
+    """Close the aiohttp sessions opened for the current event loop."""
+    session = _aiohttp_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+def set_client(client, api_key=None):
+    """
+    Install client as the shared synchronous client for api_key, e.g. a
+    stub client in benchmarks. The client is used as given, without the
+    completion cache.
+    """
+    api_key = api_key or get_together_api_key()
+    with _lock:
+        _clients[api_key] = client
+
+
+def set_async_client(client, api_key=None):
+    """set_client for the shared asynchronous client."""
+    api_key = api_key or get_together_api_key()
+    with _lock:
+        _async_clients[api_key] = client
+
+
+def reset_clients():
+    """Drop all cached clients, e.g. after the API key or base URL changes."""
+    global _scheduler
+    with _lock:
+        _scheduler = None
+        _clients.clear()
+        _async_clients.clear()
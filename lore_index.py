@@ -0,0 +1,166 @@
+"""
+Lexical retrieval over the world tree.
+
+LoreIndex keeps one entry per kingdom, town and NPC (name and description)
+and ranks them against a player's message with BM25. It is built once from
+a world store and then follows the store's changes node by node, so
+generating or editing part of the world doesn't rebuild it. select() picks
+the best entries that fit a token budget, which keeps the lore part of a
+prompt the same size however large the world is.
+"""
+import math
+import re
+import threading
+from collections import Counter
+
+from conversation_context import estimate_tokens
+from instrumentation import traced
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been
+before being below between both but by can did do does doing down during each
+few for from further had has have having he her here hers herself him himself
+his how i if in into is it its itself just me more most my myself no nor not
+now of off on once only or other our ours out over own same she should so some
+such than that the their theirs them then there these they this those through
+to too under until up very was we were what when where which while who whom
+why will with you your yours yourself
+""".split())
+
+# Fields of a node that are not lore: its children and opening scenes.
+SKIPPED_FIELDS = ("name", "towns", "npcs", "starts")
+LABELS = {"kingdom": "Kingdom", "town": "Town", "npc": "Character"}
+
+word = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercase words without stopwords, with plural "s" stripped."""
+    terms = []
+    for term in word.findall(text.lower()):
+        if term in STOPWORDS:
+            continue
+        if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+
+def node_text(kind, node):
+    fields = [value for key, value in node.items() if key not in SKIPPED_FIELDS and isinstance(value, str)]
+    return f"{LABELS[kind]} {node['name']}: " + " ".join(fields)
+
+
+class LoreIndex:
+    """
+    Entries are keyed by the names on the path to their node, e.g.
+    (kingdom, town) for a town.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.entries = {}
+        self.postings = {}
+        self.total_length = 0
+        self._store = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    @traced("build_lore_index")
+    def from_store(cls, store, follow=True):
+        """Index every node of store; with follow, keep up with its changes."""
+        index = cls()
+        index.rebuild(store)
+        if follow:
+            index._store = store
+            store.add_listener(index.on_change)
+        return index
+
+    def rebuild(self, store):
+        with self._lock:
+            self.entries.clear()
+            self.postings.clear()
+            self.total_length = 0
+        for kingdom in store.kingdom_names():
+            self.put("kingdom", (kingdom,), store.kingdom(kingdom))
+            for town in store.town_names(kingdom):
+                self.put("town", (kingdom, town), store.town(kingdom, town))
+                for npc in store.npc_names(kingdom, town):
+                    self.put("npc", (kingdom, town, npc), store.npc(kingdom, town, npc))
+
+    def on_change(self, kind, names, node):
+        """World store listener."""
+        if kind == "world":
+            self.rebuild(self._store)
+        else:
+            self.put(kind, names, node)
+
+    def close(self):
+        if self._store is not None:
+            self._store.remove_listener(self.on_change)
+            self._store = None
+
+    def put(self, kind, key, node):
+        """Add or replace the entry for one node."""
+        text = node_text(kind, node)
+        terms = Counter(tokenize(text))
+        with self._lock:
+            self._remove(key)
+            length = sum(terms.values())
+            self.entries[key] = {"kind": kind, "text": text, "terms": terms, "length": length}
+            self.total_length += length
+            for term, count in terms.items():
+                self.postings.setdefault(term, {})[key] = count
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.total_length -= entry["length"]
+        for term in entry["terms"]:
+            keys = self.postings[term]
+            del keys[key]
+            if not keys:
+                del self.postings[term]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, query, k=5, exclude=()):
+        """The k best (score, key, entry) for query, best first."""
+        with self._lock:
+            count = len(self.entries)
+            if not count:
+                return []
+            average_length = self.total_length / count
+            scores = Counter()
+            for term in set(tokenize(query)):
+                keys = self.postings.get(term)
+                if not keys:
+                    continue
+                idf = math.log(1 + (count - len(keys) + 0.5) / (len(keys) + 0.5))
+                for key, frequency in keys.items():
+                    length = self.entries[key]["length"]
+                    norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[key] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+            for key in exclude:
+                scores.pop(key, None)
+            return [(score, key, self.entries[key]) for key, score in scores.most_common(k)]
+
+    @traced("select_lore")
+    def select(self, query, token_budget=256, k=5, exclude=()):
+        """Texts of the best entries for query that fit in token_budget."""
+        selected = []
+        used = 0
+        for _, _, entry in self.search(query, k, exclude):
+            tokens = estimate_tokens(entry["text"])
+            if used + tokens > token_budget:
+                continue
+            selected.append(entry["text"])
+            used += tokens
+        return selected
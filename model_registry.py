@@ -0,0 +1,416 @@
+"""
+Which model serves each task, and what happens when it is slow.
+
+Every model call names its task: "narration", "inventory", "safety",
+"summary" or "world_generation". Each task has a route: its model, a
+smaller fallback model, a latency budget and a timeout, in seconds.
+
+- A call still running `timeout` seconds after the scheduler admitted it
+  is abandoned and made again on the fallback model; time spent waiting
+  for a slot or backing off before a retry doesn't count. A streamed call
+  times out if its first chunk hasn't arrived by then. An abandoned call
+  that hasn't been admitted is withdrawn from the scheduler's queue.
+- When the median of the task's recent calls is over the budget, its calls
+  go to the fallback model for `cooldown` seconds, then the model is tried
+  again. Calls are measured from their admission; streamed calls until
+  the stream is exhausted, and judged apart from calls that aren't
+  streamed.
+- A call that still fails after the scheduler's retries is also made again
+  on the fallback model.
+
+Tasks without a fallback (safety by default) are never timed out. Routes
+are configured with MODEL_<TASK>, MODEL_<TASK>_FALLBACK, MODEL_<TASK>_BUDGET
+and MODEL_<TASK>_TIMEOUT, e.g. MODEL_INVENTORY=meta-llama/Llama-3-8b-chat-hf
+to detect inventory changes with the 8B model. An empty fallback, budget or
+timeout turns it off.
+"""
+import asyncio
+import contextvars
+import statistics
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import instrumentation
+from config import get_setting
+from request_scheduler import Admission, admission, current_admission, is_retryable
+
+LLAMA_3_70B = "meta-llama/Llama-3-70b-chat-hf"
+LLAMA_3_8B = "meta-llama/Llama-3-8b-chat-hf"
+LLAMA_GUARD_2 = "Meta-Llama/LlamaGuard-2-8b"
+
+
+class Route:
+    def __init__(self, model, fallback=None, budget=None, timeout=None):
+        self.model = model
+        self.fallback = fallback
+        self.budget = budget
+        self.timeout = timeout
+
+    def __repr__(self):
+        return (f"Route({self.model!r}, fallback={self.fallback!r}, "
+                f"budget={self.budget!r}, timeout={self.timeout!r})")
+
+
+DEFAULT_ROUTES = {
+    "narration": Route(LLAMA_3_70B, LLAMA_3_8B, budget=4.0, timeout=15.0),
+    "inventory": Route(LLAMA_3_70B, LLAMA_3_8B, budget=3.0, timeout=10.0),
+    "safety": Route(LLAMA_GUARD_2),
+    "summary": Route(LLAMA_3_70B, LLAMA_3_8B, budget=4.0, timeout=15.0),
+    "world_generation": Route(LLAMA_3_70B, LLAMA_3_8B, timeout=60.0),
+}
+
+
+def _seconds(value):
+    return float(value) if value else None
+
+
+def routes_from_settings(defaults=DEFAULT_ROUTES):
+    routes = {}
+    for task, route in defaults.items():
+        name = f"MODEL_{task.upper()}"
+        routes[task] = Route(
+            get_setting(name, route.model),
+            get_setting(f"{name}_FALLBACK", route.fallback) or None,
+            _seconds(get_setting(f"{name}_BUDGET", route.budget)),
+            _seconds(get_setting(f"{name}_TIMEOUT", route.timeout)),
+        )
+    return routes
+
+
+class ModelRegistry:
+    """
+    window is how many recent calls of a task are compared with its
+    budget; at least min_samples are needed before it is judged slow.
+    """
+
+    def __init__(self, routes=None, window=20, min_samples=5, cooldown=30.0, max_workers=64):
+        self.routes = dict(DEFAULT_ROUTES if routes is None else routes)
+        self.window = window
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self.max_workers = max_workers
+        # Recent calls by (task, streamed)
+        self.recent = {}
+        self.slow_until = {}
+        self.latencies = {}
+        self.fallbacks = Counter()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def route(self, task):
+        return self.routes[task]
+
+    def model(self, task):
+        """The model the next call for task goes to, and why it is the fallback (or None)."""
+        route = self.routes[task]
+        with self._lock:
+            if route.fallback and time.monotonic() < self.slow_until.get(task, 0):
+                return route.fallback, "budget"
+        return route.model, None
+
+    def create(self, task, create, **kwargs):
+        """create(model=..., **kwargs) on task's model, falling back as described above."""
+        route = self.routes[task]
+        model, reason = self.model(task)
+        if reason is not None or not route.fallback:
+            return self._timed(task, model, reason, create, kwargs)
+        ticket = Admission(time.perf_counter(), parent=current_admission())
+        try:
+            response = self._call_with_timeout(route.timeout, create, dict(kwargs, model=model), ticket)
+        except FutureTimeoutError:
+            reason = "timeout"
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            reason = "error"
+        if reason is None:
+            return self._measure(task, model, response, ticket)
+        if ticket.admitted_at is not None:
+            self._record(task, model, time.perf_counter() - ticket.admitted_at, timed_out=reason == "timeout",
+                         streamed=bool(kwargs.get("stream")))
+        return self._timed(task, route.fallback, reason, create, kwargs)
+
+    async def create_async(self, task, create, **kwargs):
+        """create for a coroutine create function, e.g. the async client's."""
+        route = self.routes[task]
+        model, reason = self.model(task)
+        if reason is not None or not route.fallback:
+            return await self._timed_async(task, model, reason, create, kwargs)
+        ticket = Admission(time.perf_counter(), parent=current_admission())
+        try:
+            response = await self._call_with_timeout_async(route.timeout, create, dict(kwargs, model=model), ticket)
+        except asyncio.TimeoutError:
+            reason = "timeout"
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            reason = "error"
+        if reason is None:
+            return self._measure(task, model, response, ticket)
+        if ticket.admitted_at is not None:
+            self._record(task, model, time.perf_counter() - ticket.admitted_at, timed_out=reason == "timeout",
+                         streamed=bool(kwargs.get("stream")))
+        return await self._timed_async(task, route.fallback, reason, create, kwargs)
+
+    def stats(self):
+        """Per task and model: calls, median and p95 seconds; and fallbacks by (task, reason)."""
+        with self._lock:
+            latencies = {key: sorted(samples) for key, samples in self.latencies.items()}
+            fallbacks = dict(self.fallbacks)
+        return {
+            "latency": {
+                key: {
+                    "calls": len(samples),
+                    "p50": statistics.median(samples),
+                    "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+                }
+                for key, samples in latencies.items()
+            },
+            "fallbacks": fallbacks,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _call_with_timeout(self, timeout, create, kwargs, ticket):
+        if timeout is None:
+            return _start(create, kwargs, ticket)
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="model-call")
+        # The call keeps the caller's context (stage, priority) on the worker thread.
+        future = self._executor.submit(contextvars.copy_context().run, _start, create, kwargs, ticket)
+        changed = threading.Event()
+        ticket.watch(changed.set)
+        future.add_done_callback(lambda _: changed.set())
+        while True:
+            changed.clear()
+            if future.done():
+                return future.result()
+            left = _time_left(ticket, timeout)
+            if left is not None and left <= 0:
+                # A call still queued is withdrawn; one already running can't
+                # be interrupted, so its stream is closed if it returns one,
+                # releasing its scheduler slot.
+                ticket.withdraw()
+                future.add_done_callback(_close_abandoned)
+                raise FutureTimeoutError
+            changed.wait(left)
+
+    async def _call_with_timeout_async(self, timeout, create, kwargs, ticket):
+        if timeout is None:
+            return await _start_async(create, kwargs, ticket)
+        task = asyncio.ensure_future(_start_async(create, kwargs, ticket))
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        ticket.watch(lambda: loop.call_soon_threadsafe(changed.set))
+        task.add_done_callback(lambda _: changed.set())
+        try:
+            while True:
+                changed.clear()
+                if task.done():
+                    return task.result()
+                left = _time_left(ticket, timeout)
+                if left is not None and left <= 0:
+                    raise asyncio.TimeoutError
+                try:
+                    await asyncio.wait_for(changed.wait(), left)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if not task.done():
+                # As in _call_with_timeout: a stream that arrives anyway is closed.
+                ticket.withdraw()
+                task.cancel()
+                task.add_done_callback(_close_abandoned)
+
+    def _timed(self, task, model, reason, create, kwargs):
+        if reason is not None:
+            self._count_fallback(task, reason)
+        ticket = Admission(time.perf_counter(), parent=current_admission())
+        with admission(ticket):
+            response = create(model=model, **kwargs)
+        if kwargs.get("stream"):
+            response = TimedStream(response, ticket.admitted_at)
+        return self._measure(task, model, response, ticket)
+
+    async def _timed_async(self, task, model, reason, create, kwargs):
+        if reason is not None:
+            self._count_fallback(task, reason)
+        ticket = Admission(time.perf_counter(), parent=current_admission())
+        with admission(ticket):
+            response = await create(model=model, **kwargs)
+        if kwargs.get("stream"):
+            response = AsyncTimedStream(response, ticket.admitted_at)
+        return self._measure(task, model, response, ticket)
+
+    def _measure(self, task, model, response, ticket):
+        """Record the call now, or for a stream once it is exhausted."""
+        if isinstance(response, TimedStream):
+            response.on_done = lambda seconds: self._record(task, model, seconds, streamed=True)
+        else:
+            self._record(task, model, time.perf_counter() - ticket.admitted_at)
+        return response
+
+    def _record(self, task, model, seconds, timed_out=False, streamed=False):
+        route = self.routes[task]
+        with self._lock:
+            self.latencies.setdefault((task, model), deque(maxlen=1000)).append(seconds)
+            if model == route.model and route.budget is not None and route.fallback:
+                recent = self.recent.setdefault((task, streamed), deque(maxlen=self.window))
+                recent.append(seconds)
+                if timed_out or (len(recent) >= self.min_samples and statistics.median(recent) > route.budget):
+                    # Start afresh when the model is tried again.
+                    recent.clear()
+                    self.slow_until[task] = time.monotonic() + self.cooldown
+        if instrumentation.enabled:
+            instrumentation.registry.observe("model_task_seconds", {"task": task, "model": model}, seconds)
+
+    def _count_fallback(self, task, reason):
+        with self._lock:
+            self.fallbacks[(task, reason)] += 1
+        if instrumentation.enabled:
+            instrumentation.registry.increment("model_fallback_total", {"task": task, "reason": reason})
+
+
+class TimedStream:
+    """
+    A stream that calls on_done with the seconds since start once it is
+    exhausted. start() waits for the first chunk, so that it can be timed
+    out. close() closes the underlying stream even if iteration never
+    started.
+    """
+
+    def __init__(self, chunks, start):
+        self.on_done = None
+        self._chunks = chunks
+        self._start = start
+        self._first = []
+
+    def start(self):
+        try:
+            self._first.append(next(self._chunks))
+        except StopIteration:
+            pass
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._first:
+            return self._first.pop()
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            self._done()
+            raise
+
+    def close(self):
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+
+    def _done(self):
+        on_done, self.on_done = self.on_done, None
+        if on_done is not None:
+            on_done(time.perf_counter() - self._start)
+
+
+class AsyncTimedStream(TimedStream):
+    """TimedStream for an async iterator."""
+
+    async def start(self):
+        try:
+            self._first.append(await self._chunks.__anext__())
+        except StopAsyncIteration:
+            pass
+        except BaseException:
+            await self.aclose()
+            raise
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._first:
+            return self._first.pop()
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            self._done()
+            raise
+
+    async def aclose(self):
+        aclose = getattr(self._chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def _time_left(ticket, timeout):
+    """Seconds until the call times out, or None while it isn't admitted."""
+    if ticket.admitted_at is None:
+        return None
+    return ticket.admitted_at + timeout - time.perf_counter()
+
+
+def _start(create, kwargs, ticket):
+    """create(**kwargs); a stream is returned once its first chunk has arrived."""
+    with admission(ticket):
+        response = create(**kwargs)
+    if kwargs.get("stream"):
+        return TimedStream(response, ticket.admitted_at).start()
+    return response
+
+
+async def _start_async(create, kwargs, ticket):
+    with admission(ticket):
+        response = await create(**kwargs)
+    if kwargs.get("stream"):
+        return await AsyncTimedStream(response, ticket.admitted_at).start()
+    return response
+
+
+def _close_abandoned(future):
+    """Close the stream an abandoned call returned, releasing its scheduler slot."""
+    if not future.cancelled() and future.exception() is None and hasattr(future.result(), "close"):
+        future.result().close()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry():
+    """The process-wide registry, with routes from the environment."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry(routes_from_settings())
+    return _registry
+
+
+def set_model_registry(registry):
+    """Use registry for every model call from now on, e.g. in benchmarks."""
+    global _registry
+    with _registry_lock:
+        _registry = registry
+
+
+def call_model(task, create, **kwargs):
+    """create(model=..., **kwargs) with the model routed for task."""
+    return get_model_registry().create(task, create, **kwargs)
+
+
+async def call_model_async(task, create, **kwargs):
+    return await get_model_registry().create_async(task, create, **kwargs)
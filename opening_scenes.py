@@ -0,0 +1,101 @@
+"""
+Opening scenes precomputed for every character in the world.
+
+Each NPC node in the world store keeps a "starts" list of opening scenes
+written for that character, so a new session can start with a scene that
+matches its character without calling the model. fill() generates the
+missing scenes for the whole world concurrently, at background priority,
+and stores each one as soon as it is ready. When refresh is on, every
+scene handed to a session is replaced in the background by a new one.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import traced
+from request_scheduler import BACKGROUND, priority
+
+logger = logging.getLogger(__name__)
+
+
+def characters(store):
+    """(kingdom, town, character) names of every character in store."""
+    return [
+        (kingdom, town, npc)
+        for kingdom in store.kingdom_names()
+        for town in store.town_names(kingdom)
+        for npc in store.npc_names(kingdom, town)
+    ]
+
+
+class OpeningScenePool:
+    """
+    per_character opening scenes are kept for each character of
+    game_master's world store.
+    """
+
+    def __init__(self, game_master, per_character=1, max_workers=8, refresh=False):
+        self.game_master = game_master
+        self.store = game_master.store
+        self.per_character = per_character
+        self.refresh = refresh
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="opening-scenes")
+        self.generated = 0
+        self._lock = threading.Lock()
+
+    @traced("fill_opening_scenes")
+    def fill(self):
+        """
+        Generate the scenes missing from the pool and wait for them.
+        Returns the number of scenes generated.
+        """
+        missing = []
+        for names in characters(self.store):
+            count = len(self.store.npc(*names).get("starts", []))
+            missing += [names] * max(0, self.per_character - count)
+        for future in [self._submit(names) for names in missing]:
+            future.result()
+        return len(missing)
+
+    def used(self, kingdom, town, character, start):
+        """
+        Note that start was handed to a session; with refresh on it is
+        replaced by a freshly generated scene in the background.
+        """
+        if not self.refresh:
+            return None
+        future = self._submit((kingdom, town, character), replace=start)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, names, replace=None):
+        # Scene generation yields to players' turns in the request queue.
+        def task():
+            with priority(BACKGROUND):
+                self._add_scene(names, replace)
+
+        return self.executor.submit(task)
+
+    def _add_scene(self, names, replace=None):
+        kingdom, town, character = names
+        start = self.game_master.generate_start(
+            self.store.kingdom(kingdom), self.store.town(kingdom, town),
+            self.store.npc(kingdom, town, character),
+        )
+        # Read, modify and write under the lock, so concurrent refills of
+        # one character don't drop each other's scenes.
+        with self._lock:
+            node = self.store.npc(kingdom, town, character)
+            starts = [scene for scene in node.get("starts", []) if scene != replace]
+            starts.append(start)
+            node["starts"] = starts[-self.per_character:]
+            self.store.put_npc(kingdom, town, node)
+            self.generated += 1
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Refreshing an opening scene failed: %r", future.exception())
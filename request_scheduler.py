@@ -0,0 +1,416 @@
+"""
+Admission control for model calls shared by every module.
+
+RequestScheduler limits the request rate with a token bucket and the
+number of requests in flight with a concurrency cap. When calls have to
+wait, interactive ones (player turns) go before background ones (world
+generation). Rate-limit and transient errors are retried with exponential
+backoff and jitter.
+
+The priority of calls made by the current thread or task is set with
+`with priority(BACKGROUND):`. Threads and asyncio tasks wait in the same
+queue.
+
+`with admission(ticket):` lets a caller follow its call through the queue:
+the Admission ticket records when the call was admitted, and withdrawing it
+takes a call that is still waiting out of the queue.
+"""
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 10
+
+_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def priority(level):
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class CallWithdrawn(Exception):
+    """The call's Admission was withdrawn before it was admitted."""
+
+
+class Admission:
+    """
+    The admission of one call. admitted_at is the time.perf_counter() at
+    which the call last got a slot, and None while it waits for one (in the
+    queue or backing off before a retry). It starts out as start, for calls
+    that never go through a scheduler. Listeners are called on each change.
+
+    A ticket with a parent (the ticket of a larger piece of work, such as a
+    speculative turn) passes its admissions up to the parent, and is
+    withdrawn along with it.
+    """
+
+    def __init__(self, start, parent=None):
+        self.admitted_at = start
+        self.parent = parent
+        self.withdrawn = parent is not None and parent.withdrawn
+        self._listeners = []
+        self._on_withdraw = []
+        if parent is not None:
+            parent._on_withdraw.append(self.withdraw)
+
+    def watch(self, listener):
+        self._listeners.append(listener)
+
+    def withdraw(self):
+        """Stop the call if it hasn't been admitted, and any later retry."""
+        self.withdrawn = True
+        for callback in list(self._on_withdraw):
+            callback()
+
+    def _set(self, admitted_at):
+        self.admitted_at = admitted_at
+        for listener in self._listeners:
+            listener()
+        if self.parent is not None:
+            self.parent._set(admitted_at)
+
+
+_admission = contextvars.ContextVar("request_admission", default=None)
+
+
+def current_admission():
+    return _admission.get()
+
+
+@contextlib.contextmanager
+def admission(ticket):
+    token = _admission.set(ticket)
+    try:
+        yield ticket
+    finally:
+        _admission.reset(token)
+
+
+def is_retryable(exc):
+    # Imported here so the SDK is only loaded by code that calls the API.
+    from together import error
+
+    retryable = (error.RateLimitError, error.ServiceUnavailableError, error.Timeout, error.APIConnectionError)
+    if isinstance(exc, retryable):
+        return True
+    status = getattr(exc, "http_status", None)
+    return isinstance(exc, error.APIError) and status is not None and status >= 500
+
+
+class TokenBucket:
+    """rate tokens per second, up to capacity banked for bursts."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def try_take(self):
+        """Take a token if one is available; otherwise return the wait in seconds."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RequestScheduler:
+    def __init__(self, rate=None, burst=None, max_concurrent=16, max_retries=5,
+                 base_delay=0.5, max_delay=20.0):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.active = 0
+        self.retries = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        # (loop, event) of asyncio tasks waiting for a change.
+        self._async_waiters = []
+
+    def acquire(self, level=None):
+        """Block until a request at this priority may start."""
+        ticket = self._waiting_ticket()
+        entry = self._enqueue(level)
+        with self._condition:
+            try:
+                while True:
+                    self._check_withdrawn(ticket)
+                    wait = self._try_start(entry)
+                    if wait == 0:
+                        break
+                    self._condition.wait(wait)
+            except BaseException:
+                self._dequeue(entry)
+                raise
+        if ticket is not None:
+            ticket._set(time.perf_counter())
+
+    async def acquire_async(self, level=None):
+        """Wait without blocking the event loop until a request may start."""
+        ticket = self._waiting_ticket()
+        entry = self._enqueue(level)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                with self._condition:
+                    self._check_withdrawn(ticket)
+                    wait = self._try_start(entry)
+                    if wait == 0:
+                        break
+                    event = asyncio.Event()
+                    self._async_waiters.append((loop, event))
+                try:
+                    await asyncio.wait_for(event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._condition:
+                self._dequeue(entry)
+            raise
+        if ticket is not None:
+            ticket._set(time.perf_counter())
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._notify()
+
+    def _waiting_ticket(self):
+        ticket = _admission.get()
+        if ticket is not None:
+            self._check_withdrawn(ticket)
+            if self._wake not in ticket._on_withdraw:
+                ticket._on_withdraw.append(self._wake)
+            ticket._set(None)
+        return ticket
+
+    @staticmethod
+    def _check_withdrawn(ticket):
+        if ticket is not None and ticket.withdrawn:
+            raise CallWithdrawn("withdrawn while waiting to be admitted")
+
+    def _wake(self):
+        with self._condition:
+            self._notify()
+
+    def _enqueue(self, level):
+        level = current_priority() if level is None else level
+        entry = (level, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+        return entry
+
+    def _dequeue(self, entry):
+        if entry in self._waiting:
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            self._notify()
+
+    def _try_start(self, entry):
+        """
+        Start entry if it is next and a slot and rate token are free. Returns
+        0 once started, otherwise the seconds to wait for a rate token or
+        None to wait for another request to finish.
+        """
+        if self._waiting[0] != entry or self.active >= self.max_concurrent:
+            return None
+        wait = self.bucket.try_take() if self.bucket else 0.0
+        if wait:
+            return wait
+        heapq.heappop(self._waiting)
+        self.active += 1
+        # The next waiter may be able to start too.
+        self._notify()
+        return 0
+
+    def _notify(self):
+        self._condition.notify_all()
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+        self._async_waiters.clear()
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Run fn once admitted, retrying retryable errors. Streaming results
+        keep their slot until they are fully consumed or closed.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as exc:
+                self.release()
+                if attempt >= self.max_retries or not is_retryable(exc):
+                    raise
+                # Backing off isn't time the call is admitted.
+                self._waiting_ticket()
+                delay = self.backoff(attempt)
+                attempt += 1
+                self.retries += 1
+                logger.warning("%s, retrying in %.1fs (attempt %d)", type(exc).__name__, delay, attempt)
+                time.sleep(delay)
+                continue
+            if kwargs.get("stream"):
+                return HeldStream(result, self.release)
+            self.release()
+            return result
+
+    async def call_async(self, fn, *args, **kwargs):
+        """call for coroutine functions, such as the async client's create."""
+        attempt = 0
+        while True:
+            await self.acquire_async()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as exc:
+                self.release()
+                if attempt >= self.max_retries or not is_retryable(exc):
+                    raise
+                # Backing off isn't time the call is admitted.
+                self._waiting_ticket()
+                delay = self.backoff(attempt)
+                attempt += 1
+                self.retries += 1
+                logger.warning("%s, retrying in %.1fs (attempt %d)", type(exc).__name__, delay, attempt)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.release()
+                raise
+            if kwargs.get("stream"):
+                return AsyncHeldStream(result, self.release)
+            self.release()
+            return result
+
+
+class HeldStream:
+    """
+    A stream that holds a scheduler slot until it is exhausted, fails or is
+    closed. Unlike a generator's finally block, close() releases the slot
+    even if iteration never started, e.g. when the caller gave up on it.
+    """
+
+    def __init__(self, chunks, release):
+        self._chunks = chunks
+        self._release = release
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self._done()
+            raise
+
+    def close(self):
+        close = getattr(self._chunks, "close", None)
+        try:
+            if close is not None:
+                close()
+        finally:
+            self._done()
+
+    def _done(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._release()
+
+    def __del__(self):
+        self._done()
+
+
+class AsyncHeldStream(HeldStream):
+    """HeldStream for an async iterator."""
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._chunks.__anext__()
+        except BaseException:
+            self._done()
+            raise
+
+    async def aclose(self):
+        aclose = getattr(self._chunks, "aclose", None)
+        try:
+            if aclose is not None:
+                await aclose()
+        finally:
+            self._done()
+
+    def close(self):
+        # The underlying stream can't be closed without awaiting; the slot
+        # is released either way.
+        self._done()
+
+
+class _ScheduledEndpoint:
+    def __init__(self, scheduler, create):
+        self._scheduler = scheduler
+        self._create = create
+
+    def create(self, **kwargs):
+        return self._scheduler.call(self._create, **kwargs)
+
+
+class _AsyncScheduledEndpoint(_ScheduledEndpoint):
+    async def create(self, **kwargs):
+        return await self._scheduler.call_async(self._create, **kwargs)
+
+
+class ScheduledClient:
+    """Wraps a Together client so chat and text completions go through scheduler."""
+
+    endpoint = _ScheduledEndpoint
+
+    def __init__(self, client, scheduler):
+        self.client = client
+        self.scheduler = scheduler
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = self.endpoint(scheduler, client.chat.completions.create)
+        self.completions = self.endpoint(scheduler, client.completions.create)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class AsyncScheduledClient(ScheduledClient):
+    """ScheduledClient for an AsyncTogether client."""
+
+    endpoint = _AsyncScheduledEndpoint
@@ -0,0 +1,112 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+def normalize(message):
+    # Whitespace differences don't change a verdict.
+    return " ".join(message.split())
+
+
+def policy_hash(policy):
+    return hashlib.sha256(policy.encode("utf-8")).hexdigest()
+
+
+class SafetyCache:
+    """
+    Cache of LlamaGuard verdicts keyed by a hash of the normalized message
+    and the policy text.
+
+    Verdicts are kept in an in-memory LRU and, when path is given, in an
+    SQLite file so they survive restarts. When the policy text changes,
+    verdicts recorded under the old policy are dropped from both tiers.
+    """
+
+    def __init__(self, max_entries=4096, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._policy_hash = None
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts "
+                "(key TEXT PRIMARY KEY, policy TEXT NOT NULL, safe INTEGER NOT NULL)"
+            )
+            self._db.commit()
+
+    def key(self, message, policy):
+        digest = hashlib.sha256()
+        digest.update(policy_hash(policy).encode("ascii"))
+        digest.update(b"\0")
+        digest.update(normalize(message).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, message, policy):
+        """Return the cached verdict (True if safe), or None on a miss."""
+        key = self.key(message, policy)
+        with self._lock:
+            self._check_policy(policy)
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT safe FROM verdicts WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._remember(key, bool(row[0]))
+                    self.hits += 1
+                    return bool(row[0])
+            self.misses += 1
+            return None
+
+    def put(self, message, policy, safe):
+        key = self.key(message, policy)
+        with self._lock:
+            self._check_policy(policy)
+            self._remember(key, safe)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO verdicts (key, policy, safe) VALUES (?, ?, ?)",
+                    (key, self._policy_hash, int(safe)),
+                )
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM verdicts")
+                self._db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._memory),
+        }
+
+    def _remember(self, key, safe):
+        self._memory[key] = safe
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _check_policy(self, policy):
+        current = policy_hash(policy)
+        if current == self._policy_hash:
+            return
+        # Keys already include the policy, so old verdicts could never be
+        # hit again; drop them instead of letting them take up space.
+        self._memory.clear()
+        if self._db is not None:
+            self._db.execute("DELETE FROM verdicts WHERE policy != ?", (current,))
+            self._db.commit()
+        self._policy_hash = current
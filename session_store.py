@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_size(value):
+    """
+    Rough size in bytes of a session entry, used to enforce the memory cap.
+    Values that can't be serialized count as a small fixed amount.
+    """
+    try:
+        return len(json.dumps(value, default=lambda obj: None))
+    except (TypeError, ValueError):
+        return 1024
+
+
+class SessionStore:
+    """
+    Per-player cache of objects that should live for the whole session,
+    keyed by the Gradio session hash.
+
+    Entries are evicted least recently used first when there are more than
+    max_sessions of them or their estimated size goes over max_bytes, and
+    expire after ttl seconds without being used.
+    """
+
+    def __init__(self, factory, max_sessions=256, ttl=60 * 60, max_bytes=64 * 1024 * 1024, sizeof=estimate_size):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """
+        Return the entry for session_id, building it with the factory the
+        first time the session is seen or after it has expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            if session_id in self._entries:
+                value, size, _ = self._entries.pop(session_id)
+                self._entries[session_id] = (value, size, now)
+                return value
+
+        # Build outside the lock so a slow factory doesn't block other players.
+        value = self.factory()
+        size = self.sizeof(value)
+
+        with self._lock:
+            if session_id in self._entries:
+                # Another request for the same session won the race.
+                existing, existing_size, _ = self._entries.pop(session_id)
+                self._entries[session_id] = (existing, existing_size, now)
+                return existing
+            self._entries[session_id] = (value, size, now)
+            self._total_bytes += size
+            self._evict_over_capacity()
+        return value
+
+    def refresh_size(self, session_id):
+        """
+        Re-measure an entry after it has been mutated in place, e.g. when
+        the inventory grows.
+        """
+        with self._lock:
+            if session_id not in self._entries:
+                return
+            value, size, last_used = self._entries[session_id]
+            new_size = self.sizeof(value)
+            self._entries[session_id] = (value, new_size, last_used)
+            self._total_bytes += new_size - size
+            self._evict_over_capacity(keep=session_id)
+
+    def discard(self, session_id):
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._total_bytes -= entry[1]
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def _evict_expired(self, now):
+        if self.ttl is None:
+            return
+        # Entries are ordered by last use, so expired ones are at the front.
+        while self._entries:
+            session_id, (_, size, last_used) = next(iter(self._entries.items()))
+            if now - last_used < self.ttl:
+                break
+            self._entries.popitem(last=False)
+            self._total_bytes -= size
+
+    def _evict_over_capacity(self, keep=None):
+        while self._entries and (
+            len(self._entries) > self.max_sessions
+            or (self.max_bytes is not None and self._total_bytes > self.max_bytes)
+        ):
+            session_id = next(iter(self._entries))
+            if session_id == keep:
+                break
+            _, size, _ = self._entries.pop(session_id)
+            self._total_bytes -= size
@@ -0,0 +1,257 @@
+"""
+Speculative prefetch of the player's likely next actions.
+
+After a turn, while the player reads the response, Speculator generates
+the responses to the most likely next messages (the UI's example actions
+and the messages players send most often) in the background. If the
+player then sends one of them with the same history, and its model call
+has already been admitted by the scheduler (or is done), the prefetched
+response is used instead of calling the model again. A speculation still
+waiting, in the speculation pool or in the scheduler's queue behind other
+calls, is cancelled rather than waited for, as is anything else pending for
+the session; tokens spent on speculation that is never used are counted as
+wasted.
+
+Speculative calls run at background priority, and each session may spend
+at most token_budget (estimated) tokens on them. Once a response is
+generated it is also safety checked in the background, so the verdict is
+usually cached by the time the response is used.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+from conversation_context import estimate_tokens, messages_tokens
+from helper import build_messages, is_safe, run_action
+from request_scheduler import BACKGROUND, Admission, CallWithdrawn, admission, priority
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ACTIONS = ("Look around", "Continue the story")
+
+# Completion tokens assumed for a response that hasn't been generated yet.
+RESPONSE_TOKENS = 80
+
+
+def normalize(message):
+    return re.sub(r"\s+", " ", message.strip().lower()).rstrip(".!?")
+
+
+def fingerprint(history, game_state):
+    """What a response depends on besides the message."""
+    material = json.dumps([history, game_state["inventory"]], sort_keys=True, default=str)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class Speculation:
+    """
+    One prefetched response. status is "pending" until the player's next
+    message arrives, then "used", "cancelled" (never admitted) or
+    "discarded". admission follows its model call through the scheduler.
+    """
+
+    def __init__(self, key, estimate):
+        self.key = key
+        self.estimate = estimate
+        self.admission = Admission(None)
+        self.future = None
+        self.tokens = None
+        self.status = "pending"
+
+    def result(self, timeout=None):
+        """(output, context) of the speculative turn."""
+        return self.future.result(timeout)
+
+    def started(self):
+        """Whether the response is generated or being generated."""
+        return self.future.done() or self.admission.admitted_at is not None
+
+    def succeeded(self, timeout=None):
+        """Wait for the speculation; False if it failed."""
+        return self.future.exception(timeout) is None
+
+
+class SessionSpeculation:
+    """One session's pending speculations and spend, kept in the session."""
+
+    def __init__(self):
+        self.pending = {}
+        self.spent_tokens = 0
+
+
+class Speculator:
+    """
+    Speculates on the k most frequent messages. The default actions start
+    with prior sends each, so a few unusual messages don't displace them.
+    """
+
+    def __init__(self, actions=DEFAULT_ACTIONS, k=2, prior=10, token_budget=20000, max_workers=4):
+        self.actions = list(actions)
+        self.k = k
+        self.prior = prior
+        self.token_budget = token_budget
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculation")
+        self.counts = Counter()
+        # How each normalized message was last written, to speculate with.
+        self.spellings = {normalize(action): action for action in self.actions}
+        self.hits = 0
+        self.misses = 0
+        self.speculated = 0
+        self.cancelled = 0
+        self.tokens_spent = 0
+        self.tokens_wasted = 0
+        # Reentrant: cancelling a future runs its callback, which locks too.
+        self._lock = threading.RLock()
+
+    def likely_actions(self):
+        with self._lock:
+            counts = Counter({normalize(action): self.prior for action in self.actions})
+            counts.update(self.counts)
+            return [self.spellings[action] for action, _ in counts.most_common(self.k) if action != "start game"]
+
+    def prefetch(self, state, history, game_state, context=None):
+        """
+        Start speculating on the message that will follow history.
+        Speculation left over from the previous turn is discarded first.
+        """
+        self.discard(state)
+        key = fingerprint(history, game_state)
+        recent = history[-context.keep_last:] if context is not None else history
+        for action in self.likely_actions():
+            estimate = messages_tokens(build_messages(action, recent, game_state)) + RESPONSE_TOKENS
+            with self._lock:
+                if state.spent_tokens + estimate > self.token_budget:
+                    break
+                state.spent_tokens += estimate
+                speculation = Speculation(key, estimate)
+                # Speculation works on copies, so the session's own context
+                # and inventory only change if the speculation is used.
+                speculation.future = self.executor.submit(
+                    self._speculate, speculation, action, list(history), json.loads(json.dumps(game_state)),
+                    context.copy() if context is not None else None,
+                )
+                state.pending[normalize(action)] = speculation
+                self.speculated += 1
+            speculation.future.add_done_callback(
+                lambda future, state=state, speculation=speculation: self._settle(state, speculation)
+            )
+
+    def take(self, state, message, history, game_state):
+        """
+        The speculation for message after history, or None. Only one whose
+        model call has been admitted or is done is taken: one still waiting
+        is cancelled and counted as a miss, so the turn isn't held up behind
+        other calls. Whatever else is pending for the session is discarded.
+        """
+        action = normalize(message)
+        with self._lock:
+            self.counts[action] += 1
+            self.spellings[action] = message
+            speculation = state.pending.pop(action, None)
+            if speculation is not None and speculation.key != fingerprint(history, game_state):
+                state.pending[action] = speculation
+                speculation = None
+            if speculation is not None and not speculation.started():
+                self._cancel(speculation)
+                speculation = None
+            if speculation is not None:
+                speculation.status = "used"
+                self.hits += 1
+            else:
+                self.misses += 1
+        self._count("hit" if speculation is not None else "miss")
+        self.discard(state)
+        return speculation
+
+    def discard(self, state):
+        with self._lock:
+            pending = list(state.pending.values())
+            state.pending.clear()
+            for speculation in pending:
+                if not speculation.started():
+                    self._cancel(speculation)
+                else:
+                    # One still running is counted as wasted when it finishes.
+                    speculation.status = "discarded"
+                    if speculation.tokens is not None:
+                        self._waste(speculation.tokens)
+
+    def stats(self):
+        with self._lock:
+            turns = self.hits + self.misses
+            return {
+                "speculated": self.speculated,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / turns if turns else 0.0,
+                "cancelled": self.cancelled,
+                "tokens_spent": self.tokens_spent,
+                "tokens_wasted": self.tokens_wasted,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _cancel(self, speculation):
+        # Called with self._lock held. One already running in the pool is
+        # withdrawn from the scheduler's queue instead.
+        if not speculation.future.cancel():
+            speculation.admission.withdraw()
+        speculation.status = "cancelled"
+        self.cancelled += 1
+
+    def _speculate(self, speculation, action, history, game_state, context):
+        with priority(BACKGROUND), admission(speculation.admission):
+            output = run_action(action, history, game_state, context)
+        return output, context
+
+    def _check_safety(self, speculation, output):
+        if speculation.status in ("pending", "used"):
+            with priority(BACKGROUND):
+                is_safe(output)
+
+    def _settle(self, state, speculation):
+        """Replace the estimated spend of a finished speculation with its tokens."""
+        future = speculation.future
+        if future.cancelled() or isinstance(future.exception(), CallWithdrawn):
+            with self._lock:
+                state.spent_tokens -= speculation.estimate
+            return
+        if future.exception() is not None:
+            logger.warning("Speculation failed: %r", future.exception())
+            return
+        output, context = future.result()
+        try:
+            self.executor.submit(self._check_safety, speculation, output)
+        except RuntimeError:
+            # Shut down.
+            pass
+        if context is not None and context.prompt_tokens:
+            prompt_tokens = context.prompt_tokens[-1]
+        else:
+            prompt_tokens = speculation.estimate - RESPONSE_TOKENS
+        tokens = prompt_tokens + estimate_tokens(output)
+        with self._lock:
+            speculation.tokens = tokens
+            state.spent_tokens += tokens - speculation.estimate
+            self.tokens_spent += tokens
+            if speculation.status in ("discarded", "cancelled"):
+                self._waste(tokens)
+        if instrumentation.enabled:
+            instrumentation.registry.increment("speculation_tokens_total", {"kind": "spent"}, tokens)
+
+    def _waste(self, tokens):
+        # Called with self._lock held.
+        self.tokens_wasted += tokens
+        if instrumentation.enabled:
+            instrumentation.registry.increment("speculation_tokens_total", {"kind": "wasted"}, tokens)
+
+    @staticmethod
+    def _count(outcome):
+        if instrumentation.enabled:
+            instrumentation.registry.increment("speculation_total", {"outcome": outcome})
@@ -0,0 +1,179 @@
+"""
+Reading model output that should be JSON.
+
+A structured turn asks the model for the narration and the inventory
+changes in one response:
+
+    {"narration": "...", "itemUpdates": [{"name": "...", "change_amount": 1}]}
+
+Models don't always answer with clean JSON, so extract_json() looks for the
+object inside code fences or surrounding prose and repairs trailing commas
+before giving up, and every item update is validated on its own: a bad one
+is dropped rather than failing the turn.
+"""
+import json
+import logging
+import re
+from typing import Any
+
+from pydantic import BaseModel, ValidationError
+
+logger = logging.getLogger(__name__)
+
+
+class ItemUpdate(BaseModel):
+    name: str
+    change_amount: int
+
+
+class TurnOutput(BaseModel):
+    narration: str
+    # Checked by validate_item_updates, so a bad value only loses the updates.
+    itemUpdates: Any = None
+
+
+fence = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+trailing_comma = re.compile(r",\s*([}\]])")
+
+
+def object_end(text, start):
+    """Index just past the JSON object starting at text[start], or None if it isn't closed."""
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return None
+
+
+def extract_json(text):
+    """The first JSON object in text. Raises ValueError if there is none."""
+    match = fence.search(text)
+    if match:
+        text = match.group(1)
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("no JSON object in output")
+    end = object_end(text, start)
+    if end is None:
+        raise ValueError("unterminated JSON object in output")
+    candidate = text[start:end]
+    for attempt in (candidate, trailing_comma.sub(r"\1", candidate)):
+        try:
+            value = json.loads(attempt, strict=False)
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            return value
+    raise ValueError("invalid JSON object in output")
+
+
+def validate_item_updates(updates):
+    """The valid updates of a parsed itemUpdates list, as dicts."""
+    if not isinstance(updates, list):
+        raise ValueError("itemUpdates is not a list")
+    valid = []
+    for update in updates:
+        try:
+            item = ItemUpdate.model_validate(update)
+        except ValidationError as e:
+            logger.warning("Dropping invalid item update %r: %s", update, e)
+            continue
+        if item.name.strip():
+            valid.append({"name": item.name.strip(), "change_amount": item.change_amount})
+    return valid
+
+
+def parse_item_updates(text):
+    """Item updates from an inventory detection response. Raises ValueError if unreadable."""
+    return validate_item_updates(extract_json(text).get("itemUpdates", []))
+
+
+def looks_like_turn(text):
+    """Whether text is meant as a structured turn, rather than prose that may contain braces."""
+    return text.lstrip().startswith(("{", "```")) or '"narration"' in text
+
+
+def parse_turn(text):
+    """
+    (narration, item_updates) of a structured turn. item_updates is None
+    when the response has unusable itemUpdates, so they must be detected
+    separately; missing or null itemUpdates mean no changes. Output that
+    isn't a structured turn is taken as plain narration. Raises ValueError
+    if the response looks like a structured turn but can't be read.
+    """
+    if not looks_like_turn(text):
+        return text.strip(), None
+    try:
+        turn = TurnOutput.model_validate(extract_json(text))
+    except ValidationError as e:
+        raise ValueError(f"invalid structured turn: {e}") from e
+    if not turn.narration.strip():
+        raise ValueError("structured turn has no narration")
+    try:
+        item_updates = validate_item_updates([] if turn.itemUpdates is None else turn.itemUpdates)
+    except ValueError:
+        item_updates = None
+    return turn.narration.strip(), item_updates
+
+
+class NarrationReader:
+    """
+    Reads the narration out of a structured turn while it streams in, so
+    it can be shown before the whole response has arrived. Output that
+    doesn't start like JSON is passed through as plain narration.
+    """
+
+    start = re.compile(r'"narration"\s*:\s*"')
+
+    def __init__(self):
+        self.text = ""
+        self.narration = ""
+        self.complete = False
+
+    def feed(self, token):
+        """Add a streamed token; returns the narration so far."""
+        self.text += token
+        if self.complete:
+            return self.narration
+        stripped = self.text.lstrip()
+        if stripped and stripped[0] not in "{`":
+            self.narration = stripped
+            return self.narration
+        match = self.start.search(self.text)
+        if match is None:
+            return self.narration
+        raw = self.text[match.end():]
+        # Only decode up to the last complete character of the string.
+        i = 0
+        while i < len(raw):
+            if raw[i] == '"':
+                self.complete = True
+                break
+            if raw[i] == "\\":
+                width = 6 if raw[i + 1:i + 2] == "u" else 2
+                if i + width > len(raw):
+                    break
+                i += width
+            else:
+                i += 1
+        try:
+            self.narration = json.loads(f'"{raw[:i]}"', strict=False)
+        except ValueError:
+            pass
+        return self.narration
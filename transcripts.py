@@ -0,0 +1,121 @@
+"""
+Anonymized transcripts of player sessions, for replaying real traffic.
+
+With a TranscriptRecorder, every turn appends one JSON line:
+
+    {"session": "9c1e...", "at": 1760781612.4, "turn": 2, "message": "I look around",
+     "seconds": 0.81, "timings": {...}, "inventory_delta": {"lantern": 1},
+     "safe": true}
+
+"session" is a salted hash of the session id (the salt is new for each
+recorder, so ids can't be traced back or linked between files), "at" is
+the wall-clock time the turn started, so runs appended to the same file
+keep their order, "turn" is
+the length of the history the message was sent with, and the message has
+e-mail addresses, URLs and long numbers replaced. Responses are not
+recorded. benchmarks/replay_transcripts plays the sessions back.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+scrubbers = [
+    (re.compile(r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b"), "<email>"),
+    (re.compile(r"\b(?:https?://|www\.)\S*[^\s.,;:!?)\]]", re.IGNORECASE), "<url>"),
+    (re.compile(r"\+?\d[\d\s().-]{5,}\d"), "<number>"),
+]
+
+
+def scrub(message):
+    for pattern, placeholder in scrubbers:
+        message = pattern.sub(placeholder, message)
+    return message
+
+
+def inventory_delta(before, after):
+    delta = {}
+    for name in set(before) | set(after):
+        change = after.get(name, 0) - before.get(name, 0)
+        if change:
+            delta[name] = change
+    return delta
+
+
+class TranscriptRecorder:
+    def __init__(self, path):
+        self.path = path
+        # Turns are timed with the monotonic clock and recorded against the wall clock.
+        self._wall_offset = time.time() - time.monotonic()
+        self._salt = os.urandom(16)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def session_key(self, session_id):
+        return hashlib.sha256(self._salt + str(session_id).encode("utf-8")).hexdigest()[:16]
+
+    def record(self, session_id, message, history_length, started, seconds,
+               inventory_before, inventory_after, timings=None, safe=None):
+        line = json.dumps({
+            "session": self.session_key(session_id),
+            "at": round(started + self._wall_offset, 3),
+            "turn": history_length,
+            "message": scrub(message),
+            "seconds": round(seconds, 4),
+            "timings": {stage: round(value, 4) for stage, value in (timings or {}).items()},
+            "inventory_delta": inventory_delta(inventory_before, inventory_after),
+            "safe": safe,
+        })
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class TurnRecording:
+    """
+    One turn, from when it is created until finish() is called with the
+    turn's pipeline result. Does nothing if recorder is None.
+    """
+
+    def __init__(self, recorder, session_id, message, history, game_state):
+        self.recorder = recorder
+        self.started = time.monotonic()
+        self.session_id = session_id
+        self.message = message
+        self.history_length = len(history)
+        self.game_state = game_state
+        self.inventory = dict(game_state["inventory"]) if recorder is not None else None
+
+    def finish(self, result):
+        if self.recorder is None:
+            return
+        self.recorder.record(
+            self.session_id, self.message, self.history_length, self.started,
+            time.monotonic() - self.started, self.inventory, self.game_state["inventory"],
+            result.get("timings"), result.get("safe"),
+        )
+
+
+def load_sessions(path):
+    """
+    Recorded turns grouped by session, each session's turns in order, with
+    "at" in seconds since the first turn in the file.
+    """
+    sessions = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                turn = json.loads(line)
+                sessions.setdefault(turn["session"], []).append(turn)
+    first = min((turn["at"] for turns in sessions.values() for turn in turns), default=0)
+    for turns in sessions.values():
+        for turn in turns:
+            turn["at"] = round(turn["at"] - first, 3)
+        turns.sort(key=lambda turn: turn["at"])
+    return sessions
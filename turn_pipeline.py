@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+from helper import is_safe, is_safe_async, run_action, run_action_async
+from structured_turn import parse_turn
+
+logger = logging.getLogger(__name__)
+
+INVALID_OUTPUT = "Invalid Output"
+
+
+def read_structured_turn(text):
+    """
+    (narration, item_updates) of a structured turn, as parse_turn, but
+    (None, None) instead of an error when the response can't be read.
+    """
+    try:
+        narration, item_updates = parse_turn(text)
+    except ValueError as e:
+        logger.warning("Unreadable structured turn (%s), falling back to two calls: %r", e, text[:200])
+        outcome, narration, item_updates = "fallback", None, None
+    else:
+        outcome = "parsed" if item_updates is not None else "narration_only"
+    if instrumentation.enabled:
+        instrumentation.registry.increment("structured_turn_total", {"outcome": outcome})
+    return narration, item_updates
+
+
+class TurnPipeline:
+    """
+    Runs one chat turn: generate the narration, then check it for safety
+    and detect inventory changes at the same time. Both post-processing
+    stages only need the narration, so the turn waits for the slower of the
+    two instead of their sum. The inventory change is only committed once
+    the narration is known to be safe.
+
+    Each stage's duration in seconds is returned under "timings".
+
+    Inventory detection runs on the executor while the safety check runs on
+    the calling thread, so post-processing takes at most one worker. Size
+    max_workers for the number of turns served at once (the app does so
+    from CONCURRENCY_LIMIT), or detection waits behind other turns'.
+
+    run_structured asks for the narration and the inventory changes in one
+    structured response instead, so only the safety check is left to run
+    after generation. If the item updates can't be read they are detected
+    as usual; if the narration can't either, the turn is generated again
+    the usual way.
+
+    The *_async methods do the same on the async client, as tasks on the
+    running event loop instead of threads.
+    """
+
+    def __init__(self, max_workers=8):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="turn")
+
+    def run(self, message, history, game_state, game_master, context=None):
+        timings = {}
+        start = time.perf_counter()
+        output = run_action(message, history, game_state, context)
+        timings["generation"] = time.perf_counter() - start
+        result = self.post_process(game_state, game_master, output, timings)
+        timings["total"] = time.perf_counter() - start
+        return result
+
+    def run_structured(self, message, history, game_state, game_master, context=None):
+        timings = {}
+        start = time.perf_counter()
+        output, item_updates = read_structured_turn(
+            run_action(message, history, game_state, context, structured=True)
+        )
+        if output is None:
+            output = run_action(message, history, game_state, context)
+        timings["generation"] = time.perf_counter() - start
+        result = self.post_process(game_state, game_master, output, timings, item_updates=item_updates)
+        timings["total"] = time.perf_counter() - start
+        return result
+
+    def post_process(self, game_state, game_master, output, timings=None, safety_checks=None, item_updates=None):
+        """
+        Check output and update the inventory. safety_checks can be a list
+        of already submitted is_safe futures covering output (as the
+        streaming loop does); otherwise output is checked here. item_updates
+        already read from a structured turn are applied instead of
+        detecting them.
+        """
+        timings = {} if timings is None else timings
+        start = time.perf_counter()
+
+        inventory = None
+        if item_updates is None:
+            inventory = self.executor.submit(
+                self._timed, timings, "inventory",
+                game_master.detect_inventory_changes, dict(game_state["inventory"]), output,
+            )
+
+        if safety_checks is None:
+            safe = self._timed(timings, "safety", is_safe, output)
+        else:
+            safe = all(check.result() for check in safety_checks)
+        if not safe:
+            # Nothing from an unsafe turn may reach the inventory; drop the
+            # detection result whether or not it has started.
+            if inventory is not None:
+                inventory.cancel()
+            timings["post_process"] = time.perf_counter() - start
+            self._log(timings, safe)
+            return {"output": INVALID_OUTPUT, "safe": False, "timings": timings}
+
+        if inventory is not None:
+            item_updates = inventory.result()
+        update_msg = game_master.update_inventory(game_state["inventory"], item_updates)
+        timings["post_process"] = time.perf_counter() - start
+        self._log(timings, safe)
+        return {"output": output + update_msg, "safe": True, "timings": timings}
+
+    def submit_safety_check(self, text):
+        return self.executor.submit(is_safe, text)
+
+    async def run_async(self, message, history, game_state, game_master, context=None):
+        timings = {}
+        start = time.perf_counter()
+        output = await run_action_async(message, history, game_state, context)
+        timings["generation"] = time.perf_counter() - start
+        result = await self.post_process_async(game_state, game_master, output, timings)
+        timings["total"] = time.perf_counter() - start
+        return result
+
+    async def run_structured_async(self, message, history, game_state, game_master, context=None):
+        timings = {}
+        start = time.perf_counter()
+        output, item_updates = read_structured_turn(
+            await run_action_async(message, history, game_state, context, structured=True)
+        )
+        if output is None:
+            output = await run_action_async(message, history, game_state, context)
+        timings["generation"] = time.perf_counter() - start
+        result = await self.post_process_async(game_state, game_master, output, timings, item_updates=item_updates)
+        timings["total"] = time.perf_counter() - start
+        return result
+
+    async def post_process_async(self, game_state, game_master, output, timings=None, safety_checks=None,
+                                 item_updates=None):
+        """post_process where safety_checks are is_safe_async tasks."""
+        timings = {} if timings is None else timings
+        start = time.perf_counter()
+
+        if safety_checks is None:
+            safety_checks = [asyncio.create_task(self._timed_async(timings, "safety", is_safe_async, output))]
+        inventory = None
+        if item_updates is None:
+            inventory = asyncio.create_task(self._timed_async(
+                timings, "inventory",
+                game_master.detect_inventory_changes_async, dict(game_state["inventory"]), output,
+            ))
+
+        safe = all(await asyncio.gather(*safety_checks))
+        if not safe:
+            if inventory is not None:
+                inventory.cancel()
+            timings["post_process"] = time.perf_counter() - start
+            self._log(timings, safe)
+            return {"output": INVALID_OUTPUT, "safe": False, "timings": timings}
+
+        if inventory is not None:
+            item_updates = await inventory
+        update_msg = game_master.update_inventory(game_state["inventory"], item_updates)
+        timings["post_process"] = time.perf_counter() - start
+        self._log(timings, safe)
+        return {"output": output + update_msg, "safe": True, "timings": timings}
+
+    def submit_safety_check_async(self, text):
+        return asyncio.create_task(is_safe_async(text))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _timed(timings, stage, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            timings[stage] = time.perf_counter() - start
+
+    @staticmethod
+    async def _timed_async(timings, stage, fn, *args):
+        start = time.perf_counter()
+        try:
+            return await fn(*args)
+        finally:
+            timings[stage] = time.perf_counter() - start
+
+    @staticmethod
+    def _log(timings, safe):
+        logger.debug(
+            "turn safe=%s %s", safe,
+            " ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in timings.items()),
+        )
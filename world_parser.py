@@ -0,0 +1,158 @@
+"""
+Incremental parser for the "<Kind> N Name: ... / <Kind> N Description: ..."
+blocks the world generation prompts ask for.
+
+Text can be fed in arbitrary chunks, e.g. straight from a streamed
+response; an entity is emitted as soon as the next one starts, and close()
+flushes the last one. The parser tolerates the usual formatting drift:
+missing numbers or kind prefixes, markdown emphasis, list markers,
+descriptions spread over several lines or missing their label, a first
+line that is just the name because the prompt ended with "Name:", and
+names given as headers: "Kingdom 1: Emberhold" or a line that is only
+bold, "**Emberhold**", and numbered lists of "1. Emberhold: <description>".
+Name and description lines of the other kinds, which models echo from the
+prompt, are skipped.
+
+With parent_kind set, header lines such as "Kingdom: Emberhold" or
+"Kingdom 2: Emberhold" start a new section, so children of several parents
+can be requested in one call.
+"""
+import re
+
+MARKUP = r"[\s*_#>`~-]*"
+
+KINDS = ("World", "Kingdom", "Town", "Character")
+
+# "**Emberhold**", but not a bold sentence, which is more likely a description.
+bold_line = re.compile(r"^[\s#>-]*(\*\*|__)(?P<value>[^*_]+?)\1\s*:?$")
+
+
+def _numbered_pattern(kind):
+    """ "<Kind> N: <name>", the name given without a "Name" label."""
+    return re.compile(
+        rf"^{MARKUP}{kind}{MARKUP}\d+\s*[.):\u2013-]{MARKUP}(?P<value>.+?){MARKUP}$",
+        re.IGNORECASE,
+    )
+
+
+# "1. Emberhold: A land of fire."
+listed_line = re.compile(
+    rf"^{MARKUP}\d+\s*[.)]{MARKUP}(?P<value>[^:.!?]{{1,60}}?){MARKUP}:{MARKUP}(?P<description>.+)$"
+)
+
+
+def _field_pattern(kind, field):
+    return re.compile(
+        rf"^{MARKUP}(?:{kind}{MARKUP})?(?:\d+{MARKUP})?[.):]?{MARKUP}{field}{MARKUP}:{MARKUP}(?P<value>.*?){MARKUP}$",
+        re.IGNORECASE,
+    )
+
+
+class EntityParser:
+    def __init__(self, kind, parent_kind=None):
+        self.name_line = _field_pattern(kind, "name")
+        self.description_line = _field_pattern(kind, "description")
+        self.numbered_line = _numbered_pattern(kind)
+        others = "|".join(other for other in KINDS if other.lower() != kind.lower())
+        self.other_line = re.compile(
+            rf"^{MARKUP}(?:{others}){MARKUP}(?:\d+{MARKUP})?[.):]?{MARKUP}(?:name|description){MARKUP}:",
+            re.IGNORECASE,
+        )
+        self.header_line = None
+        if parent_kind:
+            self.header_line = re.compile(
+                rf"^{MARKUP}{parent_kind}(?:\s+\d+)?(?:\s+name)?{MARKUP}:{MARKUP}(?P<value>.*?){MARKUP}$",
+                re.IGNORECASE,
+            )
+        self.parent = None
+        self._buffer = ""
+        self._current = None
+        self._seen_content = False
+
+    def feed(self, text):
+        """Consume a chunk of text; returns the entities it completed."""
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        completed = []
+        for line in lines:
+            completed.extend(self._line(line))
+        return completed
+
+    def close(self):
+        """Flush the trailing partial line and the last entity."""
+        completed = self._line(self._buffer) if self._buffer else []
+        self._buffer = ""
+        completed.extend(self._finish())
+        return completed
+
+    def _line(self, line):
+        stripped = line.strip()
+        if not stripped:
+            return []
+
+        if self.header_line is not None:
+            header = self.header_line.match(stripped)
+            if header and not self.description_line.match(stripped):
+                completed = self._finish()
+                self.parent = header.group("value").strip()
+                return completed
+
+        if self.other_line.match(stripped):
+            return []
+
+        name = self.name_line.match(stripped)
+        if name:
+            return self._start(name.group("value"))
+
+        description = self.description_line.match(stripped)
+        if description:
+            if self._current is not None:
+                self._append(description.group("value"))
+            self._seen_content = True
+            return []
+
+        listed = listed_line.match(stripped)
+        if listed:
+            completed = self._start(listed.group("value"))
+            self._append(listed.group("description"))
+            return completed
+
+        name = self.numbered_line.match(stripped) or bold_line.match(stripped)
+        if name and not name.group("value").strip().endswith((".", "!", "?")):
+            return self._start(name.group("value"))
+
+        if self._current is None and not self._seen_content:
+            # The prompt ended with "Name:", so the reply opens with the name.
+            self._current = {"name": stripped.strip("*_# "), "description": ""}
+            self._seen_content = True
+        elif self._current is not None:
+            self._append(stripped)
+        return []
+
+    def _start(self, name):
+        completed = self._finish()
+        self._current = {"name": name.strip(), "description": ""}
+        self._seen_content = True
+        return completed
+
+    def _append(self, text):
+        text = text.strip()
+        if text:
+            current = self._current["description"]
+            self._current["description"] = f"{current} {text}".strip()
+
+    def _finish(self):
+        current, self._current = self._current, None
+        if current and current["name"] and current["description"]:
+            return [(self.parent, current)]
+        return []
+
+
+def parse_entities(kind, text, parent_kind=None):
+    """Parse a complete response into a list of (parent, entity) pairs."""
+    parser = EntityParser(kind, parent_kind)
+    return parser.feed(text) + parser.close()
+
+
+def normalize_name(name):
+    return re.sub(r"[^a-z0-9]+", " ", (name or "").lower()).strip()
@@ -0,0 +1,348 @@
+"""
+Storage for generated worlds.
+
+Both backends expose the same node-level API, so callers can read one
+kingdom, town or NPC at a time and update single nodes without rewriting
+the whole world:
+
+- JsonWorldStore keeps the world in memory and rewrites the JSON file
+  atomically on every change. It is the format GeneratedWorld.json has
+  always used.
+- SqliteWorldStore keeps one row per node, indexed by parent, and only
+  reads the rows that are asked for. Load time and memory stay flat as the
+  world grows.
+
+open_world_store picks the backend from the file extension (.db, .sqlite
+or .sqlite3 for SQLite); save_world and load_world read and write a whole
+world dict in either format.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import closing
+
+from instrumentation import traced
+
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+NODE_FIELDS = ("name", "description")
+
+
+def is_sqlite_path(path):
+    return str(path).lower().endswith(SQLITE_EXTENSIONS)
+
+
+def write_json_atomic(data, path):
+    """Write data to path so readers never see a partially written file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".world-", suffix=".json.tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class _Listeners:
+    """
+    Functions called as listener(kind, names, node) after a kingdom, town
+    or npc node is stored, with names the path of node names down to it.
+    node is the dict that was passed in and may include its children.
+    replace_world calls listener("world", (), None).
+    """
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def _changed(self, kind, names, node):
+        for listener in list(self._listeners):
+            listener(kind, names, node)
+
+
+class JsonWorldStore(_Listeners):
+    def __init__(self, world, path=None):
+        self.world = world
+        self.path = path
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            return cls(json.load(f), path)
+
+    def get_meta(self, key, default=None):
+        return self.world.get(key, default)
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self.world[key] = value
+            self._save()
+
+    def kingdom_names(self):
+        return list(self.world.get("kingdoms", {}))
+
+    def kingdom(self, kingdom):
+        return self._fields(self.world["kingdoms"][kingdom], "towns")
+
+    def town_names(self, kingdom):
+        return list(self.world["kingdoms"][kingdom].get("towns", {}))
+
+    def town(self, kingdom, town):
+        return self._fields(self.world["kingdoms"][kingdom]["towns"][town], "npcs")
+
+    def npc_names(self, kingdom, town):
+        return list(self.world["kingdoms"][kingdom]["towns"][town].get("npcs", {}))
+
+    def npc(self, kingdom, town, npc):
+        return dict(self.world["kingdoms"][kingdom]["towns"][town]["npcs"][npc])
+
+    def put_kingdom(self, kingdom):
+        with self._lock:
+            kingdoms = self.world.setdefault("kingdoms", {})
+            existing = kingdoms.get(kingdom["name"], {})
+            kingdoms[kingdom["name"]] = {**existing, **kingdom, "towns": existing.get("towns", {})}
+            self._save()
+        self._changed("kingdom", (kingdom["name"],), kingdom)
+
+    def put_town(self, kingdom, town):
+        with self._lock:
+            towns = self.world["kingdoms"][kingdom].setdefault("towns", {})
+            existing = towns.get(town["name"], {})
+            towns[town["name"]] = {**existing, **town, "npcs": existing.get("npcs", {})}
+            self._save()
+        self._changed("town", (kingdom, town["name"]), town)
+
+    def put_npc(self, kingdom, town, npc):
+        with self._lock:
+            npcs = self.world["kingdoms"][kingdom]["towns"][town].setdefault("npcs", {})
+            npcs[npc["name"]] = dict(npc)
+            self._save()
+        self._changed("npc", (kingdom, town, npc["name"]), npc)
+
+    def replace_world(self, world):
+        with self._lock:
+            self.world = world
+            self._save()
+        self._changed("world", (), None)
+
+    def to_dict(self):
+        return self.world
+
+    def _save(self):
+        if self.path:
+            write_json_atomic(self.world, self.path)
+
+    @staticmethod
+    def _fields(node, children):
+        return {key: value for key, value in node.items() if key != children}
+
+
+class SqliteWorldStore(_Listeners):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS nodes (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        parent INTEGER,
+        name TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS nodes_by_parent ON nodes (parent, kind, name);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(self.SCHEMA)
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+
+    def kingdom_names(self):
+        return self._child_names("kingdom", None)
+
+    def kingdom(self, kingdom):
+        return self._node(self._kingdom_id(kingdom))
+
+    def town_names(self, kingdom):
+        return self._child_names("town", self._kingdom_id(kingdom))
+
+    def town(self, kingdom, town):
+        return self._node(self._town_id(kingdom, town))
+
+    def npc_names(self, kingdom, town):
+        return self._child_names("npc", self._town_id(kingdom, town))
+
+    def npc(self, kingdom, town, npc):
+        return self._node(self._id("npc", self._town_id(kingdom, town), npc))
+
+    def put_kingdom(self, kingdom):
+        with self._lock, self._db:
+            self._put("kingdom", None, kingdom, children="towns")
+        self._changed("kingdom", (kingdom["name"],), kingdom)
+
+    def put_town(self, kingdom, town):
+        parent = self._kingdom_id(kingdom)
+        with self._lock, self._db:
+            self._put("town", parent, town, children="npcs")
+        self._changed("town", (kingdom, town["name"]), town)
+
+    def put_npc(self, kingdom, town, npc):
+        parent = self._town_id(kingdom, town)
+        with self._lock, self._db:
+            self._put("npc", parent, npc)
+        self._changed("npc", (kingdom, town, npc["name"]), npc)
+
+    def replace_world(self, world):
+        """Replace everything with a nested world dict, in one transaction."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM nodes")
+            self._db.execute("DELETE FROM meta")
+            for key, value in world.items():
+                if key != "kingdoms":
+                    self._db.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            for kingdom in world.get("kingdoms", {}).values():
+                kingdom_id = self._put("kingdom", None, kingdom, children="towns")
+                for town in kingdom.get("towns", {}).values():
+                    town_id = self._put("town", kingdom_id, town, children="npcs")
+                    for npc in town.get("npcs", {}).values():
+                        self._put("npc", town_id, npc)
+        self._changed("world", (), None)
+
+    def to_dict(self):
+        """The whole world as a nested dict. Reads every node."""
+        with self._lock:
+            meta = self._db.execute("SELECT key, value FROM meta").fetchall()
+            rows = self._db.execute("SELECT id, kind, parent, data FROM nodes ORDER BY id").fetchall()
+        world = {key: json.loads(value) for key, value in meta}
+        world["kingdoms"] = {}
+        children = {}
+        for node_id, kind, parent, data in rows:
+            node = json.loads(data)
+            if kind == "kingdom":
+                node["towns"] = children[node_id] = {}
+                world["kingdoms"][node["name"]] = node
+            elif kind == "town":
+                node["npcs"] = children[node_id] = {}
+                children[parent][node["name"]] = node
+            else:
+                children[parent][node["name"]] = node
+        return world
+
+    def close(self):
+        self._db.close()
+
+    def _put(self, kind, parent, node, children=None):
+        data = {key: value for key, value in node.items() if key != children}
+        row = self._db.execute(
+            "SELECT id FROM nodes WHERE parent IS ? AND kind = ? AND name = ?",
+            (parent, kind, node["name"]),
+        ).fetchone()
+        if row:
+            self._db.execute("UPDATE nodes SET data = ? WHERE id = ?", (json.dumps(data), row[0]))
+            return row[0]
+        cursor = self._db.execute(
+            "INSERT INTO nodes (kind, parent, name, data) VALUES (?, ?, ?, ?)",
+            (kind, parent, node["name"], json.dumps(data)),
+        )
+        return cursor.lastrowid
+
+    def _child_names(self, kind, parent):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT name FROM nodes WHERE parent IS ? AND kind = ? ORDER BY id", (parent, kind)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _id(self, kind, parent, name):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM nodes WHERE parent IS ? AND kind = ? AND name = ?", (parent, kind, name)
+            ).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return row[0]
+
+    def _kingdom_id(self, kingdom):
+        return self._id("kingdom", None, kingdom)
+
+    def _town_id(self, kingdom, town):
+        return self._id("town", self._kingdom_id(kingdom), town)
+
+    def _node(self, node_id):
+        with self._lock:
+            row = self._db.execute("SELECT data FROM nodes WHERE id = ?", (node_id,)).fetchone()
+        return json.loads(row[0])
+
+
+def open_world_store(path):
+    if is_sqlite_path(path):
+        return SqliteWorldStore(path)
+    return JsonWorldStore.load(path)
+
+
+def as_world_store(world):
+    """Accept either a store or a plain world dict."""
+    if isinstance(world, dict):
+        return JsonWorldStore(world)
+    return world
+
+
+@traced("save_world")
+def save_world(world, filename):
+    if is_sqlite_path(filename):
+        with closing(SqliteWorldStore(filename)) as store:
+            store.replace_world(world)
+    else:
+        write_json_atomic(world, filename)
+
+
+@traced("load_world")
+def load_world(filename):
+    if is_sqlite_path(filename):
+        with closing(SqliteWorldStore(filename)) as store:
+            return store.to_dict()
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def migrate_json(json_path, db_path):
+    """Copy a GeneratedWorld.json file into a new SQLite world store."""
+    with open(json_path, "r") as f:
+        world = json.load(f)
+    store = SqliteWorldStore(db_path)
+    store.replace_world(world)
+    return store
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python world_store.py <GeneratedWorld.json> <GeneratedWorld.db>")
+    migrate_json(sys.argv[1], sys.argv[2])
+    print(f"Migrated {sys.argv[1]} to {sys.argv[2]}")